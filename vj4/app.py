@@ -9,12 +9,18 @@ from aiohttp import web
 
 from vj4 import db
 from vj4 import error
+from vj4.model import fleet
+from vj4.model import record as record_model
 from vj4.model import system
+from vj4.model.adaptor import contest as contest_model
+from vj4.model.adaptor import problem as problem_model
 from vj4.service import bus
+from vj4.service import incbuffer
 from vj4.service import smallcache
 from vj4.service import staticmanifest
 from vj4.util import json
 from vj4.util import options
+from vj4.util import projection
 from vj4.util import tools
 
 options.define('debug', default=False, help='Enable debug mode.')
@@ -77,12 +83,20 @@ class Application(web.Application):
 
     # Initialize components.
     staticmanifest.init(static_path)
+    projection.enabled = options.debug
     loop = asyncio.get_event_loop()
     loop.run_until_complete(db.init())
     loop.run_until_complete(system.setup())
     loop.run_until_complete(system.ensure_db_version())
     loop.run_until_complete(asyncio.gather(tools.ensure_all_indexes(), bus.init()))
     smallcache.init()
+    problem_model.init()
+    contest_model.init()
+    self.on_shutdown.append(lambda app: contest_model.shutdown_recalc_executor())
+    record_model.init()
+    incbuffer.init()
+    self.on_shutdown.append(lambda app: incbuffer.uninit())
+    fleet.init()
 
     # Load views.
     from vj4.handler import contest
@@ -127,7 +141,7 @@ def connection_route(prefix, name, global_route=False):
         elif msg.tp == sockjs.MSG_MESSAGE:
           message = json.decode(msg.data)
           if message == WS_MSG_HEARTBEAT:
-            pass
+            await session.on_heartbeat()
           else:
             await session.on_message(**message)
         elif msg.tp == sockjs.MSG_CLOSED:
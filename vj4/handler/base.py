@@ -17,9 +17,9 @@ from vj4.model import blacklist
 from vj4.model import builtin
 from vj4.model import domain
 from vj4.model import fs
+from vj4.model import loader
 from vj4.model import opcount
 from vj4.model import token
-from vj4.model import user
 from vj4.model.adaptor import setting
 from vj4.service import mailer
 from vj4.util import json
@@ -40,6 +40,8 @@ class HandlerBase(setting.SettingMixin):
   locale = locale.get(options.default_locale)
   timezone = None
   user = builtin.USER_GUEST
+  # Effective permissions of the current user in the current domain, computed in prepare().
+  perm_mask = builtin.PERM_NONE
 
   async def prepare(self):
     self.session = await self.update_session()
@@ -48,9 +50,9 @@ class HandlerBase(setting.SettingMixin):
     if 'uid' in self.session:
       uid = self.session['uid']
       self.user, self.domain, self.domain_user, bdoc = await asyncio.gather(
-          user.get_by_uid(uid),
+          self.loader.get_user(uid),
           domain.get(self.domain_id),
-          domain.get_user(self.domain_id, uid),
+          self.loader.get_domain_user(self.domain_id, uid),
           blacklist.get(self.remote_ip))
       if not self.user:
         raise error.UserNotFoundError(uid)
@@ -59,6 +61,7 @@ class HandlerBase(setting.SettingMixin):
     else:
       self.domain, bdoc = await asyncio.gather(
           domain.get(self.domain_id), blacklist.get(self.remote_ip))
+    self.perm_mask = self.get_perm_mask()
     self.view_lang = self.get_setting('view_lang')
     try:
       self.timezone = pytz.timezone(self.get_setting('timezone'))
@@ -71,11 +74,14 @@ class HandlerBase(setting.SettingMixin):
     if not self.GLOBAL and not self.has_priv(builtin.PRIV_VIEW_ALL_DOMAIN):
       self.check_perm(builtin.PERM_VIEW)
 
-  def has_perm(self, perm):
+  def get_perm_mask(self):
+    if self.has_priv(builtin.PRIV_MANAGE_ALL_DOMAIN):
+      return builtin.PERM_ALL
     role = self.domain_user.get('role', builtin.ROLE_DEFAULT)
-    mask = domain.get_all_roles(self.domain).get(role, builtin.PERM_NONE)
-    return ((perm & mask) == perm
-            or self.has_priv(builtin.PRIV_MANAGE_ALL_DOMAIN))
+    return domain.get_all_roles(self.domain).get(role, builtin.PERM_NONE)
+
+  def has_perm(self, perm):
+    return (perm & self.perm_mask) == perm
 
   def check_perm(self, perm):
     if not self.has_perm(perm):
@@ -228,6 +234,7 @@ class Handler(web.View, HandlerBase):
   def __await__(self):
     try:
       self.response = web.Response()
+      self.loader = loader.Loader()
       yield from HandlerBase.prepare(self).__await__()
       yield from super(Handler, self).__await__()
     except asyncio.CancelledError:
@@ -264,9 +271,37 @@ class Handler(web.View, HandlerBase):
     self.response.headers.add('Pragma', 'no-cache')
     self.response.text = json.encode(obj)
 
+  def check_etag(self, etag):
+    """Sets the ETag of the response.
+
+    Returns True if it matches If-None-Match of the request, in which case the status is set
+    to 304 and the handler should return without a body.
+    """
+    etag = '"{0}"'.format(etag)
+    self.response.headers['ETag'] = etag
+    if self.request.headers.get('If-None-Match', '') == etag:
+      self.response.set_status(304, None)
+      return True
+    return False
+
   async def binary(self, data, content_type='application/octet-stream', file_name=None):
+    await self.stream(content_type, file_name, len(data))
+    await self.response.write(data)
+
+  async def stream(self, content_type='application/octet-stream', file_name=None,
+                   content_length=None):
+    """Sends the headers, after which the body is written by self.response.write().
+
+    The body is chunked if content_length is not given. The ETag set by check_etag is kept.
+    """
+    etag = self.response.headers.get('ETag')
     self.response = web.StreamResponse()
-    self.response.content_length = len(data)
+    if etag:
+      self.response.headers['ETag'] = etag
+    if content_length is not None:
+      self.response.content_length = content_length
+    else:
+      self.response.enable_chunked_encoding()
     self.response.content_type = content_type
     if file_name:
       for char in '/<>:\"\'\\|?* ':
@@ -274,7 +309,6 @@ class Handler(web.View, HandlerBase):
       self.response.headers.add('Content-Disposition',
                                 'attachment; filename="{}"'.format(file_name))
     await self.response.prepare(self.request)
-    await self.response.write(data)
 
   @property
   def prefer_json(self):
@@ -345,6 +379,7 @@ class Connection(sockjs.Session, HandlerBase):
   def __init__(self, *args, **kwargs):
     super(Connection, self).__init__(*args, **kwargs)
     self.response = web.Response()  # dummy response
+    self.loader = loader.shared()
 
   async def on_open(self):
     pass
@@ -352,6 +387,9 @@ class Connection(sockjs.Session, HandlerBase):
   async def on_message(self, **kwargs):
     pass
 
+  async def on_heartbeat(self):
+    pass
+
   async def on_close(self):
     pass
 
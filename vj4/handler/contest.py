@@ -1,9 +1,7 @@
 import asyncio
 import calendar
 import datetime
-import io
 import pytz
-import zipfile
 from bson import objectid
 
 from vj4 import app
@@ -19,6 +17,7 @@ from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.handler import base
 from vj4.util import pagination
+from vj4.util import zipstream
 
 
 @app.route('/contest', 'contest_main')
@@ -28,35 +27,38 @@ class ContestMainHandler(contest.ContestMixin, base.Handler):
   @base.require_perm(builtin.PERM_VIEW_CONTEST)
   @base.get_argument
   @base.sanitize
-  async def get(self, *, rule: int=0, page: int=1):
+  async def get(self, *, rule: int=0, page: int=1, cursor: str=''):
     if not rule:
-      tdocs = contest.get_multi(self.domain_id, document.TYPE_CONTEST)
+      query = {}
       qs = ''
     else:
       if rule not in constant.contest.CONTEST_RULES:
         raise error.ValidationError('rule')
-      tdocs = contest.get_multi(self.domain_id, document.TYPE_CONTEST, rule=rule)
+      query = {'rule': rule}
       qs = 'rule={0}'.format(rule)
-    tdocs, tpcount, _ = await pagination.paginate(tdocs, page, self.CONTESTS_PER_PAGE)
+    tdocs, tpcount, _, cursors = await pagination.paginate(
+        contest.get_multi, [('doc_id', -1)], page, self.CONTESTS_PER_PAGE, cursor,
+        fields=contest.PROJECTION_LIST, domain_id=self.domain_id, doc_type=document.TYPE_CONTEST, **query)
     tsdict = await contest.get_dict_status(self.domain_id, self.user['_id'], document.TYPE_CONTEST,
                                           (tdoc['doc_id'] for tdoc in tdocs))
-    self.render('contest_main.html', page=page, tpcount=tpcount, qs=qs, rule=rule,
-                tdocs=tdocs, tsdict=tsdict)
+    self.render('contest_main.html', page=page, tpcount=tpcount, cursors=cursors, qs=qs,
+                rule=rule, tdocs=tdocs, tsdict=tsdict)
 
 
 @app.route('/contest/{tid:\w{24}}', 'contest_detail')
 class ContestDetailHandler(contest.ContestMixin, base.OperationHandler):
   DISCUSSIONS_PER_PAGE = 15
+  RANK_RADIUS = 2
 
   @base.route_argument
   @base.require_perm(builtin.PERM_VIEW_CONTEST)
   @base.get_argument
   @base.sanitize
-  async def get(self, *, tid: objectid.ObjectId, page: int=1):
+  async def get(self, *, tid: objectid.ObjectId, page: int=1, cursor: str=''):
     tdoc = await contest.get(self.domain_id, document.TYPE_CONTEST, tid)
     tsdoc, pdict = await asyncio.gather(
         contest.get_status(self.domain_id, document.TYPE_CONTEST, tdoc['doc_id'], self.user['_id']),
-        problem.get_dict(self.domain_id, tdoc['pids']))
+        problem.get_dict(self.domain_id, tdoc['pids'], fields=problem.PROJECTION_ROW))
     psdict = dict()
     rdict = dict()
     if tsdoc:
@@ -65,19 +67,25 @@ class ContestDetailHandler(contest.ContestMixin, base.OperationHandler):
         psdict[pdetail['pid']] = pdetail
       if self.can_show_record(tdoc):
         rdict = await record.get_dict((psdoc['rid'] for psdoc in psdict.values()),
-                                      get_hidden=True)
+                                      get_hidden=True, fields=record.PROJECTION_LIST)
       else:
         rdict = dict((psdoc['rid'], {'_id': psdoc['rid']}) for psdoc in psdict.values())
     else:
       attended = False
+    if attended:
+      ranked_around, rank_count = await self.get_ranked_around(tdoc, self.user['_id'],
+                                                               self.RANK_RADIUS)
+    else:
+      ranked_around, rank_count = [], 0
     # discussion
-    ddocs, dpcount, dcount = await pagination.paginate(
-        discussion.get_multi(self.domain_id,
-                             parent_doc_type=tdoc['doc_type'],
-                             parent_doc_id=tdoc['doc_id']),
-        page, self.DISCUSSIONS_PER_PAGE)
+    ddocs, dpcount, dcount, cursors = await pagination.paginate(
+        discussion.get_multi, [('update_at', -1), ('doc_id', -1)],
+        page, self.DISCUSSIONS_PER_PAGE, cursor,
+        domain_id=self.domain_id,
+        parent_doc_type=tdoc['doc_type'], parent_doc_id=tdoc['doc_id'])
     uids = set(ddoc['owner_uid'] for ddoc in ddocs)
     uids.add(tdoc['owner_uid'])
+    uids.update(tsdoc['uid'] for _, tsdoc in ranked_around)
     udict = await user.get_dict(uids)
     dudict = await domain.get_dict_user_by_uid(domain_id=self.domain_id, uids=uids)
     path_components = self.build_path(
@@ -85,7 +93,8 @@ class ContestDetailHandler(contest.ContestMixin, base.OperationHandler):
       (tdoc['title'], None))
     self.render('contest_detail.html', tdoc=tdoc, tsdoc=tsdoc, attended=attended, udict=udict,
                 dudict=dudict, pdict=pdict, psdict=psdict, rdict=rdict,
-                ddocs=ddocs, page=page, dpcount=dpcount, dcount=dcount,
+                ranked_around=ranked_around, rank_count=rank_count,
+                ddocs=ddocs, page=page, dpcount=dpcount, dcount=dcount, cursors=cursors,
                 datetime_stamp=self.datetime_stamp,
                 page_title=tdoc['title'], path_components=path_components)
 
@@ -110,23 +119,17 @@ class ContestCodeHandler(base.OperationHandler):
   @base.require_perm(builtin.PERM_READ_RECORD_CODE)
   @base.sanitize
   async def get(self, *, tid: objectid.ObjectId):
-    tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, document.TYPE_CONTEST, tid)
+    tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, document.TYPE_CONTEST, tid,
+                                                     contest.PROJECTION_SCOREBOARD)
     rnames = {}
     for tsdoc in tsdocs:
       for pdetail in tsdoc.get('detail', []):
         rnames[pdetail['rid']] = 'U{}_P{}_R{}'.format(tsdoc['uid'], pdetail['pid'], pdetail['rid'])
-    output_buffer = io.BytesIO()
-    zip_file = zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED)
-    rdocs = record.get_multi(get_hidden=True, _id={'$in': list(rnames.keys())})
-    async for rdoc in rdocs:
-      zip_file.writestr(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code'])
-    # mark all files as created in Windows :p
-    for zfile in zip_file.filelist:
-      zfile.create_system = 0
-    zip_file.close()
-
-    await self.binary(output_buffer.getvalue(), 'application/zip',
-                      file_name='{}.zip'.format(tdoc['title']))
+    await self.stream('application/zip', file_name='{}.zip'.format(tdoc['title']))
+    zip_writer = zipstream.ZipWriter(self.response)
+    async for rdoc in record.get_multi_code(list(rnames.keys())):
+      await zip_writer.writestr(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code'])
+    await zip_writer.close()
 
 
 @app.route('/contest/{tid}/{pid:-?\d+|\w{24}}', 'contest_detail_problem')
@@ -141,8 +144,8 @@ class ContestDetailProblemHandler(contest.ContestMixin, base.Handler):
                                       problem.get(self.domain_id, pid, uid))
     tsdoc, udoc, dudoc = await asyncio.gather(
         contest.get_status(self.domain_id, document.TYPE_CONTEST, tdoc['doc_id'], self.user['_id']),
-        user.get_by_uid(tdoc['owner_uid']),
-        domain.get_user(domain_id=self.domain_id, uid=tdoc['owner_uid']))
+        self.loader.get_user(tdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, tdoc['owner_uid']))
     attended = tsdoc and tsdoc.get('attend') == 1
     if not self.is_done(tdoc):
       if not attended:
@@ -172,7 +175,7 @@ class ContestDetailProblemSubmitHandler(contest.ContestMixin, base.Handler):
                                       problem.get(self.domain_id, pid, uid))
     tsdoc, udoc = await asyncio.gather(
         contest.get_status(self.domain_id, document.TYPE_CONTEST, tdoc['doc_id'], self.user['_id']),
-        user.get_by_uid(tdoc['owner_uid']))
+        self.loader.get_user(tdoc['owner_uid']))
     attended = tsdoc and tsdoc.get('attend') == 1
     if not attended:
       raise error.ContestNotAttendedError(tdoc['doc_id'])
@@ -233,18 +236,28 @@ class ContestDetailProblemSubmitHandler(contest.ContestMixin, base.Handler):
 @app.route('/contest/{tid}/scoreboard', 'contest_scoreboard')
 class ContestScoreboardHandler(contest.ContestMixin, base.Handler):
   @base.route_argument
+  @base.get_argument
   @base.require_perm(builtin.PERM_VIEW_CONTEST)
   @base.require_perm(builtin.PERM_VIEW_CONTEST_SCOREBOARD)
   @base.sanitize
-  async def get(self, *, tid: objectid.ObjectId):
-    tdoc, rows, udict = await self.get_scoreboard(document.TYPE_CONTEST, tid)
+  async def get(self, *, tid: objectid.ObjectId, begin: int=0, end: int=0, freeze_at: int=0):
+    board = await self.get_visible_board(document.TYPE_CONTEST, tid)
+    tdoc = board.tdoc
+    freeze_at = self.get_freeze_at(tdoc, freeze_at)
+    if self.prefer_json:
+      if self.check_etag(self.get_scoreboard_etag(board, freeze_at, begin, end)):
+        return
+      rows = await self.get_scoreboard(board, False, begin, end or None, freeze_at)
+      self.json({'rows': rows, 'total': len(board)})
+      self.response.headers['Cache-Control'] = 'no-cache'
+      return
+    rows = await self.get_scoreboard(board, False, begin, end or None, freeze_at)
     page_title = self.translate('contest_scoreboard')
     path_components = self.build_path(
         (self.translate('contest_main'), self.reverse_url('contest_main')),
         (tdoc['title'], self.reverse_url('contest_detail', tid=tdoc['doc_id'])),
         (page_title, None))
-    dudict = await domain.get_dict_user_by_uid(domain_id=self.domain_id, uids=udict.keys())
-    self.render('contest_scoreboard.html', tdoc=tdoc, rows=rows, dudict=dudict,
+    self.render('contest_scoreboard.html', tdoc=tdoc, rows=rows, freeze_at=freeze_at,
                 page_title=page_title, path_components=path_components)
 
 
@@ -260,17 +273,23 @@ class ContestScoreboardDownloadHandler(contest.ContestMixin, base.Handler):
     return self.render_html('contest_scoreboard_download_html.html', rows=rows).encode()
 
   @base.route_argument
+  @base.get_argument
   @base.require_perm(builtin.PERM_VIEW_CONTEST)
   @base.require_perm(builtin.PERM_VIEW_CONTEST_SCOREBOARD)
   @base.sanitize
-  async def get(self, *, tid: objectid.ObjectId, ext: str):
+  async def get(self, *, tid: objectid.ObjectId, ext: str, freeze_at: int=0):
     get_status_content = {
       'csv': self._export_status_as_csv,
       'html': self._export_status_as_html,
     }
     if ext not in get_status_content:
       raise error.ValidationError('ext')
-    tdoc, rows, udict = await self.get_scoreboard(document.TYPE_CONTEST, tid, True)
+    board = await self.get_visible_board(document.TYPE_CONTEST, tid)
+    tdoc = board.tdoc
+    freeze_at = self.get_freeze_at(tdoc, freeze_at)
+    if self.check_etag(self.get_scoreboard_etag(board, freeze_at, ext)):
+      return
+    rows = await self.get_scoreboard(board, True, freeze_at=freeze_at)
     data = get_status_content[ext](rows)
     file_name = tdoc['title']
     await self.binary(data, file_name='{}.{}'.format(file_name, ext))
@@ -31,18 +31,20 @@ class DiscussionMainHandler(base.Handler):
   @base.require_perm(builtin.PERM_VIEW_DISCUSSION)
   @base.get_argument
   @base.sanitize
-  async def get(self, *, page: int=1):
-    # TODO(iceboy): continuation based pagination.
-    nodes, (ddocs, dpcount, _) = await asyncio.gather(
+  async def get(self, *, page: int=1, cursor: str=''):
+    nodes, (ddocs, dpcount, _, cursors) = await asyncio.gather(
         discussion.get_nodes(self.domain_id),
         # TODO(twd2): exclude problem/contest discussions?
-        pagination.paginate(discussion.get_multi(self.domain_id), page, self.DISCUSSIONS_PER_PAGE))
+        pagination.paginate(discussion.get_multi, [('update_at', -1), ('doc_id', -1)],
+                            page, self.DISCUSSIONS_PER_PAGE, cursor,
+                            count_func=discussion.count, domain_id=self.domain_id))
     udict, dudict, vndict = await asyncio.gather(
         user.get_dict(ddoc['owner_uid'] for ddoc in ddocs),
         domain.get_dict_user_by_uid(domain_id=self.domain_id, uids=(ddoc['owner_uid'] for ddoc in ddocs)),
         discussion.get_dict_vnodes(self.domain_id, map(discussion.node_id, ddocs)))
     self.render('discussion_main_or_node.html', discussion_nodes=nodes, ddocs=ddocs,
-                udict=udict, dudict=dudict, vndict=vndict, page=page, dpcount=dpcount)
+                udict=udict, dudict=dudict, vndict=vndict, page=page, dpcount=dpcount,
+                cursors=cursors)
 
 
 @app.route('/discuss/{doc_type:-?\d+}/{doc_id}', 'discussion_node_document_as_node')
@@ -54,7 +56,7 @@ class DiscussionNodeHandler(contest.ContestStatusMixin, base.Handler):
   @base.get_argument
   @base.route_argument
   @base.sanitize
-  async def get(self, *, doc_type: int=None, doc_id: str, page: int=1):
+  async def get(self, *, doc_type: int=None, doc_id: str, page: int=1, cursor: str=''):
     if doc_type is None:
       node_or_dtuple = doc_id
     else:
@@ -65,12 +67,11 @@ class DiscussionNodeHandler(contest.ContestStatusMixin, base.Handler):
     if vnode['doc_type'] == document.TYPE_PROBLEM and vnode.get('hidden', False):
       self.check_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)
     # TODO(twd2): do more visibility check eg. contest
-    # TODO(iceboy): continuation based pagination.
-    ddocs, dpcount, _ = await pagination.paginate(
-        discussion.get_multi(self.domain_id,
-                             parent_doc_type=vnode['doc_type'],
-                             parent_doc_id=vnode['doc_id']),
-        page, self.DISCUSSIONS_PER_PAGE)
+    ddocs, dpcount, _, cursors = await pagination.paginate(
+        discussion.get_multi, [('update_at', -1), ('doc_id', -1)],
+        page, self.DISCUSSIONS_PER_PAGE, cursor,
+        domain_id=self.domain_id,
+        parent_doc_type=vnode['doc_type'], parent_doc_id=vnode['doc_id'])
     uids = set(ddoc['owner_uid'] for ddoc in ddocs)
     if 'owner_uid' in vnode:
       uids.add(vnode['owner_uid'])
@@ -82,8 +83,8 @@ class DiscussionNodeHandler(contest.ContestStatusMixin, base.Handler):
         (self.translate('discussion_main'), self.reverse_url('discussion_main')),
         (vnode['title'], None))
     self.render('discussion_main_or_node.html', discussion_nodes=nodes, vnode=vnode, ddocs=ddocs,
-                udict=udict, dudict=dudict, vndict=vndict, page=page, dpcount=dpcount, **vncontext,
-                path_components=path_components)
+                udict=udict, dudict=dudict, vndict=vndict, page=page, dpcount=dpcount,
+                cursors=cursors, **vncontext, path_components=path_components)
 
 
 @app.route('/discuss/{doc_type:-?\d+}/{doc_id}/create', 'discussion_create_document_as_node')
@@ -146,16 +147,17 @@ class DiscussionDetailHandler(base.OperationHandler):
   @base.get_argument
   @base.route_argument
   @base.sanitize
-  async def get(self, *, did: document.convert_doc_id, page: int=1):
+  async def get(self, *, did: document.convert_doc_id, page: int=1, cursor: str=''):
     ddoc = await discussion.inc_views(self.domain_id, did)
     if self.has_priv(builtin.PRIV_USER_PROFILE):
       dsdoc = await discussion.get_status(self.domain_id, ddoc['doc_id'], self.user['_id'])
     else:
       dsdoc = None
-    vnode, (drdocs, pcount, drcount) = await asyncio.gather(
+    vnode, (drdocs, pcount, drcount, cursors) = await asyncio.gather(
         discussion.get_vnode(self.domain_id, discussion.node_id(ddoc)),
-        pagination.paginate(discussion.get_multi_reply(self.domain_id, ddoc['doc_id']),
-                            page, self.REPLIES_PER_PAGE))
+        pagination.paginate(discussion.get_multi_reply, [('doc_id', -1)],
+                            page, self.REPLIES_PER_PAGE, cursor,
+                            domain_id=self.domain_id, did=ddoc['doc_id']))
     if not vnode:
       vnode = builtin.VNODE_MISSING
     elif vnode['doc_type'] == document.TYPE_PROBLEM and vnode.get('hidden', False):
@@ -176,7 +178,7 @@ class DiscussionDetailHandler(base.OperationHandler):
         (ddoc['title'], None))
     self.render('discussion_detail.html', page_title=ddoc['title'], path_components=path_components,
                 ddoc=ddoc, dsdoc=dsdoc, drdocs=drdocs, page=page, pcount=pcount, drcount=drcount,
-                vnode=vnode, udict=udict, dudict=dudict)
+                cursors=cursors, vnode=vnode, udict=udict, dudict=dudict)
 
   @base.require_priv(builtin.PRIV_USER_PROFILE)
   @base.require_perm(builtin.PERM_REPLY_DISCUSSION)
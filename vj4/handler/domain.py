@@ -10,6 +10,7 @@ from vj4 import constant
 from vj4.model import builtin
 from vj4.model import document
 from vj4.model import domain
+from vj4.model import record
 from vj4.model import user
 from vj4.model.adaptor import discussion
 from vj4.model.adaptor import contest
@@ -30,42 +31,25 @@ class DomainMainHandler(contest.ContestStatusMixin, base.Handler):
 
   async def prepare_contest(self):
     if self.has_perm(builtin.PERM_VIEW_CONTEST):
-      tdocs = await contest.get_multi(self.domain_id, document.TYPE_CONTEST) \
-                           .limit(self.CONTESTS_ON_MAIN) \
-                           .to_list()
-      tsdict = await contest.get_dict_status(self.domain_id, self.user['_id'],
-                                             document.TYPE_CONTEST,
-                                             (tdoc['doc_id'] for tdoc in tdocs))
-    else:
-      tdocs = []
-      tsdict = {}
-    return tdocs, tsdict
+      return await contest.get_multi(self.domain_id, document.TYPE_CONTEST) \
+                          .limit(self.CONTESTS_ON_MAIN) \
+                          .to_list()
+    return []
 
   async def prepare_homework(self):
     if self.has_perm(builtin.PERM_VIEW_HOMEWORK):
-      tdocs = await contest.get_multi(self.domain_id, document.TYPE_HOMEWORK) \
-                           .limit(self.HOMEWORK_ON_MAIN) \
-                           .to_list()
-      tsdict = await contest.get_dict_status(self.domain_id, self.user['_id'],
-                                             document.TYPE_HOMEWORK,
-                                             (tdoc['doc_id'] for tdoc in tdocs))
-    else:
-      tdocs = []
-      tsdict = {}
-    return tdocs, tsdict
+      return await contest.get_multi(self.domain_id, document.TYPE_HOMEWORK) \
+                          .limit(self.HOMEWORK_ON_MAIN) \
+                          .to_list()
+    return []
 
   async def prepare_training(self):
     if self.has_perm(builtin.PERM_VIEW_TRAINING):
-      tdocs = await training.get_multi(self.domain_id) \
-                            .sort('doc_id', 1) \
-                            .limit(self.TRAININGS_ON_MAIN) \
-                            .to_list()
-      tsdict = await training.get_dict_status(self.domain_id, self.user['_id'],
-                                              (tdoc['doc_id'] for tdoc in tdocs))
-    else:
-      tdocs = []
-      tsdict = {}
-    return tdocs, tsdict
+      return await training.get_multi(self.domain_id) \
+                           .sort('doc_id', 1) \
+                           .limit(self.TRAININGS_ON_MAIN) \
+                           .to_list()
+    return []
 
   async def prepare_discussion(self):
     if self.has_perm(builtin.PERM_VIEW_DISCUSSION):
@@ -79,13 +63,20 @@ class DomainMainHandler(contest.ContestStatusMixin, base.Handler):
     return ddocs, vndict
 
   async def get(self):
-    (tdocs, tsdict), (htdocs, htsdict),\
-    (trdocs, trsdict), (ddocs, vndict) = await asyncio.gather(
+    tdocs, htdocs, trdocs, (ddocs, vndict) = await asyncio.gather(
         self.prepare_contest(), self.prepare_homework(),
         self.prepare_training(), self.prepare_discussion())
-    udict, dudict = await asyncio.gather(
+    sdict, udict, dudict = await asyncio.gather(
+        document.get_dict_status_multi(
+            self.domain_id, self.user['_id'],
+            [(document.TYPE_CONTEST, (tdoc['doc_id'] for tdoc in tdocs)),
+             (document.TYPE_HOMEWORK, (tdoc['doc_id'] for tdoc in htdocs)),
+             (document.TYPE_TRAINING, (tdoc['doc_id'] for tdoc in trdocs))]),
         user.get_dict(ddoc['owner_uid'] for ddoc in ddocs),
         domain.get_dict_user_by_uid(self.domain_id, (ddoc['owner_uid'] for ddoc in ddocs)))
+    tsdict = sdict[document.TYPE_CONTEST]
+    htsdict = sdict[document.TYPE_HOMEWORK]
+    trsdict = sdict[document.TYPE_TRAINING]
     self.render('domain_main.html', discussion_nodes=await discussion.get_nodes(self.domain_id),
                 tdocs=tdocs, tsdict=tsdict,
                 htdocs=htdocs, htsdict=htsdict,
@@ -113,14 +104,18 @@ class DomainDashboardHandler(base.Handler):
 class DomainEditHandler(base.Handler):
   @base.require_perm(builtin.PERM_EDIT_DESCRIPTION)
   async def get(self):
-    self.render('domain_manage_edit.html')
+    self.render('domain_manage_edit.html', dedup_policies=record.DEDUP_POLICY_RANGE.items())
 
   @base.require_perm(builtin.PERM_EDIT_DESCRIPTION)
   @base.post_argument
   @base.require_csrf_token
   @base.sanitize
-  async def post(self, *, name: str, gravatar: str, bulletin: str):
-    await domain.edit(self.domain_id, name=name, gravatar=gravatar, bulletin=bulletin)
+  async def post(self, *, name: str, gravatar: str, bulletin: str,
+                 dedup_policy: int=record.DEDUP_POLICY_NONE):
+    if dedup_policy not in record.DEDUP_POLICY_RANGE:
+      raise error.ValidationError('dedup_policy')
+    await domain.edit(self.domain_id, name=name, gravatar=gravatar, bulletin=bulletin,
+                      dedup_policy=dedup_policy)
     self.json_or_redirect(self.url)
 
 
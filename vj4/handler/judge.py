@@ -11,6 +11,7 @@ from vj4.handler import base
 from vj4.model import builtin
 from vj4.model import document
 from vj4.model import domain
+from vj4.model import fleet
 from vj4.model import record
 from vj4.model import user
 from vj4.model.adaptor import contest
@@ -19,6 +20,14 @@ from vj4.model.adaptor import setting
 from vj4.service import bus
 from vj4.service import queue
 from vj4.util import locale
+from vj4.util import options
+
+options.define('judge_next_flush_ms', default=100,
+               help='Milliseconds to coalesce judge progress updates of a record.')
+options.define('judge_max_concurrency', default=64,
+               help='Maximum number of records dispatched to a judge at once.')
+options.define('judge_datalist_max_limit', default=1000,
+               help='Maximum number of entries in a page of the judge data list.')
 
 _logger = logging.getLogger(__name__)
 
@@ -42,7 +51,6 @@ async def _send_ac_mail(handler, rdoc):
 
 async def _post_judge(handler, rdoc):
   accept = rdoc['status'] == constant.record.STATUS_ACCEPTED
-  bus.publish_throttle('record_change', rdoc, rdoc['_id'])
   post_coros = list()
   # TODO(twd2): ignore no effect statuses like system error, ...
   if rdoc['type'] == constant.record.TYPE_SUBMISSION:
@@ -58,12 +66,15 @@ async def _post_judge(handler, rdoc):
                                      rdoc['_id'], rdoc['status']):
         if accept:
           # TODO(twd2): enqueue rdoc['pid'] to recalculate rp.
-          await problem.inc(rdoc['domain_id'], rdoc['pid'], 'num_accept', 1)
-          post_coros.append(domain.inc_user(rdoc['domain_id'], rdoc['uid'], num_accept=1))
-    else:
+          await problem.inc_buffered(rdoc['domain_id'], rdoc['pid'], 'num_accept', 1)
+          post_coros.append(domain.inc_user_buffered(rdoc['domain_id'], rdoc['uid'],
+                                                     num_accept=1))
+    elif not rdoc.get('rejudge_job'):
       # TODO(twd2): enqueue rdoc['pid'] to recalculate rp.
       await job.record.user_in_problem(rdoc['uid'], rdoc['domain_id'], rdoc['pid'])
-    post_coros.append(job.difficulty.update_problem(rdoc['domain_id'], rdoc['pid']))
+    # Records of a rejudge job are recalculated by the job when all of them are judged.
+    if not rdoc.get('rejudge_job'):
+      post_coros.append(job.difficulty.update_problem(rdoc['domain_id'], rdoc['pid']))
   await asyncio.gather(*post_coros)
 
 
@@ -82,22 +93,46 @@ class JudgeNoopHandler(base.Handler):
     self.json({})
 
 
+@app.route('/judge/fleet', 'judge_fleet')
+class JudgeFleetHandler(base.Handler):
+  @base.require_priv(builtin.PRIV_VIEW_JUDGE_STATISTICS)
+  async def get(self):
+    self.json({'judges': await fleet.get_all()})
+
+
 @app.route('/judge/datalist', 'judge_datalist')
 class JudgeDataListHandler(base.Handler):
   @base.get_argument
   @base.sanitize
-  async def get(self, last: int=0):
+  async def get(self, last: int=0, limit: int=0,
+                after_at: int=0, after: objectid.ObjectId=None):
+    """Lists the data changed since last.
+
+    The list is paged only if the judge passes limit or a cursor. When the response has a
+    cursor, the judge fetches the next page with the same last and the cursor, and uses the time
+    of the first page as the next last.
+    """
     # TODO(iceboy): This function looks strange.
     # Judge will have PRIV_READ_PROBLEM_DATA,
     # domain administrator will have PERM_READ_PROBLEM_DATA.
     if not self.has_priv(builtin.PRIV_READ_PROBLEM_DATA):
       self.check_perm(builtin.PERM_READ_PROBLEM_DATA)
-    pids = await problem.get_data_list(last)
+    # Taken before the query, so that the data uploaded during the query is listed next time.
+    now = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+    if limit > 0 or after_at:
+      if limit <= 0 or limit > options.judge_datalist_max_limit:
+        limit = options.judge_datalist_max_limit
+    else:
+      # Judges which do not know the cursor get the full list.
+      limit = 0
+    mdocs, cursor = await problem.get_data_list(last, limit, after_at, after)
     datalist = []
-    for domain_id, pid in pids:
-      datalist.append({'domain_id': domain_id, 'pid': pid})
-    self.json({'pids': datalist,
-               'time': calendar.timegm(datetime.datetime.utcnow().utctimetuple())})
+    for mdoc in mdocs:
+      datalist.append({'domain_id': mdoc['domain_id'], 'pid': mdoc['pid'], 'md5': mdoc['md5']})
+    response = {'pids': datalist, 'time': now}
+    if cursor:
+      response['after_at'], response['after'] = cursor
+    self.json(response)
 
 
 # TODO(iceboy): Move this to RecordCancelHandler.
@@ -135,73 +170,137 @@ class JudgeScoreHandler(base.Handler):
 
 @app.connection_route('/judge/consume-conn', 'judge_consume-conn')
 class JudgeNotifyConnection(base.Connection):
+  """Dispatches records to a judge.
+
+  The judge advertises the number of records it judges in parallel with the concurrency
+  argument, and may change it later with a capacity message. A record is acknowledged only when
+  it is judged, so the judge never has more records than its concurrency.
+  """
   @base.require_priv(builtin.PRIV_READ_RECORD_CODE | builtin.PRIV_WRITE_RECORD)
-  async def on_open(self):
+  @base.get_argument
+  @base.sanitize
+  async def on_open(self, *, concurrency: int=0):
     self.rids = {}  # delivery_tag -> rid
+    self.next_updates = {}  # rid -> coalesced update
+    self.next_timers = {}  # rid -> timer handle
+    self.next_lock = asyncio.Lock()
+    self.heartbeat_at = asyncio.get_event_loop().time()
+    self.concurrency = self._clamp_concurrency(concurrency)
+    await fleet.add(self.id, self.user['_id'], self.remote_ip)
+    await fleet.set_concurrency(self.id, self.concurrency)
     bus.subscribe(self.on_problem_data_change, ['problem_data_change'])
-    self.channel = await queue.consume('judge', self._on_queue_message)
+    self.channel = await queue.consume('judge', self._on_queue_message, self.concurrency)
     asyncio.ensure_future(self.channel.close_event.wait()).add_done_callback(lambda _: self.close())
 
+  @staticmethod
+  def _clamp_concurrency(concurrency):
+    if concurrency <= 0:
+      return options.queue_prefetch
+    return min(concurrency, options.judge_max_concurrency)
+
   async def on_problem_data_change(self, e):
     domain_id_pid = dict(e['value'])
     self.send(event=e['key'], **domain_id_pid)
 
-  async def _on_queue_message(self, tag, *, rid):
+  async def _on_queue_message(self, tag, *, rid, enqueue_at=None):
     rdoc = await record.begin_judge(rid, self.user['_id'], self.id,
-                                    constant.record.STATUS_FETCHED)
+                                    constant.record.STATUS_FETCHED, enqueue_at)
+    if rdoc and rdoc.get('reuse_rid'):
+      # A duplicate of a judged record, completed without the judge.
+      reused_rdoc = await record.reuse_judge(rdoc, self.user['_id'], self.id)
+      if reused_rdoc:
+        await asyncio.gather(queue.ack(self.channel, tag), _post_judge(self, reused_rdoc))
+        return
     if rdoc:
       self.rids[tag] = rdoc['_id']
+      await fleet.begin_judge(self.id, rdoc.get('wait_ms', 0))
       self.send(rid=str(rdoc['_id']), tag=tag, pid=str(rdoc['pid']), domain_id=rdoc['domain_id'],
                 lang=rdoc['lang'], code=rdoc['code'], type=rdoc['type'])
-      bus.publish_throttle('record_change', rdoc, rdoc['_id'])
     else:
-      # Record not found, eat it.
-      await self.channel.basic_client_ack(tag)
-
-  async def on_message(self, *, key, tag, **kwargs):
-    if key == 'next':
-      rid = self.rids[tag]
-      update = {}
-      if 'status' in kwargs:
-        update.setdefault('$set', {})['status'] = int(kwargs['status'])
-      if 'compiler_text' in kwargs:
-        update.setdefault('$push', {})['compiler_texts'] = str(kwargs['compiler_text'])
-      if 'judge_text' in kwargs:
-        update.setdefault('$push', {})['judge_texts'] = str(kwargs['judge_text'])
-      if 'case' in kwargs:
-        update.setdefault('$push', {})['cases'] = {
-          'status': int(kwargs['case']['status']),
-          'score': int(kwargs['case']['score']),
-          'time_ms': int(kwargs['case']['time_ms']),
-          'memory_kb': int(kwargs['case']['memory_kb']),
-          'judge_text': str(kwargs['case']['judge_text']),
-        }
-      if 'progress' in kwargs:
-        update.setdefault('$set', {})['progress'] = float(kwargs['progress'])
-      rdoc = await record.next_judge(rid, self.user['_id'], self.id, **update)
-      if not rdoc:
-        return
-      bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+      # Record not found or not waiting, e.g. a stale delivery of a requeued record, eat it.
+      await queue.ack(self.channel, tag)
+
+  def _add_next(self, rid, kwargs):
+    """Merges a next message into the pending update of the record."""
+    update = self.next_updates.setdefault(rid, {})
+    if 'status' in kwargs:
+      update.setdefault('$set', {})['status'] = int(kwargs['status'])
+    pushes = []
+    if 'compiler_text' in kwargs:
+      pushes.append(('compiler_texts', str(kwargs['compiler_text'])))
+    if 'judge_text' in kwargs:
+      pushes.append(('judge_texts', str(kwargs['judge_text'])))
+    if 'case' in kwargs:
+      pushes.append(('cases', {
+        'status': int(kwargs['case']['status']),
+        'score': int(kwargs['case']['score']),
+        'time_ms': int(kwargs['case']['time_ms']),
+        'memory_kb': int(kwargs['case']['memory_kb']),
+        'judge_text': str(kwargs['case']['judge_text']),
+      }))
+    for field, value in pushes:
+      update.setdefault('$push', {}).setdefault(field, {'$each': []})['$each'].append(value)
+    if 'progress' in kwargs:
+      update.setdefault('$set', {})['progress'] = float(kwargs['progress'])
+    if rid not in self.next_timers:
+      self.next_timers[rid] = asyncio.get_event_loop().call_later(
+          options.judge_next_flush_ms / 1000,
+          lambda: asyncio.ensure_future(self._flush_next(rid)))
+
+  async def _flush_next(self, rid):
+    """Writes the pending update of the record.
+
+    Writes are serialized by the lock, so an update is never written after a later one, and
+    the pending update is fully written when this returns.
+    """
+    timer = self.next_timers.pop(rid, None)
+    if timer:
+      timer.cancel()
+    async with self.next_lock:
+      update = self.next_updates.pop(rid, None)
+      if update:
+        await record.next_judge(rid, self.user['_id'], self.id, **update)
+
+  async def on_message(self, *, key, tag=None, **kwargs):
+    # Messages also keep the judge alive, at most one heartbeat per sweep interval.
+    if asyncio.get_event_loop().time() - self.heartbeat_at >= options.judge_sweep_interval:
+      await self.on_heartbeat()
+    if key == 'capacity':
+      concurrency = self._clamp_concurrency(int(kwargs['concurrency']))
+      if concurrency != self.concurrency:
+        self.concurrency = concurrency
+        await asyncio.gather(queue.set_prefetch(self.channel, concurrency),
+                             fleet.set_concurrency(self.id, concurrency))
+    elif key == 'next':
+      self._add_next(self.rids[tag], kwargs)
     elif key == 'end':
       rid = self.rids.pop(tag)
+      await self._flush_next(rid)
       rdoc, _ = await asyncio.gather(record.end_judge(rid, self.user['_id'], self.id,
                                                       int(kwargs['status']),
                                                       int(kwargs['score']),
                                                       int(kwargs['time_ms']),
                                                       int(kwargs['memory_kb'])),
-                                     self.channel.basic_client_ack(tag))
+                                     queue.ack(self.channel, tag))
       if not rdoc:
+        # Requeued by the sweeper.
+        await fleet.end_judge(self.id)
         return
-      await _post_judge(self, rdoc)
+      judge_ms = int((datetime.datetime.utcnow() - rdoc['judge_at']).total_seconds() * 1000)
+      await asyncio.gather(fleet.end_judge(self.id, judge_ms), _post_judge(self, rdoc))
+
+  async def on_heartbeat(self):
+    self.heartbeat_at = asyncio.get_event_loop().time()
+    await fleet.heartbeat(self.id)
 
   async def on_close(self):
     async def close():
       async def reset_record(rid):
-        rdoc = await record.end_judge(rid, self.user['_id'], self.id,
-                                      constant.record.STATUS_WAITING, 0, 0, 0)
-        bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+        await self._flush_next(rid)
+        await record.end_judge(rid, self.user['_id'], self.id,
+                               constant.record.STATUS_WAITING, 0, 0, 0)
 
       await asyncio.gather(*[reset_record(rid) for rid in self.rids.values()])
-      await self.channel.close()
+      await asyncio.gather(fleet.delete(self.id), self.channel.close())
 
     asyncio.get_event_loop().create_task(close())
@@ -13,15 +13,14 @@ from vj4 import job
 from vj4.handler import base
 from vj4.handler import record as record_handler
 from vj4.model import builtin
+from vj4.model import container
 from vj4.model import user
 from vj4.model import document
 from vj4.model import domain
 from vj4.model import fs
 from vj4.model import oplog
 from vj4.model import record
-from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
-from vj4.model.adaptor import training
 from vj4.service import bus
 from vj4.util import pagination
 from vj4.util import options
@@ -29,14 +28,14 @@ from vj4.util import misc
 
 
 async def render_or_json_problem_list(self, page, ppcount, pcount, pdocs,
-                                      category, psdict, **kwargs):
+                                      category, psdict, cursors, **kwargs):
   if 'page_title' not in kwargs:
     kwargs['page_title'] = self.translate(self.TITLE)
   if 'path_components' not in kwargs:
     kwargs['path_components'] = self.build_path((self.translate(self.NAME), None))
   if self.prefer_json:
     list_html = self.render_html('partials/problem_list.html', page=page, ppcount=ppcount,
-                                 pcount=pcount, pdocs=pdocs, psdict=psdict)
+                                 pcount=pcount, pdocs=pdocs, psdict=psdict, cursors=cursors)
     stat_html = self.render_html('partials/problem_stat.html', pcount=pcount)
     lucky_html = self.render_html('partials/problem_lucky.html', category=category)
     path_html = self.render_html('partials/path.html', path_components=kwargs['path_components'])
@@ -48,7 +47,7 @@ async def render_or_json_problem_list(self, page, ppcount, pcount, pdocs,
   else:
     self.render('problem_main.html', page=page, ppcount=ppcount, pcount=pcount, pdocs=pdocs,
                 category=category, psdict=psdict, categories=problem.get_categories(),
-                **kwargs)
+                cursors=cursors, **kwargs)
 
 
 @app.route('/p', 'problem_main')
@@ -58,16 +57,14 @@ class ProblemMainHandler(base.OperationHandler):
   @base.require_perm(builtin.PERM_VIEW_PROBLEM)
   @base.get_argument
   @base.sanitize
-  async def get(self, *, page: int=1):
-    # TODO(iceboy): projection.
+  async def get(self, *, page: int=1, cursor: str=''):
     if not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN):
       f = {'hidden': False}
     else:
       f = {}
-    pdocs, ppcount, pcount = await pagination.paginate(problem.get_multi(domain_id=self.domain_id,
-                                                                         **f) \
-                                                              .sort([('doc_id', 1)]),
-                                                       page, self.PROBLEMS_PER_PAGE)
+    pdocs, ppcount, pcount, cursors = await pagination.paginate(
+        problem.get_multi, [('doc_id', 1)], page, self.PROBLEMS_PER_PAGE, cursor,
+        fields=problem.PROJECTION_LIST, count_func=problem.count, domain_id=self.domain_id, **f)
     if self.has_priv(builtin.PRIV_USER_PROFILE):
       # TODO(iceboy): projection.
       psdict = await problem.get_dict_status(self.domain_id,
@@ -76,7 +73,7 @@ class ProblemMainHandler(base.OperationHandler):
     else:
       psdict = None
     await render_or_json_problem_list(self, page=page, ppcount=ppcount, pcount=pcount,
-                                      pdocs=pdocs, category='', psdict=psdict)
+                                      pdocs=pdocs, category='', psdict=psdict, cursors=cursors)
 
   @base.require_priv(builtin.PRIV_USER_PROFILE)
   @base.require_csrf_token
@@ -138,18 +135,15 @@ class ProblemCategoryHandler(base.OperationHandler):
   @base.get_argument
   @base.route_argument
   @base.sanitize
-  async def get(self, *, category: str, page: int=1):
-    # TODO(iceboy): projection.
+  async def get(self, *, category: str, page: int=1, cursor: str=''):
     if not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN):
       f = {'hidden': False}
     else:
       f = {}
     query = ProblemCategoryHandler.build_query(category)
-    pdocs, ppcount, pcount = await pagination.paginate(problem.get_multi(domain_id=self.domain_id,
-                                                                         **query,
-                                                                         **f) \
-                                                              .sort([('doc_id', 1)]),
-                                                       page, self.PROBLEMS_PER_PAGE)
+    pdocs, ppcount, pcount, cursors = await pagination.paginate(
+        problem.get_multi, [('doc_id', 1)], page, self.PROBLEMS_PER_PAGE, cursor,
+        fields=problem.PROJECTION_LIST, domain_id=self.domain_id, **query, **f)
     if self.has_priv(builtin.PRIV_USER_PROFILE):
       # TODO(iceboy): projection.
       psdict = await problem.get_dict_status(self.domain_id,
@@ -163,7 +157,8 @@ class ProblemCategoryHandler(base.OperationHandler):
         (page_title, None))
     await render_or_json_problem_list(self, page=page, ppcount=ppcount, pcount=pcount,
                                       pdocs=pdocs, category=category, psdict=psdict,
-                                      page_title=page_title, path_components=path_components)
+                                      cursors=cursors, page_title=page_title,
+                                      path_components=path_components)
 
 
 @app.route('/p/category/{category:[^/]*}/random', 'problem_category_random')
@@ -187,20 +182,25 @@ class ProblemCategoryRandomHandler(base.Handler):
 
 @app.route('/p/{pid:-?\d+|\w{24}}', 'problem_detail')
 class ProblemDetailHandler(base.OperationHandler):
-  async def _get_related_trainings(self, pid):
-    if self.has_perm(builtin.PERM_VIEW_TRAINING):
-      return await training.get_multi(self.domain_id, **{'dag.pids': pid}).to_list()
-    return None
+  async def _get_related(self, pid):
+    """Gets the related trainings, contests and homework from the container index.
 
-  async def _get_related_contests(self, pid):
+    Each of them is None if the user is not allowed to view it.
+    """
+    related = {}
+    if self.has_perm(builtin.PERM_VIEW_TRAINING):
+      related[document.TYPE_TRAINING] = []
     if self.has_perm(builtin.PERM_VIEW_CONTEST):
-      return await contest.get_multi(self.domain_id, document.TYPE_CONTEST, pids=pid).to_list()
-    return None
-
-  async def _get_related_homework(self, pid):
+      related[document.TYPE_CONTEST] = []
     if self.has_perm(builtin.PERM_VIEW_HOMEWORK):
-      return await contest.get_multi(self.domain_id, document.TYPE_HOMEWORK, pids=pid).to_list()
-    return None
+      related[document.TYPE_HOMEWORK] = []
+    if related:
+      for summary in await container.get(self.domain_id, pid):
+        if summary['doc_type'] in related:
+          related[summary['doc_type']].append(summary)
+    return (related.get(document.TYPE_TRAINING),
+            related.get(document.TYPE_CONTEST),
+            related.get(document.TYPE_HOMEWORK))
 
   @base.require_perm(builtin.PERM_VIEW_PROBLEM)
   @base.route_argument
@@ -210,11 +210,10 @@ class ProblemDetailHandler(base.OperationHandler):
     pdoc = await problem.get(self.domain_id, pid, uid)
     if pdoc.get('hidden', False):
       self.check_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)
-    udoc, dudoc = await asyncio.gather(user.get_by_uid(pdoc['owner_uid']),
-                                       domain.get_user(self.domain_id, pdoc['owner_uid']))
-    tdocs, ctdocs, htdocs = await asyncio.gather(self._get_related_trainings(pid),
-                                                 self._get_related_contests(pid),
-                                                 self._get_related_homework(pid))
+    udoc, dudoc, (tdocs, ctdocs, htdocs) = await asyncio.gather(
+        self.loader.get_user(pdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, pdoc['owner_uid']),
+        self._get_related(pdoc['doc_id']))
     path_components = self.build_path(
         (self.translate('problem_main'), self.reverse_url('problem_main')),
         (pdoc['title'], None))
@@ -263,8 +262,9 @@ class ProblemSubmitHandler(base.Handler):
     pdoc = await problem.get(self.domain_id, pid, uid)
     if pdoc.get('hidden', False):
       self.check_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)
-    udoc, dudoc = await asyncio.gather(user.get_by_uid(pdoc['owner_uid']),
-                                       domain.get_user(self.domain_id, pdoc['owner_uid']))
+    udoc, dudoc = await asyncio.gather(
+        self.loader.get_user(pdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, pdoc['owner_uid']))
     if uid is None:
       rdocs = []
     else:
@@ -345,7 +345,9 @@ class ProblemPretestConnection(record_handler.RecordVisibilityMixin, base.Connec
     bus.subscribe(self.on_record_change, ['record_change'])
 
   async def on_record_change(self, e):
-    rdoc = e['value']
+    rdoc = await record.get_state(e['value'])
+    if not rdoc:
+      return
     if rdoc['uid'] != self.user['_id'] or \
        rdoc['domain_id'] != self.domain_id or rdoc['pid'] != self.pid:
       return
@@ -368,14 +370,15 @@ class ProblemSolutionHandler(base.OperationHandler):
   @base.get_argument
   @base.route_argument
   @base.sanitize
-  async def get(self, *, pid: document.convert_doc_id, page: int=1):
+  async def get(self, *, pid: document.convert_doc_id, page: int=1, cursor: str=''):
     uid = self.user['_id'] if self.has_priv(builtin.PRIV_USER_PROFILE) else None
     pdoc = await problem.get(self.domain_id, pid, uid)
     if pdoc.get('hidden', False):
       self.check_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)
-    psdocs, pcount, pscount = await pagination.paginate(
-        problem.get_multi_solution(self.domain_id, pdoc['doc_id']),
-        page, self.SOLUTIONS_PER_PAGE)
+    psdocs, pcount, pscount, cursors = await pagination.paginate(
+        problem.get_multi_solution, [('vote', -1), ('doc_id', -1)],
+        page, self.SOLUTIONS_PER_PAGE, cursor,
+        domain_id=self.domain_id, pid=pdoc['doc_id'])
     uids = {pdoc['owner_uid']}
     uids.update(psdoc['owner_uid'] for psdoc in psdocs)
     for psdoc in psdocs:
@@ -393,7 +396,7 @@ class ProblemSolutionHandler(base.OperationHandler):
         (self.translate('problem_solution'), None))
     self.render('problem_solution.html', path_components=path_components,
                 pdoc=pdoc, psdocs=psdocs, page=page, pcount=pcount, pscount=pscount,
-                udict=udict, dudict=dudict, pssdict=pssdict)
+                cursors=cursors, udict=udict, dudict=dudict, pssdict=pssdict)
 
   @base.require_priv(builtin.PRIV_USER_PROFILE)
   @base.require_perm(builtin.PERM_CREATE_PROBLEM_SOLUTION)
@@ -654,8 +657,9 @@ class ProblemEditHandler(base.Handler):
     pdoc = await problem.get(self.domain_id, pid, uid)
     if not self.own(pdoc, builtin.PERM_EDIT_PROBLEM_SELF):
       self.check_perm(builtin.PERM_EDIT_PROBLEM)
-    udoc, dudoc = await asyncio.gather(user.get_by_uid(pdoc['owner_uid']),
-                                       domain.get_user(self.domain_id, pdoc['owner_uid']))
+    udoc, dudoc = await asyncio.gather(
+        self.loader.get_user(pdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, pdoc['owner_uid']))
     path_components = self.build_path(
         (self.translate('problem_main'), self.reverse_url('problem_main')),
         (pdoc['title'], self.reverse_url('problem_detail', pid=pdoc['doc_id'])),
@@ -686,8 +690,9 @@ class ProblemSettingsHandler(base.Handler):
     pdoc = await problem.get(self.domain_id, pid, uid)
     if not self.own(pdoc, builtin.PERM_EDIT_PROBLEM_SELF):
       self.check_perm(builtin.PERM_EDIT_PROBLEM)
-    udoc, dudoc = await asyncio.gather(user.get_by_uid(pdoc['owner_uid']),
-                                       domain.get_user(self.domain_id, pdoc['owner_uid']))
+    udoc, dudoc = await asyncio.gather(
+        self.loader.get_user(pdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, pdoc['owner_uid']))
     path_components = self.build_path(
         (self.translate('problem_main'), self.reverse_url('problem_main')),
         (pdoc['title'], self.reverse_url('problem_detail', pid=pdoc['doc_id'])),
@@ -783,8 +788,9 @@ class ProblemStatisticsHandler(base.Handler):
     pdoc = await problem.get(self.domain_id, pid, uid)
     if pdoc.get('hidden', False):
       self.check_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)
-    udoc, dudoc = await asyncio.gather(user.get_by_uid(pdoc['owner_uid']),
-                                       domain.get_user(self.domain_id, pdoc['owner_uid']))
+    udoc, dudoc = await asyncio.gather(
+        self.loader.get_user(pdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, pdoc['owner_uid']))
     path_components = self.build_path(
         (self.translate('problem_main'), self.reverse_url('problem_main')),
         (pdoc['title'], self.reverse_url('problem_detail', pid=pdoc['doc_id'])),
@@ -15,9 +15,10 @@ class RankingMainHandler(base.Handler):
   @base.get_argument
   @base.route_argument
   @base.sanitize
-  async def get(self, *, page: int=1):
-    dudocs, dupcount, _ = await pagination.paginate(
-        domain.get_multi_user(domain_id=self.domain_id, rp={'$gt': 0.0}).sort([('rank', 1)]),
-        page, self.USERS_PER_PAGE)
+  async def get(self, *, page: int=1, cursor: str=''):
+    dudocs, dupcount, _, cursors = await pagination.paginate(
+        domain.get_multi_user, [('rank', 1), ('uid', 1)], page, self.USERS_PER_PAGE, cursor,
+        domain_id=self.domain_id, rp={'$gt': 0.0})
     udict = await user.get_dict(dudoc['uid'] for dudoc in dudocs)
-    self.render('ranking_main.html', page=page, dupcount=dupcount, dudocs=dudocs, udict=udict)
+    self.render('ranking_main.html', page=page, dupcount=dupcount, cursors=cursors,
+                dudocs=dudocs, udict=udict)
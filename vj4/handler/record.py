@@ -1,7 +1,5 @@
 import asyncio
-import calendar
 import datetime
-import struct
 import urllib.parse
 from bson import objectid
 
@@ -10,6 +8,7 @@ from vj4 import constant
 from vj4 import error
 from vj4.handler import base
 from vj4.model import builtin
+from vj4.model import counter
 from vj4.model import document
 from vj4.model import domain
 from vj4.model import fs
@@ -19,6 +18,7 @@ from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.service import bus
 from vj4.util import options
+from vj4.util import projection
 
 
 class RecordVisibilityMixin(contest.ContestVisibilityMixin):
@@ -69,28 +69,23 @@ class RecordMainHandler(RecordMixin, base.Handler):
     else:
       start = None
     query = await self.get_filter_query(uid_or_name, pid, tid)
-    # TODO(iceboy): projection, pagination.
+    # TODO(iceboy): pagination.
     rdocs = await record.get_all_multi(**query, end_id=start,
-      get_hidden=self.has_priv(builtin.PRIV_VIEW_HIDDEN_RECORD)).sort([('_id', -1)]).limit(50).to_list()
-    # TODO(iceboy): projection.
+      get_hidden=self.has_priv(builtin.PRIV_VIEW_HIDDEN_RECORD),
+      fields=record.PROJECTION_LIST).sort([('_id', -1)]).limit(50).to_list()
+    rdocs = projection.guard_all(rdocs, record.PROJECTION_LIST)
     udict, dudict, pdict = await asyncio.gather(
         user.get_dict(rdoc['uid'] for rdoc in rdocs),
         domain.get_dict_user_by_uid(domain_id=self.domain_id, uids=(rdoc['uid'] for rdoc in rdocs)),
-        problem.get_dict_multi_domain((rdoc['domain_id'], rdoc['pid']) for rdoc in rdocs))
+        problem.get_dict_multi_domain(((rdoc['domain_id'], rdoc['pid']) for rdoc in rdocs),
+                                      fields=problem.PROJECTION_ROW))
     # statistics
     statistics = None
     if self.has_priv(builtin.PRIV_VIEW_JUDGE_STATISTICS):
-      ts = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
-      day_count, week_count, month_count, year_count, rcount = await asyncio.gather(
-          record.get_count(objectid.ObjectId(
-              struct.pack('>i', ts - 24 * 3600) + struct.pack('b', -1) * 8)),
-          record.get_count(objectid.ObjectId(
-              struct.pack('>i', ts - 7 * 24 * 3600) + struct.pack('b', -1) * 8)),
-          record.get_count(objectid.ObjectId(
-              struct.pack('>i', ts - 30 * 24 * 3600) + struct.pack('b', -1) * 8)),
-          record.get_count(objectid.ObjectId(
-              struct.pack('>i', ts - int(365.2425 * 24 * 3600)) + struct.pack('b', -1) * 8)),
-          record.get_count())
+      now = datetime.datetime.utcnow()
+      (day_count, week_count, month_count, year_count), rcount = await counter.get_record_counts(
+          now - datetime.timedelta(days=1), now - datetime.timedelta(days=7),
+          now - datetime.timedelta(days=30), now - datetime.timedelta(days=365.2425))
       statistics = {'day': day_count, 'week': week_count, 'month': month_count,
                     'year': year_count, 'total': rcount}
     url_prefix = '/d/{}'.format(urllib.parse.quote(self.domain_id))
@@ -103,6 +98,45 @@ class RecordMainHandler(RecordMixin, base.Handler):
         query_string=query_string)
 
 
+# Open record main connections, indexed by their filter queries.
+_main_router = bus.Router([('uid',), ('domain_id', 'pid'), ('tid',)])
+
+
+async def _on_record_change(e):
+  """Dispatches a record change to the matching record main connections.
+
+  The user, problem and contest are fetched once per event, the domain user once per domain,
+  and the row is rendered once per group of connections which would render it identically.
+  """
+  if not _main_router:
+    return
+  rdoc = await record.get_state(e['value'])
+  if not rdoc:
+    return
+  conns = _main_router.match(rdoc)
+  if not conns:
+    return
+  loader = conns[0].loader
+  coros = [loader.get_user(rdoc['uid']), loader.get_problem(rdoc['domain_id'], rdoc['pid'])]
+  if rdoc['tid']:
+    coros.append(contest.get(rdoc['domain_id'], rdoc.get('ttype', document.TYPE_CONTEST),
+                             rdoc['tid']))
+  udoc, pdoc, *tdoc = await asyncio.gather(*coros)
+  if tdoc:
+    conns = [conn for conn in conns if conn.can_show_status(rdoc, tdoc[0])]
+  domain_ids = list({conn.domain_id for conn in conns})
+  dudocs = await asyncio.gather(*[loader.get_domain_user(domain_id, rdoc['uid'])
+                                  for domain_id in domain_ids])
+  dudict = dict(zip(domain_ids, dudocs))
+  groups = {}
+  for conn in conns:
+    groups.setdefault(conn.render_key(rdoc), []).append(conn)
+  for group in groups.values():
+    html = group[0].render_tr(rdoc, udoc, dudict[group[0].domain_id], pdoc)
+    for conn in group:
+      conn.send(html=html)
+
+
 @app.connection_route('/records-conn', 'record_main-conn')
 class RecordMainConnection(RecordMixin, base.Connection):
   @base.get_argument
@@ -110,29 +144,38 @@ class RecordMainConnection(RecordMixin, base.Connection):
   async def on_open(self, *, uid_or_name: str='', pid: str='', tid: str=''):
     await super(RecordMainConnection, self).on_open()
     self.query = await self.get_filter_query(uid_or_name, pid, tid)
-    bus.subscribe(self.on_record_change, ['record_change'])
+    if not _main_router:
+      bus.subscribe(_on_record_change, ['record_change'])
+    _main_router.add(self, self.query)
 
-  async def on_record_change(self, e):
-    rdoc = e['value']
-    for key, value in self.query.items():
-      if rdoc[key] != value:
-        return
-    if rdoc['tid']:
-      show_status, tdoc = await self.rdoc_contest_visible(rdoc)
-      if not show_status:
-        return
-    # TODO(iceboy): projection.
-    udoc, dudoc, pdoc = await asyncio.gather(user.get_by_uid(rdoc['uid']),
-                                             domain.get_user(self.domain_id, rdoc['uid']),
-                                             problem.get(rdoc['domain_id'], rdoc['pid']))
+  def can_show_status(self, rdoc, tdoc):
+    if self.user['_id'] == rdoc['uid']:
+      return self.can_show_record(tdoc)
+    else:
+      return self.can_show_scoreboard(tdoc)
+
+  def can_rejudge(self, rdoc):
+    return ((rdoc['domain_id'] == self.domain_id and self.has_perm(builtin.PERM_REJUDGE))
+            or self.has_priv(builtin.PRIV_REJUDGE))
+
+  def render_key(self, rdoc):
+    """Returns a key which is equal for connections rendering the record identically."""
+    can_rejudge = self.can_rejudge(rdoc)
+    return (self.domain_id, id(self.locale), str(self.timezone),
+            self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN),
+            can_rejudge, self.csrf_token if can_rejudge else None)
+
+  def render_tr(self, rdoc, udoc, dudoc, pdoc):
     # check permission for visibility: hidden problem
-    if pdoc.get('hidden', False) and (pdoc['domain_id'] != self.domain_id
-                                      or not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)):
+    if pdoc and pdoc.get('hidden', False) and (pdoc['domain_id'] != self.domain_id
+                                               or not self.has_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)):
       pdoc = None
-    self.send(html=self.render_html('record_main_tr.html', rdoc=rdoc, udoc=udoc, dudoc=dudoc, pdoc=pdoc))
+    return self.render_html('record_main_tr.html', rdoc=rdoc, udoc=udoc, dudoc=dudoc, pdoc=pdoc)
 
   async def on_close(self):
-    bus.unsubscribe(self.on_record_change)
+    _main_router.remove(self)
+    if not _main_router:
+      bus.unsubscribe(_on_record_change)
 
 
 @app.route('/records/{rid}', 'record_detail')
@@ -162,14 +205,14 @@ class RecordDetailHandler(RecordMixin, base.Handler):
       else: # TYPE_HOMEWORK
         raise error.PermissionError(builtin.PERM_VIEW_HOMEWORK_HIDDEN_SCOREBOARD)
     udoc, dudoc = await asyncio.gather(
-        user.get_by_uid(rdoc['uid']),
-        domain.get_user(self.domain_id, rdoc['uid']))
+        self.loader.get_user(rdoc['uid']),
+        self.loader.get_domain_user(self.domain_id, rdoc['uid']))
     try:
       pdoc = await problem.get(rdoc['domain_id'], rdoc['pid'])
     except error.ProblemNotFoundError:
       pdoc = {}
     if show_status and 'judge_uid' in rdoc:
-      judge_udoc = await user.get_by_uid(rdoc['judge_uid'])
+      judge_udoc = await self.loader.get_user(rdoc['judge_uid'])
     else:
       judge_udoc = None
     # check permission for visibility: hidden problem
@@ -196,10 +239,11 @@ class RecordDetailConnection(RecordMixin, base.Connection):
     self.send_record(rdoc)
 
   async def on_record_change(self, e):
-    rdoc = e['value']
-    if rdoc['_id'] != self.rid:
+    if e['value']['_id'] != self.rid:
       return
-    self.send_record(rdoc)
+    rdoc = await record.get_state(e['value'])
+    if rdoc:
+      self.send_record(rdoc)
 
   def send_record(self, rdoc):
     self.send(status_html=self.render_html('record_detail_status.html', rdoc=rdoc),
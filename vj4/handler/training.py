@@ -7,8 +7,6 @@ from vj4 import error
 from vj4 import constant
 from vj4.model import builtin
 from vj4.model import document
-from vj4.model import domain
-from vj4.model import user
 from vj4.model.adaptor import problem
 from vj4.model.adaptor import training
 from vj4.handler import base
@@ -71,14 +69,14 @@ class TrainingMainHandler(base.Handler, TrainingMixin):
   @base.require_perm(builtin.PERM_VIEW_TRAINING)
   @base.get_argument
   @base.sanitize
-  async def get(self, *, sort: str='', page: int=1):
+  async def get(self, *, sort: str='', page: int=1, cursor: str=''):
     if sort:
       qs = 'sort={0}'.format(sort)
     else:
       qs = ''
-    tdocs, tpcount, _ = await pagination.paginate(training.get_multi(self.domain_id) \
-                                                          .sort('doc_id', 1),
-                                                  page, self.TRAININGS_PER_PAGE)
+    tdocs, tpcount, _, cursors = await pagination.paginate(
+        training.get_multi, [('doc_id', 1)], page, self.TRAININGS_PER_PAGE, cursor,
+        domain_id=self.domain_id)
     tids = set(tdoc['doc_id'] for tdoc in tdocs)
     tsdict = dict()
     tdict = dict()
@@ -95,8 +93,8 @@ class TrainingMainHandler(base.Handler, TrainingMixin):
         tdict = await training.get_dict(self.domain_id, enrolled_tids)
     for tdoc in tdocs:
       tdict[tdoc['doc_id']] = tdoc
-    self.render('training_main.html', tdocs=tdocs, page=page, tpcount=tpcount, qs=qs,
-                tsdict=tsdict, tdict=tdict)
+    self.render('training_main.html', tdocs=tdocs, page=page, tpcount=tpcount, cursors=cursors,
+                qs=qs, tsdict=tsdict, tdict=tdict)
 
 
 @app.route('/training/{tid:\w{24}}', 'training_detail')
@@ -112,12 +110,12 @@ class TrainingDetailHandler(base.OperationHandler, TrainingMixin):
       f = {'hidden': False}
     else:
       f = {}
-    owner_udoc, owner_dudoc, pdict = await asyncio.gather(
-        user.get_by_uid(tdoc['owner_uid']),
-        domain.get_user(domain_id=self.domain_id, uid=tdoc['owner_uid']),
-        problem.get_dict(self.domain_id, pids, **f))
-    psdict = await problem.get_dict_status(self.domain_id,
-                                           self.user['_id'], pdict.keys())
+    owner_udoc, owner_dudoc, pdict, psdict = await asyncio.gather(
+        self.loader.get_user(tdoc['owner_uid']),
+        self.loader.get_domain_user(self.domain_id, tdoc['owner_uid']),
+        problem.get_dict(self.domain_id, pids, **f),
+        problem.get_dict_status(self.domain_id, self.user['_id'], pids))
+    psdict = {pid: psdoc for pid, psdoc in psdict.items() if pid in pdict}
     done_pids = set()
     prog_pids = set()
     for pid, psdoc in psdict.items():
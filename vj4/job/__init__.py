@@ -3,3 +3,4 @@ from vj4.job import record
 from vj4.job import rp
 from vj4.job import num
 from vj4.job import difficulty
+from vj4.job import rejudge
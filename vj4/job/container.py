@@ -0,0 +1,34 @@
+import logging
+
+from vj4.model import container
+from vj4.model import document
+from vj4.model.adaptor import training
+from vj4.util import argmethod
+from vj4.util import domainjob
+
+
+_logger = logging.getLogger(__name__)
+
+
+@domainjob.wrap
+async def rebuild(domain_id: str):
+  _logger.info('Containers')
+  tdocs_and_pids = []
+  tdocs = document.get_multi(domain_id=domain_id,
+                             doc_type={'$in': [document.TYPE_CONTEST,
+                                               document.TYPE_HOMEWORK,
+                                               document.TYPE_TRAINING]},
+                             fields={'doc_type': 1, 'doc_id': 1, 'title': 1,
+                                     'begin_at': 1, 'end_at': 1, 'pids': 1, 'dag': 1})
+  async for tdoc in tdocs:
+    if tdoc['doc_type'] == document.TYPE_TRAINING:
+      pids = training.get_pids(tdoc['dag'])
+    else:
+      pids = tdoc['pids']
+    tdocs_and_pids.append((tdoc, pids))
+  _logger.info('Committing')
+  await container.reset(domain_id, tdocs_and_pids)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
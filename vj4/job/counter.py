@@ -0,0 +1,44 @@
+import collections
+import datetime
+import logging
+
+from vj4 import db
+from vj4.model import counter
+from vj4.model import document
+from vj4.util import argmethod
+from vj4.util import domainjob
+
+
+_logger = logging.getLogger(__name__)
+
+
+@domainjob.wrap
+async def documents(domain_id: str):
+  _logger.info('Documents')
+  await document.recount(domain_id)
+
+
+@argmethod.wrap
+async def records():
+  _logger.info('Records')
+  now = datetime.datetime.utcnow()
+  counts = collections.Counter()
+  count = 0
+  async for rdoc in db.coll('record').find({}, {'_id': 1}):
+    at = rdoc['_id'].generation_time.replace(tzinfo=None)
+    counts[counter.get_record_bucket(at, now)] += 1
+    count += 1
+    if count % 100000 == 0:
+      _logger.info('#{0}'.format(count))
+  _logger.info('Committing')
+  await counter.set_record_counts(counts)
+
+
+@argmethod.wrap
+async def rollup():
+  _logger.info('Rollup')
+  await counter.rollup_records()
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
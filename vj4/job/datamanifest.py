@@ -0,0 +1,33 @@
+import logging
+
+from vj4.model import datamanifest
+from vj4.model import document
+from vj4.model.adaptor import problem
+from vj4.util import argmethod
+from vj4.util import domainjob
+
+
+_logger = logging.getLogger(__name__)
+
+
+@domainjob.wrap
+async def rebuild(domain_id: str):
+  _logger.info('Problem data')
+  entries = []
+  pdocs = document.get_multi(domain_id=domain_id, doc_type=document.TYPE_PROBLEM,
+                             fields={'domain_id': 1, 'doc_id': 1, 'data': 1})
+  async for pdoc in pdocs:
+    data = pdoc.get('data')
+    if not data:
+      continue
+    if type(data) is dict:
+      data_domain_id, data_pid = data['domain'], data['pid']
+    else:
+      data_domain_id, data_pid = domain_id, pdoc['doc_id']
+    entries.append((pdoc['doc_id'], data_domain_id, data_pid, await problem.get_data(pdoc)))
+  _logger.info('Committing')
+  await datamanifest.reset(domain_id, entries)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -102,6 +102,8 @@ async def update_problem(domain_id: str, pid: document.convert_doc_id):
   pdoc = await problem.get(domain_id, pid)
   difficulty_algo = difficulty_algorithm(pdoc['num_submit'], pdoc['num_accept'])
   difficulty = _get_difficulty(pdoc, difficulty_algo)
+  if pdoc.get('difficulty') == difficulty and pdoc.get('difficulty_algo') == difficulty_algo:
+    return pdoc
   return await problem.edit(domain_id, pdoc['doc_id'], difficulty=difficulty,
                             difficulty_algo=difficulty_algo)
 
@@ -123,6 +125,7 @@ async def recalc(domain_id: str):
   if execute:
     _logger.info('Committing')
     await bulk.execute()
+    await problem.invalidate(domain_id)
   
 
 if __name__ == '__main__':
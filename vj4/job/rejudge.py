@@ -0,0 +1,169 @@
+"""Bulk rejudge of the submissions of a problem, a contest or a user.
+
+The records are reset with one update and enqueued in batches at a limited rate. When all of
+them are judged, the problem statuses, rp, difficulties and contest statuses are recalculated
+once per affected key. The progress is tracked in a document of the job.rejudge collection,
+with the last enqueued record as a cursor, and an interrupted job can be resumed with finish.
+"""
+import asyncio
+import datetime
+import functools
+import logging
+
+from bson import objectid
+
+from vj4 import constant
+from vj4 import db
+from vj4 import job
+from vj4.model import document
+from vj4.model import record
+from vj4.model.adaptor import contest as contest_model
+from vj4.util import argmethod
+from vj4.util import options
+
+options.define('rejudge_batch_size', default=100,
+               help='Number of records enqueued at once by a rejudge job.')
+options.define('rejudge_rate', default=50.0,
+               help='Maximum number of records enqueued per second by a rejudge job.')
+options.define('rejudge_poll_interval', default=5.0,
+               help='Seconds between progress checks of a rejudge job.')
+
+STATUS_ENQUEUING = 'enqueuing'
+STATUS_JUDGING = 'judging'
+STATUS_RECALCULATING = 'recalculating'
+STATUS_DONE = 'done'
+
+_logger = logging.getLogger(__name__)
+
+
+async def _set(job_id, **kwargs):
+  await db.coll('job.rejudge').update_one({'_id': job_id}, {'$set': kwargs})
+
+
+async def _set_contest_progress(job_id, tid, done, total):
+  await _set(job_id, contest_progress={'tid': tid, 'done': done, 'total': total})
+
+
+def _get_pending_query(job_id):
+  return {'rejudge_job': job_id,
+          '$or': [{'status': constant.record.STATUS_WAITING},
+                  {'judge_token': {'$exists': True}}]}
+
+
+async def _run(kind, args, query):
+  coll = db.coll('job.rejudge')
+  job_id = (await coll.insert_one({'kind': kind,
+                                   'args': args,
+                                   'status': STATUS_ENQUEUING,
+                                   'begin_at': datetime.datetime.utcnow(),
+                                   'total': 0,
+                                   'enqueued': 0,
+                                   'judged': 0})).inserted_id
+  _logger.info('Job {0}'.format(job_id))
+  total = await record.rejudge_multi(job_id, **query,
+                                     type=constant.record.TYPE_SUBMISSION)
+  _logger.info('Reset {0} records'.format(total))
+  await _set(job_id, total=total)
+  return await finish(job_id)
+
+
+async def _enqueue_all(job_id, after_id=None, enqueued=0):
+  """Enqueues the records of the job after the record after_id, in the order of _id."""
+  query = {'rejudge_job': job_id}
+  if after_id:
+    query['_id'] = {'$gt': after_id}
+  rdocs = record.get_all_multi(get_hidden=True, **query,
+                               fields={'_id': 1, 'domain_id': 1, 'uid': 1}).sort('_id', 1)
+  batch = []
+  async for rdoc in rdocs:
+    batch.append(rdoc)
+    if len(batch) >= options.rejudge_batch_size:
+      enqueued = await _enqueue_batch(job_id, batch, enqueued)
+      batch = []
+  if batch:
+    await _enqueue_batch(job_id, batch, enqueued)
+
+
+async def _enqueue_batch(job_id, rdocs, enqueued):
+  await asyncio.gather(*[record.enqueue_rejudge(rdoc) for rdoc in rdocs])
+  enqueued += len(rdocs)
+  _logger.info('Enqueued {0} records'.format(enqueued))
+  await _set(job_id, enqueued=enqueued, enqueued_rid=rdocs[-1]['_id'])
+  await asyncio.sleep(len(rdocs) / options.rejudge_rate)
+  return enqueued
+
+
+@argmethod.wrap
+async def finish(job_id: objectid.ObjectId):
+  """Finishes a job whose records are reset. Returns the job id.
+
+  The records which are not enqueued yet are enqueued, and the affected statuses are
+  recalculated when all records of the job are judged.
+  """
+  jdoc = await db.coll('job.rejudge').find_one({'_id': job_id})
+  if jdoc['status'] == STATUS_ENQUEUING:
+    # The total is not set if the job was interrupted right after the records were reset.
+    jdoc['total'] = await db.coll('record').count({'rejudge_job': job_id})
+    await _set(job_id, total=jdoc['total'])
+    await _enqueue_all(job_id, jdoc.get('enqueued_rid'), jdoc['enqueued'])
+    await _set(job_id, status=STATUS_JUDGING)
+  while True:
+    pending = await db.coll('record').count(_get_pending_query(job_id))
+    await _set(job_id, judged=jdoc['total'] - pending)
+    if not pending:
+      break
+    _logger.info('Waiting for {0} records'.format(pending))
+    await asyncio.sleep(options.rejudge_poll_interval)
+  await _set(job_id, status=STATUS_RECALCULATING)
+  problem_users = set()
+  problems = set()
+  contests = set()
+  rdocs = record.get_all_multi(get_hidden=True, rejudge_job=job_id,
+                               fields={'domain_id': 1, 'pid': 1, 'uid': 1,
+                                       'ttype': 1, 'tid': 1})
+  async for rdoc in rdocs:
+    problem_users.add((rdoc['domain_id'], rdoc['pid'], rdoc['uid']))
+    problems.add((rdoc['domain_id'], rdoc['pid']))
+    if rdoc.get('tid'):
+      contests.add((rdoc['domain_id'], rdoc.get('ttype') or document.TYPE_CONTEST, rdoc['tid']))
+  _logger.info('Recalculating {0} problem statuses'.format(len(problem_users)))
+  for domain_id, pid, uid in problem_users:
+    await job.record.user_in_problem(uid, domain_id, pid)
+  _logger.info('Recalculating {0} problems'.format(len(problems)))
+  for domain_id, pid in problems:
+    await job.rp.update_problem(domain_id, pid)
+    await job.difficulty.update_problem(domain_id, pid)
+  _logger.info('Recalculating {0} contests'.format(len(contests)))
+  for domain_id, doc_type, tid in contests:
+    await contest_model.recalc_status(domain_id, doc_type, tid,
+                                      functools.partial(_set_contest_progress, job_id, tid),
+                                      parallel=1)
+  await _set(job_id, status=STATUS_DONE, end_at=datetime.datetime.utcnow())
+  return job_id
+
+
+@argmethod.wrap
+async def problem(domain_id: str, pid: document.convert_doc_id):
+  return await _run('problem', [domain_id, pid], {'domain_id': domain_id, 'pid': pid})
+
+
+@argmethod.wrap
+async def contest(domain_id: str, tid: objectid.ObjectId):
+  return await _run('contest', [domain_id, tid], {'domain_id': domain_id, 'tid': tid})
+
+
+@argmethod.wrap
+async def user(uid: int, domain_id: str=''):
+  query = {'uid': uid}
+  if domain_id:
+    query['domain_id'] = domain_id
+  return await _run('user', [uid, domain_id], query)
+
+
+@argmethod.wrap
+def get(job_id: objectid.ObjectId):
+  return db.coll('job.rejudge').find_one({'_id': job_id})
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
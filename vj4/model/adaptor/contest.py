@@ -1,8 +1,13 @@
 import asyncio
+import calendar
 import collections
+from concurrent import futures
 import datetime
 import functools
+import hashlib
 import itertools
+import logging
+import os
 
 from bson import objectid
 from pymongo import errors
@@ -10,18 +15,70 @@ from pymongo import errors
 from vj4 import constant
 from vj4 import error
 from vj4.model import builtin
+from vj4.model import container
 from vj4.model import document
 from vj4.model import user
 from vj4.model import domain
+from vj4.model import snapshot
 from vj4.model.adaptor import problem
+from vj4.service import bus
 from vj4.util import argmethod
 from vj4.util import misc
+from vj4.util import options
+from vj4.util import projection
 from vj4.util import rank
 from vj4.util import validator
 
 
 journal_key_func = lambda j: j['rid']
 
+PROJECTION_LIST = {'domain_id': 1,
+                   'doc_type': 1,
+                   'doc_id': 1,
+                   'owner_uid': 1,
+                   'title': 1,
+                   'rule': 1,
+                   'begin_at': 1,
+                   'end_at': 1,
+                   'penalty_since': 1,
+                   'pids': 1,
+                   'attend': 1}
+# Projection of status documents for ranking and scoreboards.
+PROJECTION_SCOREBOARD = {'uid': 1,
+                         'attend': 1,
+                         'accept': 1,
+                         'score': 1,
+                         'time': 1,
+                         'penalty_score': 1,
+                         'detail': 1}
+# Projection of status documents kept by cached scoreboards.
+PROJECTION_BOARD = {**PROJECTION_SCOREBOARD, 'rev': 1}
+# Projection of status documents for computing frozen scoreboards.
+PROJECTION_FREEZE = {'uid': 1, 'attend': 1, 'rev': 1, 'journal': 1}
+# Fields of the contest document which affect its scoreboard.
+BOARD_TDOC_FIELDS = ['title', 'rule', 'pids', 'begin_at', 'end_at',
+                     'penalty_since', 'penalty_rules']
+
+# Projection of status documents for updating their statistics incrementally.
+PROJECTION_UPDATE = {'uid': 1, 'attend': 1, 'rev': 1, 'stale': 1, 'detail': 1}
+# Projection of status documents for recalculating their statistics.
+PROJECTION_RECALC = {'uid': 1, 'rev': 1, 'journal': 1}
+
+options.define('scoreboard_max_entries', default=64,
+               help='Maximum number of contest scoreboards cached in each process.')
+options.define('frozen_scoreboard_max_entries', default=16,
+               help='Maximum number of frozen contest scoreboards cached in each process.')
+options.define('contest_freeze_interval', default=300,
+               help='Seconds to which the freeze times of scoreboards are rounded down.')
+options.define('contest_status_retries', default=5,
+               help='Attempts to update a contest status on revision conflicts.')
+options.define('contest_recalc_processes', default=0,
+               help='Number of processes recalculating contest statuses, 0 for the CPU count.')
+options.define('contest_recalc_chunk_size', default=500,
+               help='Number of contest statuses recalculated by a process at a time.')
+
+_logger = logging.getLogger(__name__)
+
 Rule = collections.namedtuple('Rule', ['show_record_func',
                                        'show_scoreboard_func',
                                        'stat_func',
@@ -30,9 +87,33 @@ Rule = collections.namedtuple('Rule', ['show_record_func',
                                        'scoreboard_func'])
 
 
+def _oi_sum(detail):
+  return {'score': sum(d['score'] for d in detail), 'detail': detail}
+
+
 def _oi_stat(tdoc, journal):
   detail = list(dict((j['pid'], j) for j in journal if j['pid'] in tdoc['pids']).values())
-  return {'score': sum(d['score'] for d in detail), 'detail': detail}
+  return _oi_sum(detail)
+
+
+def _oi_stat_inc(tdoc, detail, jdoc):
+  ddict = collections.OrderedDict((d['pid'], d) for d in detail if d['pid'] in tdoc['pids'])
+  d = ddict.get(jdoc['pid'])
+  if jdoc['pid'] in tdoc['pids'] and (not d or jdoc['rid'] >= d['rid']):
+    ddict[jdoc['pid']] = jdoc
+  return _oi_sum(list(ddict.values()))
+
+
+def _acm_detail(tdoc, jdoc, naccept):
+  real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
+  penalty = datetime.timedelta(minutes=20) * naccept
+  return {**jdoc, 'naccept': naccept, 'time': (real + penalty).total_seconds()}
+
+
+def _acm_sum(detail):
+  return {'accept': sum(int(d['accept']) for d in detail),
+          'time': sum(d['time'] for d in detail if d['accept']),
+          'detail': detail}
 
 
 def _acm_stat(tdoc, journal):
@@ -44,23 +125,31 @@ def _acm_stat(tdoc, journal):
       if not j['accept']:
         naccept[j['pid']] += 1
 
-  def time(jdoc):
-    real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
-    penalty = datetime.timedelta(minutes=20) * naccept[jdoc['pid']]
-    return (real + penalty).total_seconds()
+  return _acm_sum([_acm_detail(tdoc, j, naccept[j['pid']]) for j in effective.values()])
 
-  detail = [{**j, 'naccept': naccept[j['pid']], 'time': time(j)} for j in effective.values()]
-  return {'accept': sum(int(d['accept']) for d in detail),
-          'time': sum(d['time'] for d in detail if d['accept']),
-          'detail': detail}
 
+def _get_effective_inc(tdoc, detail, jdoc):
+  """Returns the effective entries by pid, or None if jdoc is not after the effective entry of its
+  problem, i.e. it is judged out of order or rejudged."""
+  ddict = collections.OrderedDict((d['pid'], d) for d in detail if d['pid'] in tdoc['pids'])
+  d = ddict.get(jdoc['pid'])
+  if d and jdoc['rid'] <= d['rid']:
+    return None
+  return ddict
 
-def _assignment_stat(tdoc, journal):
-  effective = {}
-  for j in journal:
-    if j['pid'] in tdoc['pids'] and not (j['pid'] in effective and effective[j['pid']]['accept']):
-      effective[j['pid']] = j
 
+def _acm_stat_inc(tdoc, detail, jdoc):
+  ddict = _get_effective_inc(tdoc, detail, jdoc)
+  if ddict is None:
+    return None
+  d = ddict.get(jdoc['pid'])
+  if jdoc['pid'] in tdoc['pids'] and not (d and d['accept']):
+    naccept = (d['naccept'] if d else 0) + int(not jdoc['accept'])
+    ddict[jdoc['pid']] = _acm_detail(tdoc, jdoc, naccept)
+  return _acm_sum(list(ddict.values()))
+
+
+def _assignment_detail(tdoc, jdoc):
   def time(jdoc):
     real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
     return real.total_seconds()
@@ -78,13 +167,35 @@ def _assignment_stat(tdoc, journal):
         break
     return score * coefficient
 
-  detail = [{**j, 'penalty_score': penalty_score(j), 'time': time(j)} for j in effective.values()]
+  return {**jdoc, 'penalty_score': penalty_score(jdoc), 'time': time(jdoc)}
+
+
+def _assignment_sum(detail):
   return {'score': sum(d['score'] for d in detail),
           'penalty_score': sum(d['penalty_score'] for d in detail),
           'time': sum(d['time'] for d in detail),
           'detail': detail}
 
 
+def _assignment_stat(tdoc, journal):
+  effective = {}
+  for j in journal:
+    if j['pid'] in tdoc['pids'] and not (j['pid'] in effective and effective[j['pid']]['accept']):
+      effective[j['pid']] = j
+
+  return _assignment_sum([_assignment_detail(tdoc, j) for j in effective.values()])
+
+
+def _assignment_stat_inc(tdoc, detail, jdoc):
+  ddict = _get_effective_inc(tdoc, detail, jdoc)
+  if ddict is None:
+    return None
+  d = ddict.get(jdoc['pid'])
+  if jdoc['pid'] in tdoc['pids'] and not (d and d['accept']):
+    ddict[jdoc['pid']] = _assignment_detail(tdoc, jdoc)
+  return _assignment_sum(list(ddict.values()))
+
+
 def _oi_equ_func(a, b):
   return a.get('score', 0) == b.get('score', 0)
 
@@ -263,6 +374,21 @@ RULES = {
                                          _assignment_scoreboard),
 }
 
+# Number of leading status_sort fields on which users share a rank, as the rank_func of the rule,
+# e.g. _oi_equ_func. Users of the other rules are ranked by their positions.
+RANK_TIE_FIELDS = {
+  constant.contest.RULE_OI: 1,
+}
+
+# Functions which apply a journal entry to the effective entries of a status document in O(1), by
+# rule. Returns the same statistics as the stat_func of the rule, or None if the statistics must be
+# computed from the whole journal.
+STAT_INC_FUNCS = {
+  constant.contest.RULE_OI: _oi_stat_inc,
+  constant.contest.RULE_ACM: _acm_stat_inc,
+  constant.contest.RULE_ASSIGNMENT: _assignment_stat_inc,
+}
+
 
 @argmethod.wrap
 async def add(domain_id: str, doc_type: int,
@@ -293,10 +419,12 @@ async def add(domain_id: str, doc_type: int,
     if kwargs['penalty_since'] > end_at:
       raise error.ValidationError('penalty_since', 'end_at')
   # TODO(twd2): should we check problem existance here?
-  return await document.add(domain_id, content, owner_uid, doc_type,
-                            title=title, rule=rule,
-                            begin_at=begin_at, end_at=end_at, pids=pids, attend=0,
-                            **kwargs)
+  tid = await document.add(domain_id, content, owner_uid, doc_type,
+                           title=title, rule=rule,
+                           begin_at=begin_at, end_at=end_at, pids=pids, attend=0,
+                           **kwargs)
+  await container.set(domain_id, doc_type, tid, pids, title, begin_at, end_at)
+  return tid
 
 
 @argmethod.wrap
@@ -331,11 +459,16 @@ async def edit(domain_id: str, doc_type: int, tid: objectid.ObjectId, **kwargs):
       raise error.ValidationError('penalty_since', 'begin_at')
     if 'end_at' in kwargs and kwargs['penalty_since'] > kwargs['end_at']:
       raise error.ValidationError('penalty_since', 'end_at')
-  return await document.set(domain_id, doc_type, tid, **kwargs)
+  tdoc = await document.set(domain_id, doc_type, tid, **kwargs)
+  if tdoc and kwargs.keys() & {'pids', 'title', 'begin_at', 'end_at'}:
+    await container.set(domain_id, doc_type, tid, tdoc['pids'], tdoc['title'],
+                        tdoc['begin_at'], tdoc['end_at'])
+  if tdoc and kwargs.keys() & set(BOARD_TDOC_FIELDS):
+    await invalidate_board(domain_id, doc_type, tid)
+  return tdoc
 
 
 def get_multi(domain_id: str, doc_type: int, fields=None, **kwargs):
-  # TODO(twd2): projection.
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
   return document.get_multi(domain_id=domain_id,
@@ -351,13 +484,14 @@ async def attend(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
   try:
-    await document.capped_inc_status(domain_id, doc_type, tid,
-                                     uid, 'attend', 1, 0, 1)
+    tsdoc = await document.capped_inc_status(domain_id, doc_type, tid,
+                                             uid, 'attend', 1, 0, 1)
   except errors.DuplicateKeyError:
     if doc_type == document.TYPE_CONTEST:
       raise error.ContestAlreadyAttendedError(domain_id, tid, uid) from None
     elif doc_type == document.TYPE_HOMEWORK:
       raise error.HomeworkAlreadyAttendedError(domain_id, tid, uid) from None
+  await _publish_status(domain_id, doc_type, tid, tsdoc)
   return await document.inc(domain_id, doc_type, tid, 'attend', 1)
 
 
@@ -379,19 +513,14 @@ def get_multi_status(doc_type: int, *, fields=None, **kwargs):
 async def get_dict_status(domain_id, uid, doc_type, tids, *, fields=None):
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
-  result = dict()
-  async for tsdoc in get_multi_status(domain_id=domain_id,
-                                      uid=uid,
-                                      doc_type=doc_type,
-                                      doc_id={'$in': list(set(tids))},
-                                      fields=fields):
-    result[tsdoc['doc_id']] = tsdoc
-  return result
+  sdict = await document.get_dict_status_multi(domain_id, uid, [(doc_type, tids)],
+                                               fields=fields)
+  return sdict[doc_type]
 
 
 @argmethod.wrap
 async def get_and_list_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, fields=None):
-  # TODO(iceboy): projection, pagination.
+  # TODO(iceboy): pagination.
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
   tdoc = await get(domain_id, doc_type, tid)
@@ -401,7 +530,7 @@ async def get_and_list_status(domain_id: str, doc_type: int, tid: objectid.Objec
                                            fields=fields) \
                          .sort(RULES[tdoc['rule']].status_sort) \
                          .to_list()
-  return tdoc, tsdocs
+  return tdoc, projection.guard_all(tsdocs, fields)
 
 
 def _get_status_journal(tsdoc):
@@ -414,43 +543,405 @@ def _get_status_journal(tsdoc):
 async def update_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int,
                         rid: objectid.ObjectId, pid: document.convert_doc_id,
                         accept: bool, score: int):
-  """This method returns None when the modification has been superseded by a parallel operation."""
+  """Appends a journal entry to a status document and updates its statistics.
+
+  The statistics are updated incrementally from the effective entries if the rule supports it and
+  the entry follows them, or computed from the whole journal otherwise, with one write guarded by
+  the revision of the status document. This method returns None when the modification has been
+  superseded by parallel operations contest_status_retries times, in which case the entry is
+  appended and the status document is marked stale until the next update or recalculation.
+  """
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
   tdoc = await document.get(domain_id, doc_type, tid)
-  tsdoc = await document.rev_push_status(
-    domain_id, tdoc['doc_type'], tdoc['doc_id'], uid,
-    'journal', {'rid': rid, 'pid': pid, 'accept': accept, 'score': score})
-  if 'attend' not in tsdoc or not tsdoc['attend']:
-    if tdoc['doc_type'] == document.TYPE_CONTEST:
-      raise error.ContestNotAttendedError(domain_id, tid, uid)
-    elif tdoc['doc_type'] == document.TYPE_HOMEWORK:
-      raise error.HomeworkNotAttendedError(domain_id, tid, uid)
+  jdoc = {'rid': rid, 'pid': pid, 'accept': accept, 'score': score}
+  stat_inc_func = STAT_INC_FUNCS.get(tdoc['rule'])
+  for _ in range(options.contest_status_retries):
+    tsdoc = await document.get_status(domain_id, doc_type, tid, uid, fields=PROJECTION_UPDATE)
+    if not tsdoc or not tsdoc.get('attend'):
+      if doc_type == document.TYPE_CONTEST:
+        raise error.ContestNotAttendedError(domain_id, tid, uid)
+      else:
+        raise error.HomeworkNotAttendedError(domain_id, tid, uid)
+    stats = None
+    if stat_inc_func and not tsdoc.get('stale'):
+      stats = stat_inc_func(tdoc, tsdoc.get('detail', []), jdoc)
+    if stats is not None:
+      tsdoc = await document.rev_push_set_status(domain_id, doc_type, tid, uid, tsdoc['rev'],
+                                                 'journal', jdoc, **stats)
     else:
-      raise error.InvalidArgumentError('doc_type')
+      tsdoc = await document.get_status(domain_id, doc_type, tid, uid,
+                                        fields={**PROJECTION_UPDATE, 'journal': 1})
+      journal = _get_status_journal({'journal': tsdoc.get('journal', []) + [jdoc]})
+      stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
+      tsdoc = await document.rev_set_status(domain_id, doc_type, tid, uid, tsdoc['rev'],
+                                            journal=journal, stale=False, **stats)
+    if tsdoc:
+      await _publish_status(domain_id, doc_type, tid, tsdoc)
+      return tsdoc
+  _logger.warning('Status of user %d in %s/%s is stale after %d attempts',
+                  uid, domain_id, tid, options.contest_status_retries)
+  await document.rev_push_status(domain_id, doc_type, tid, uid, 'journal', jdoc, stale=True)
+  return None
+
 
+# The process pool recalculating contest statuses, created on first use. Only the command line
+# and jobs use it, so that no process is forked from a web server process.
+_recalc_executor = None
+
+
+def _get_recalc_processes():
+  return options.contest_recalc_processes or os.cpu_count() or 1
+
+
+def _get_recalc_executor():
+  global _recalc_executor
+  if not _recalc_executor:
+    _recalc_executor = futures.ProcessPoolExecutor(_get_recalc_processes())
+  return _recalc_executor
+
+
+def shutdown_recalc_executor():
+  """Shuts down the process pool recalculating contest statuses, if any."""
+  global _recalc_executor
+  if _recalc_executor:
+    _recalc_executor.shutdown()
+    _recalc_executor = None
+
+
+def _recalc_fields(stat_func, tdoc, tsdoc):
   journal = _get_status_journal(tsdoc)
-  stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
-  tsdoc = await document.rev_set_status(domain_id, tdoc['doc_type'], tid, uid, tsdoc['rev'],
-                                        journal=journal, **stats)
-  return tsdoc
+  return {'journal': journal, 'stale': False, **stat_func(tdoc, journal)}
+
+
+def _recalc_chunk(stat_func, tdoc, tsdocs):
+  """Returns the (uid, rev, fields) of the recalculated status documents."""
+  return [(tsdoc['uid'], tsdoc['rev'], _recalc_fields(stat_func, tdoc, tsdoc))
+          for tsdoc in tsdocs]
+
+
+async def _recalc_one(domain_id, doc_type, tdoc, uid):
+  for _ in range(options.contest_status_retries):
+    tsdoc = await document.get_status(domain_id, doc_type, tdoc['doc_id'], uid,
+                                      fields=PROJECTION_RECALC)
+    fields = _recalc_fields(RULES[tdoc['rule']].stat_func, tdoc, tsdoc)
+    if await document.rev_set_status(domain_id, doc_type, tdoc['doc_id'], uid, tsdoc['rev'],
+                                     return_doc=False, **fields):
+      return
+  _logger.warning('Status of user %d in %s/%s is stale after %d attempts',
+                  uid, domain_id, tdoc['doc_id'], options.contest_status_retries)
+  await document.set_status(domain_id, doc_type, tdoc['doc_id'], uid, stale=True)
+
+
+async def _write_recalc(domain_id, doc_type, tdoc, updates):
+  modified = await document.rev_set_status_multi(domain_id, doc_type, tdoc['doc_id'], updates)
+  if modified == len(updates):
+    return
+  # Recalculates the status documents which may have been changed since they were read, i.e.
+  # which do not have exactly the update, one by one.
+  udict = dict((uid, (rev, fields)) for uid, rev, fields in updates)
+  tsdocs = document.get_multi_status(domain_id=domain_id,
+                                     doc_type=doc_type,
+                                     doc_id=tdoc['doc_id'],
+                                     uid={'$in': list(udict)},
+                                     fields=PROJECTION_RECALC)
+  async for tsdoc in tsdocs:
+    rev, fields = udict[tsdoc['uid']]
+    if tsdoc['rev'] != rev + 1 or tsdoc.get('journal') != fields.get('journal'):
+      await _recalc_one(domain_id, doc_type, tdoc, tsdoc['uid'])
 
 
 @argmethod.wrap
-async def recalc_status(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+async def recalc_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, progress=None,
+                        parallel: int=0):
+  """Recalculates the statistics of the status documents of a contest from their journals.
+
+  The status documents are streamed in chunks of contest_recalc_chunk_size. Each chunk is written
+  back with an unordered bulk guarded by the revisions, and the status documents changed in the
+  meantime are recalculated again one by one.
+
+  Args:
+    progress: optional coroutine function called with the number of status documents
+        recalculated and the total after each chunk.
+    parallel: if nonzero, the statistics are computed in parallel by a process pool of
+        contest_recalc_processes processes, which is only to be used from the command line and
+        jobs. Otherwise they are computed in the calling process.
+
+  Returns:
+    The number of status documents recalculated.
+  """
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
   tdoc = await document.get(domain_id, doc_type, tid)
-  async with document.get_multi_status(domain_id=domain_id,
-                                       doc_type=doc_type,
-                                       doc_id=tdoc['doc_id']) as tsdocs:
-    async for tsdoc in tsdocs:
-      if 'journal' not in tsdoc or not tsdoc['journal']:
-        continue
-      journal = _get_status_journal(tsdoc)
-      stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
-      await document.rev_set_status(domain_id, doc_type, tid, tsdoc['uid'], tsdoc['rev'],
-                                    return_doc=False, journal=journal, **stats)
+  stat_func = RULES[tdoc['rule']].stat_func
+  stat_tdoc = {key: tdoc[key] for key in ['doc_id', *BOARD_TDOC_FIELDS] if key in tdoc}
+  query = {'domain_id': domain_id,
+           'doc_type': doc_type,
+           'doc_id': tdoc['doc_id'],
+           'journal.0': {'$exists': True}}
+  total = await document.get_multi_status(**query).count()
+  loop = asyncio.get_event_loop()
+  executor = _get_recalc_executor() if parallel else None
+  num_processes = _get_recalc_processes() if parallel else 1
+  pending = collections.deque()
+  done = 0
+
+  def submit(chunk):
+    if executor:
+      pending.append(loop.run_in_executor(executor, _recalc_chunk, stat_func, stat_tdoc, chunk))
+    else:
+      future = loop.create_future()
+      future.set_result(_recalc_chunk(stat_func, stat_tdoc, chunk))
+      pending.append(future)
+
+  async def write_next():
+    nonlocal done
+    updates = await pending.popleft()
+    await _write_recalc(domain_id, doc_type, tdoc, updates)
+    done += len(updates)
+    _logger.info('Recalculated %d of %d statuses of %s/%s', done, total, domain_id, tid)
+    if progress:
+      await progress(done, total)
+
+  chunk = []
+  tsdocs = document.get_multi_status(**query, fields=PROJECTION_RECALC)
+  async for tsdoc in tsdocs:
+    chunk.append(tsdoc)
+    if len(chunk) >= options.contest_recalc_chunk_size:
+      submit(chunk)
+      chunk = []
+      # Keeps every process busy while bounding the chunks held in memory.
+      if len(pending) > num_processes:
+        await write_next()
+  if chunk:
+    submit(chunk)
+  while pending:
+    await write_next()
+  await invalidate_board(domain_id, doc_type, tid)
+  return done
+
+
+def get_public_rows(rows):
+  """Returns scoreboard rows with the user documents reduced to their public fields."""
+  return [[{**cell, 'raw': {field: cell['raw'][field] for field in user.PROJECTION_PUBLIC
+                            if field in cell['raw']}}
+           if cell['type'] == 'user' and cell.get('raw') else cell
+           for cell in row]
+          for row in rows]
+
+
+class Scoreboard(object):
+  """The status documents of a contest ranked by its rule, updated incrementally.
+
+  The status documents are kept in a rank index ordered by status_sort, with ties broken by uid,
+  so that the rank of a user and a range of the ranked list are found in O(log n).
+  """
+  def __init__(self, tdoc, tsdocs):
+    self.tdoc = tdoc
+    self.rule = RULES[tdoc['rule']]
+    self.tdoc_digest = hashlib.md5(
+        repr([tdoc.get(key) for key in BOARD_TDOC_FIELDS]).encode()).hexdigest()[:8]
+    self.tsdocs = {}  # uid -> tsdoc
+    self.index = rank.RankIndex(tie_len=RANK_TIE_FIELDS.get(tdoc['rule']))
+    self.rev_sum = 0
+    for tsdoc in tsdocs:
+      self.update(tsdoc)
+
+  def _key(self, tsdoc):
+    return tuple(-tsdoc.get(field, 0) if direction < 0 else tsdoc.get(field, 0)
+                 for field, direction in self.rule.status_sort) + (tsdoc['uid'],)
+
+  def __len__(self):
+    return len(self.tsdocs)
+
+  @property
+  def version(self):
+    """A version which changes with every change of the scoreboard.
+
+    Every update of a status document increments its rev, so the version is the same in all
+    processes which have applied the same updates.
+    """
+    return '{0}-{1}-{2}'.format(self.tdoc_digest, len(self.tsdocs), self.rev_sum)
+
+  def update(self, tsdoc):
+    """Puts a status document. Returns False if it is not newer than the current one."""
+    old_tsdoc = self.tsdocs.get(tsdoc['uid'])
+    if old_tsdoc:
+      if tsdoc.get('rev', 0) <= old_tsdoc.get('rev', 0):
+        return False
+      self.index.remove(self._key(old_tsdoc))
+      self.rev_sum -= old_tsdoc.get('rev', 0)
+    self.tsdocs[tsdoc['uid']] = tsdoc
+    self.index.insert(self._key(tsdoc))
+    self.rev_sum += tsdoc.get('rev', 0)
+    return True
+
+  def get_ranked(self, begin=0, end=None):
+    """Returns a slice of the list of (rank, tsdoc)."""
+    return [(r, self.tsdocs[key[-1]]) for r, key in self.index.ranked(begin, end)]
+
+  def get_position(self, uid):
+    """Returns the position of a user in the ranked list from 0, or None if not attended."""
+    tsdoc = self.tsdocs.get(uid)
+    if not tsdoc:
+      return None
+    return self.index.index(self._key(tsdoc))
+
+  def get_ranked_around(self, uid, radius):
+    """Returns the (rank, tsdoc) of a user and up to radius users before and after."""
+    position = self.get_position(uid)
+    if position is None:
+      return []
+    return self.get_ranked(position - radius, position + radius + 1)
+
+
+# (domain_id, doc_type, tid) -> Scoreboard, None if the cache is disabled.
+_boards = None
+# (domain_id, doc_type, tid, freeze_at) -> (version of the live scoreboard, Scoreboard), None if
+# the cache is disabled.
+_frozen_boards = None
+# (domain_id, doc_type, tid) -> status documents received while the scoreboard is loaded.
+_pending_updates = {}
+# (domain_id, doc_type, tid) -> future of loading the scoreboard.
+_loads = {}
+# Incremented on every invalidation so that loads racing with changes are not cached.
+_epoch = 0
+
+
+async def _on_contest_status_change(e):
+  value = e['value']
+  _update_local((value['domain_id'], value['doc_type'], value['tid']), value['tsdoc'])
+
+
+async def _on_contest_change(e):
+  value = e['value']
+  _invalidate_local((value['domain_id'], value['doc_type'], value['tid']))
+
+
+def init():
+  global _boards
+  global _frozen_boards
+  _boards = collections.OrderedDict()
+  _frozen_boards = collections.OrderedDict()
+  bus.subscribe(_on_contest_status_change, ['contest_status_change'])
+  bus.subscribe(_on_contest_change, ['contest_change'])
+
+
+def uninit():
+  global _boards
+  global _frozen_boards
+  bus.unsubscribe(_on_contest_status_change)
+  bus.unsubscribe(_on_contest_change)
+  _boards = None
+  _frozen_boards = None
+
+
+def _update_local(key, tsdoc):
+  if _boards is None:
+    return
+  board = _boards.get(key)
+  if board:
+    board.update(tsdoc)
+  if key in _pending_updates:
+    _pending_updates[key].append(tsdoc)
+
+
+def _invalidate_local(key):
+  global _epoch
+  _epoch += 1
+  if _boards is not None:
+    _boards.pop(key, None)
+  if _frozen_boards is not None:
+    for frozen_key in [frozen_key for frozen_key in _frozen_boards if frozen_key[:3] == key]:
+      del _frozen_boards[frozen_key]
+
+
+async def _publish_status(domain_id, doc_type, tid, tsdoc):
+  tsdoc = {field: tsdoc[field] for field in PROJECTION_BOARD if field in tsdoc}
+  _update_local((domain_id, doc_type, tid), tsdoc)
+  await bus.publish('contest_status_change', {'domain_id': domain_id,
+                                              'doc_type': doc_type,
+                                              'tid': tid,
+                                              'tsdoc': tsdoc})
+
+
+async def invalidate_board(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+  """Drops the cached scoreboards of a contest, after its status documents are rewritten."""
+  _invalidate_local((domain_id, doc_type, tid))
+  await snapshot.delete(domain_id, doc_type, tid)
+  await bus.publish('contest_change', {'domain_id': domain_id,
+                                       'doc_type': doc_type,
+                                       'tid': tid})
+
+
+async def _load_board(key):
+  epoch = _epoch
+  _pending_updates[key] = []
+  try:
+    tdoc, tsdocs = await get_and_list_status(*key, fields=PROJECTION_BOARD)
+    board = Scoreboard(tdoc, tsdocs)
+    for tsdoc in _pending_updates[key]:
+      board.update(tsdoc)
+  finally:
+    del _pending_updates[key]
+    del _loads[key]
+  if epoch == _epoch and _boards is not None:
+    _boards[key] = board
+    while len(_boards) > options.scoreboard_max_entries:
+      _boards.popitem(False)
+  return board
+
+
+async def get_board(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+  """Returns the scoreboard of a contest, cached in the process. Do not modify it."""
+  key = (domain_id, doc_type, tid)
+  if _boards is None:
+    return Scoreboard(*await get_and_list_status(*key, fields=PROJECTION_BOARD))
+  board = _boards.get(key)
+  if board:
+    _boards.move_to_end(key)
+    return board
+  if key not in _loads:
+    _loads[key] = asyncio.ensure_future(_load_board(key))
+  return await asyncio.shield(_loads[key])
+
+
+def _freeze(tdoc, tsdocs, freeze_at):
+  rule = RULES[tdoc['rule']]
+  frozen_tsdocs = []
+  for tsdoc in tsdocs:
+    frozen_tsdoc = {'uid': tsdoc['uid'], 'attend': tsdoc.get('attend'), 'rev': tsdoc.get('rev', 0)}
+    if tsdoc.get('journal'):
+      journal = [j for j in _get_status_journal(tsdoc)
+                 if j['rid'].generation_time.replace(tzinfo=None) <= freeze_at]
+      frozen_tsdoc.update(rule.stat_func(tdoc, journal))
+    frozen_tsdocs.append(frozen_tsdoc)
+  return Scoreboard(tdoc, frozen_tsdocs)
+
+
+async def get_frozen_board(domain_id: str, doc_type: int, tid: objectid.ObjectId,
+                           freeze_at: datetime.datetime, version: str=None):
+  """Returns the scoreboard of a contest as of freeze_at, computed from the journals.
+
+  If version is given, the scoreboard is cached in the process while the live scoreboard has the
+  version. Do not modify it. The statistics are computed in a thread, which keeps the event loop
+  responsive but still holds the GIL while computing.
+  """
+  key = (domain_id, doc_type, tid, freeze_at)
+  if version and _frozen_boards is not None:
+    entry = _frozen_boards.get(key)
+    if entry and entry[0] == version:
+      _frozen_boards.move_to_end(key)
+      return entry[1]
+  epoch = _epoch
+  tdoc, tsdocs = await get_and_list_status(domain_id, doc_type, tid, fields=PROJECTION_FREEZE)
+  board = await asyncio.get_event_loop().run_in_executor(None, _freeze, tdoc, tsdocs, freeze_at)
+  if version and epoch == _epoch and _frozen_boards is not None:
+    _frozen_boards[key] = (version, board)
+    _frozen_boards.move_to_end(key)
+    while len(_frozen_boards) > options.frozen_scoreboard_max_entries:
+      _frozen_boards.popitem(False)
+  return board
 
 
 def _parse_pids(pids_str):
@@ -536,23 +1027,84 @@ class ContestVisibilityMixin(object):
 
 
 class ContestCommonOperationMixin(object):
-  async def get_scoreboard(self, doc_type: int, tid: objectid.ObjectId, is_export: bool=False):
+  async def get_visible_board(self, doc_type: int, tid: objectid.ObjectId):
     if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
       raise error.InvalidArgumentError('doc_type')
-    tdoc, tsdocs = await get_and_list_status(self.domain_id, doc_type, tid)
-    if not self.can_show_scoreboard(tdoc):
+    board = await get_board(self.domain_id, doc_type, tid)
+    if not self.can_show_scoreboard(board.tdoc):
       if doc_type == document.TYPE_CONTEST:
         raise error.ContestScoreboardHiddenError(self.domain_id, tid)
       elif doc_type == document.TYPE_HOMEWORK:
         raise error.HomeworkScoreboardHiddenError(self.domain_id, tid)
+    return board
+
+  async def get_ranked_around(self, tdoc, uid: int, radius: int):
+    """Returns the (rank, tsdoc) around a user and the number of users, if the scoreboard is
+    visible."""
+    if not self.can_show_scoreboard(tdoc):
+      return [], 0
+    board = await get_board(self.domain_id, tdoc['doc_type'], tdoc['doc_id'])
+    return board.get_ranked_around(uid, radius), len(board)
+
+  def get_freeze_at(self, tdoc, freeze_at: int):
+    """Returns the timestamp at which a scoreboard is frozen, or 0 if the scoreboard at that time
+    is live, i.e. it is not before the end of the contest and now.
+
+    The timestamp is rounded down to a multiple of contest_freeze_interval seconds from the
+    beginning of the contest, so that few distinct frozen scoreboards are computed.
+    """
+    if not freeze_at:
+      return 0
+    try:
+      freeze_time = datetime.datetime.utcfromtimestamp(freeze_at)
+    except (OverflowError, OSError, ValueError):
+      raise error.ValidationError('freeze_at')
+    if freeze_time >= min(tdoc['end_at'], self.now):
+      return 0
+    begin_at = calendar.timegm(tdoc['begin_at'].utctimetuple())
+    interval = max(options.contest_freeze_interval, 1)
+    return max(freeze_at - (freeze_at - begin_at) % interval, begin_at)
+
+  def get_scoreboard_etag(self, board, freeze_at: int, *args):
+    """Returns an ETag of a scoreboard frozen at freeze_at, in the language of the request."""
+    return '-'.join(str(arg) for arg in [board.version, freeze_at, self.view_lang, *args])
+
+  def is_board_final(self, tdoc):
+    """Returns whether the scoreboard no longer changes for its viewers, i.e. the contest is done
+    or the scoreboard is hidden by the rule."""
+    return self.is_done(tdoc) or not RULES[tdoc['rule']].show_scoreboard_func(tdoc, self.now)
+
+  async def _render_scoreboard(self, tdoc, ranked_tsdocs, is_export):
+    uids = [tsdoc['uid'] for _, tsdoc in ranked_tsdocs]
     udict, dudict, pdict = await asyncio.gather(
-        user.get_dict([tsdoc['uid'] for tsdoc in tsdocs]),
-        domain.get_dict_user_by_uid(self.domain_id, [tsdoc['uid'] for tsdoc in tsdocs]),
-        problem.get_dict(self.domain_id, tdoc['pids']))
-    ranked_tsdocs = RULES[tdoc['rule']].rank_func(tsdocs)
+        user.get_dict(uids),
+        domain.get_dict_user_by_uid(self.domain_id, uids),
+        problem.get_dict(self.domain_id, tdoc['pids'], fields=problem.PROJECTION_SCOREBOARD))
     rows = RULES[tdoc['rule']].scoreboard_func(is_export, self.translate, tdoc,
                                                        ranked_tsdocs, udict, dudict, pdict)
-    return tdoc, rows, udict
+    return get_public_rows(rows)
+
+  async def get_scoreboard(self, board, is_export: bool=False, begin: int=0, end: int=None,
+                           freeze_at: int=0):
+    """Returns the scoreboard rows of the users ranked begin to end (exclusive), from 0.
+
+    The scoreboard is frozen at the timestamp freeze_at, as returned by get_freeze_at, if it is
+    not 0. Frozen scoreboards are cached in the process. Final scoreboards are rendered once and
+    served from a snapshot until the version of the scoreboard changes.
+    """
+    tdoc = board.tdoc
+    if freeze_at:
+      board = await get_frozen_board(self.domain_id, tdoc['doc_type'], tdoc['doc_id'],
+                                     datetime.datetime.utcfromtimestamp(freeze_at), board.version)
+    if freeze_at or not self.is_board_final(tdoc):
+      return await self._render_scoreboard(tdoc, board.get_ranked(begin, end), is_export)
+    view = snapshot.VIEW_EXPORT if is_export else snapshot.VIEW_PAGE
+    key = (self.domain_id, tdoc['doc_type'], tdoc['doc_id'], view, self.view_lang)
+    sdoc = await snapshot.get(*key)
+    if not sdoc or sdoc['version'] != board.version:
+      rows = await self._render_scoreboard(tdoc, board.get_ranked(), is_export)
+      sdoc = await snapshot.put(*key, board.version, rows)
+    return snapshot.get_rows(sdoc, begin, end)
 
   async def verify_problems(self, pids):
     pdocs = await problem.get_multi(domain_id=self.domain_id, doc_id={'$in': pids},
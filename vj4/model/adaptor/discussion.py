@@ -15,6 +15,8 @@ from vj4.util import validator
 ALLOWED_DOC_TYPES = [document.TYPE_PROBLEM, document.TYPE_PROBLEM_LIST,
                      document.TYPE_CONTEST, document.TYPE_TRAINING]
 
+_nodes_cache = smallcache.register('discussion-nodes', max_entries=1024)
+
 
 def node_id(ddoc):
   if ddoc['parent_doc_type'] == document.TYPE_DISCUSSION_NODE:
@@ -37,13 +39,14 @@ async def initialize(domain_id: str):
 
 @argmethod.wrap
 async def get_nodes(domain_id: str):
-  items = smallcache.get_direct(smallcache.PREFIX_DISCUSSION_NODES + domain_id)
+  items = _nodes_cache.get(domain_id)
   if items is None:
+    version = _nodes_cache.version
     doc = await document.get(domain_id, document.TYPE_DISCUSSION_NODE,
                              document.DOC_ID_DISCUSSION_NODES)
-    items = doc['content'] if doc else []
-    smallcache.set_local_direct(smallcache.PREFIX_DISCUSSION_NODES + domain_id, items)
-  return collections.OrderedDict(items)
+    items = _nodes_cache.set_local(domain_id, doc['content'] if doc else [], version=version)
+  # Categories are copied so that callers can add nodes to them.
+  return collections.OrderedDict((name, list(category)) for name, category in items)
 
 
 async def _update_nodes(domain_id, nodes):
@@ -56,7 +59,7 @@ async def _update_nodes(domain_id, nodes):
                              document.DOC_ID_DISCUSSION_NODES, content=items)
     if not doc:
       raise error.InvalidStateError()
-  await smallcache.unset_global(smallcache.PREFIX_DISCUSSION_NODES + domain_id)
+  await _nodes_cache.unset_global(domain_id)
 
 
 @argmethod.wrap
@@ -172,6 +175,8 @@ async def inc_views(domain_id: str, did: document.convert_doc_id):
 
 @argmethod.wrap
 async def count(domain_id: str, **kwargs):
+  if not kwargs:
+    return await document.count(domain_id, document.TYPE_DISCUSSION)
   return await document.get_multi(domain_id=domain_id, doc_type=document.TYPE_DISCUSSION,
                                   **kwargs).count()
 
@@ -235,12 +240,13 @@ async def get_list_reply(domain_id: str, did: document.convert_doc_id, *, fields
                        .to_list(None)
 
 
-def get_multi_reply(domain_id: str, did: document.convert_doc_id, *, fields=None):
+def get_multi_reply(domain_id: str, did: document.convert_doc_id, *, fields=None, **kwargs):
   return document.get_multi(domain_id=domain_id,
                             doc_type=document.TYPE_DISCUSSION_REPLY,
                             parent_doc_type=document.TYPE_DISCUSSION,
                             parent_doc_id=did,
-                            fields=fields) \
+                            fields=fields,
+                            **kwargs) \
                  .sort([('doc_id', -1)])
 
 
@@ -1,21 +1,30 @@
+import calendar
 import collections
+import copy as _copy
 import datetime
 import itertools
 import random
+import time
 from bson import objectid
 from pymongo import errors
 
 from vj4 import constant
-from vj4 import db
 from vj4 import error
 from vj4.model import builtin
+from vj4.model import datamanifest
 from vj4.model import document
 from vj4.model import domain
 from vj4.model import fs
 from vj4.service import bus
 from vj4.util import argmethod
+from vj4.util import options
+from vj4.util import projection
 from vj4.util import validator
 
+options.define('problem_cache_max_entries', default=1024,
+               help='Maximum number of problems cached in each process.')
+options.define('problem_counter_ttl', default=5.0,
+               help='Seconds before the counters of a cached problem are refreshed.')
 
 SETTING_DIFFICULTY_ALGORITHM = 0
 SETTING_DIFFICULTY_ADMIN = 1
@@ -27,6 +36,96 @@ SETTING_DIFFICULTY_RANGE = collections.OrderedDict([
   (SETTING_DIFFICULTY_AVERAGE, 'Use average of above')
 ])
 
+# Projection profiles.
+PROJECTION_ROW = {'domain_id': 1,
+                  'doc_type': 1,
+                  'doc_id': 1,
+                  'title': 1,
+                  'hidden': 1}
+PROJECTION_LIST = {**PROJECTION_ROW,
+                   'category': 1,
+                   'tag': 1,
+                   'num_submit': 1,
+                   'num_accept': 1,
+                   'difficulty': 1}
+PROJECTION_SCOREBOARD = PROJECTION_ROW
+PROJECTION_DETAIL = None
+
+
+# Counters updated on every submission. Writes to these keys do not invalidate the cache,
+# instead cached values are refreshed from the database after problem_counter_ttl seconds.
+COUNTER_KEYS = ('num_submit', 'num_accept')
+
+# (domain_id, pid) -> [pdoc, counter expire time], None if the cache is disabled.
+_cache = None
+# Incremented on every invalidation so that fetches racing with writes are not cached.
+_epoch = 0
+
+
+async def _on_problem_change(e):
+  _invalidate_local(e['value']['domain_id'], e['value'].get('pid'))
+
+
+def init():
+  global _cache
+  _cache = collections.OrderedDict()
+  bus.subscribe(_on_problem_change, ['problem_change', 'problem_data_change'])
+
+
+def uninit():
+  global _cache
+  bus.unsubscribe(_on_problem_change)
+  _cache = None
+
+
+def _invalidate_local(domain_id, pid=None):
+  global _epoch
+  _epoch += 1
+  if _cache is None:
+    return
+  if pid is None:
+    for key in [key for key in _cache if key[0] == domain_id]:
+      del _cache[key]
+  else:
+    _cache.pop((domain_id, pid), None)
+
+
+async def invalidate(domain_id, pid=None):
+  """Invalidates a cached problem, or all problems in the domain if pid is None."""
+  _invalidate_local(domain_id, pid)
+  await bus.publish('problem_change', {'domain_id': domain_id, 'pid': pid})
+
+
+def _cache_put(key, pdoc):
+  _cache[key] = [pdoc, time.time() + options.problem_counter_ttl]
+  _cache.move_to_end(key)
+  while len(_cache) > options.problem_cache_max_entries:
+    _cache.popitem(False)
+
+
+async def _get_cached(domain_id, pid):
+  key = (domain_id, pid)
+  epoch = _epoch
+  entry = _cache.get(key)
+  if not entry:
+    pdoc = await document.get(domain_id, document.TYPE_PROBLEM, pid)
+    if pdoc and epoch == _epoch and _cache is not None:
+      _cache_put(key, pdoc)
+      pdoc = _copy.deepcopy(pdoc)
+    return pdoc
+  _cache.move_to_end(key)
+  pdoc = entry[0]
+  if entry[1] <= time.time():
+    cdoc = await document.get(domain_id, document.TYPE_PROBLEM, pid,
+                              fields={k: 1 for k in COUNTER_KEYS})
+    if not cdoc:
+      _invalidate_local(domain_id, pid)
+      return None
+    pdoc = {**pdoc, **{k: cdoc[k] for k in COUNTER_KEYS if k in cdoc}}
+    if epoch == _epoch and _cache is not None:
+      _cache_put(key, pdoc)
+  return _copy.deepcopy(pdoc)
+
 
 @argmethod.wrap
 def get_categories():
@@ -42,6 +141,10 @@ async def add(domain_id: str, title: str, content: str, owner_uid: int,
   pid = await document.add(domain_id, content, owner_uid, document.TYPE_PROBLEM,
                            pid, title=title, data=data, category=category, tag=tag,
                            hidden=hidden, num_submit=0, num_accept=0, ac_msg=ac_msg)
+  if type(data) is dict:
+    await datamanifest.link(domain_id, pid, data['domain'], data['pid'])
+  elif data:
+    await datamanifest.set(domain_id, pid, data)
   await domain.inc_user(domain_id, owner_uid, num_problems=1)
   return pid
 
@@ -60,19 +163,23 @@ async def copy(pdoc, dest_domain_id: str, owner_uid: int,
                   pid=pid, hidden=hidden, category=pdoc['category'],
                   data=data, tag=pdoc.get('tag', []),
                   ac_msg=pdoc.get('ac_msg', ''))
-  await document.inc(src_domain_id, document.TYPE_PROBLEM, src_pid, 'num_be_copied', 1)
+  await inc(src_domain_id, src_pid, 'num_be_copied', 1)
   return pid
 
 
 @argmethod.wrap
 async def get(domain_id: str, pid: document.convert_doc_id, uid: int = None):
-  pdoc = await document.get(domain_id, document.TYPE_PROBLEM, pid)
+  if _cache is not None:
+    pdoc = await _get_cached(domain_id, pid)
+  else:
+    pdoc = await document.get(domain_id, document.TYPE_PROBLEM, pid)
   if not pdoc:
     raise error.ProblemNotFoundError(domain_id, pid)
+  document.apply_buffered(pdoc)
   # TODO(twd2): move out:
   if uid is not None:
-    pdoc['psdoc'] = await document.get_status(domain_id, document.TYPE_PROBLEM,
-                                              doc_id=pid, uid=uid)
+    pdoc['psdoc'] = document.apply_buffered_status(
+        await document.get_status(domain_id, document.TYPE_PROBLEM, doc_id=pid, uid=uid))
   else:
     pdoc['psdoc'] = None
   return pdoc
@@ -87,11 +194,14 @@ async def edit(domain_id: str, pid: document.convert_doc_id, **kwargs):
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, **kwargs)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  await invalidate(domain_id, pid)
   return pdoc
 
 
 @argmethod.wrap
 async def count(domain_id: str, **kwargs):
+  if kwargs.keys() <= {'hidden'}:
+    return await document.count(domain_id, document.TYPE_PROBLEM, kwargs.get('hidden'))
   return await document.get_multi(domain_id=domain_id, doc_type=document.TYPE_PROBLEM,
                                   **kwargs).count()
 
@@ -114,7 +224,7 @@ async def get_dict(domain_id, pids, *, fields=None, **kwargs):
   async for pdoc in get_multi(domain_id=domain_id,
                               doc_id={'$in': list(set(pids))},
                               fields=fields, **kwargs):
-    result[pdoc['doc_id']] = pdoc
+    result[pdoc['doc_id']] = projection.guard(pdoc, fields)
   return result
 
 
@@ -129,7 +239,7 @@ async def get_dict_multi_domain(pdom_and_ids, *, fields=None):
   if not query['$or']:
     return result
   async for pdoc in document.get_multi(**query, fields=fields):
-    result[(pdoc['domain_id'], pdoc['doc_id'])] = pdoc
+    result[(pdoc['domain_id'], pdoc['doc_id'])] = projection.guard(pdoc, fields)
   return result
 
 
@@ -149,13 +259,9 @@ def get_multi_status(*, fields=None, **kwargs):
 
 
 async def get_dict_status(domain_id, uid, pids, *, fields=None):
-  result = dict()
-  async for psdoc in get_multi_status(domain_id=domain_id,
-                                      uid=uid,
-                                      doc_id={'$in': list(set(pids))},
-                                      fields=fields):
-    result[psdoc['doc_id']] = psdoc
-  return result
+  sdict = await document.get_dict_status_multi(domain_id, uid,
+                                               [(document.TYPE_PROBLEM, pids)], fields=fields)
+  return sdict[document.TYPE_PROBLEM]
 
 
 @argmethod.wrap
@@ -187,12 +293,13 @@ async def set_solution(domain_id: str, psid: document.convert_doc_id, content: s
   return psdoc
 
 
-def get_multi_solution(domain_id: str, pid: document.convert_doc_id, fields=None):
+def get_multi_solution(domain_id: str, pid: document.convert_doc_id, fields=None, **kwargs):
   return document.get_multi(domain_id=domain_id,
                             doc_type=document.TYPE_PROBLEM_SOLUTION,
                             parent_doc_type=document.TYPE_PROBLEM,
                             parent_doc_id=pid,
-                            fields=fields) \
+                            fields=fields,
+                            **kwargs) \
                  .sort([('vote', -1), ('doc_id', -1)])
 
 
@@ -297,6 +404,8 @@ async def set_data(domain_id: str, pid: document.convert_doc_id, data: objectid.
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, data=data)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  await datamanifest.set(domain_id, pid, data)
+  _invalidate_local(domain_id, pid)
   await bus.publish('problem_data_change', {'domain_id': domain_id, 'pid': pid})
   return pdoc
 
@@ -306,31 +415,58 @@ async def set_hidden(domain_id: str, pid: document.convert_doc_id, hidden: bool)
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, hidden=hidden)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  await invalidate(domain_id, pid)
   return pdoc
 
 
 @argmethod.wrap
-async def get_data_list(last: int):
-  last_datetime = datetime.datetime.utcfromtimestamp(last)
-  # TODO(twd2): performance improve, more elegant
-  coll = db.coll('document')
-  pdocs = coll.find({'doc_type': document.TYPE_PROBLEM})
-  pids = []  # with domain_id
-  async for pdoc in pdocs:
-    data = await get_data(pdoc)
-    if not data:
-      continue
-    date = data['uploadDate']
-    if not date:
-      continue
-    if last_datetime < date:
-      pids.append((pdoc['domain_id'], pdoc['doc_id']))
-  return list(set(pids))
+async def get_data_list(last: int, limit: int=0,
+                        after_at: int=0, after: objectid.ObjectId=None):
+  """Returns a page of the data changed since last, from the data manifest.
+
+  Args:
+    last: the timestamp of the last synchronization, in seconds.
+    limit: the maximum number of entries returned, or 0 for all of them.
+    after_at, after: the cursor of the previous page, in milliseconds and the entry id.
+
+  Returns:
+    A tuple (entries, cursor). The cursor is (after_at, after) of the next page, or None if
+    this is the last page.
+  """
+  after_datetime = None
+  if after_at:
+    after_datetime = datetime.datetime.utcfromtimestamp(0) \
+                     + datetime.timedelta(milliseconds=after_at)
+  mdocs = await datamanifest.get_list(datetime.datetime.utcfromtimestamp(last), limit,
+                                      after_datetime, after)
+  cursor = None
+  if limit and len(mdocs) >= limit:
+    upload_at = mdocs[-1]['upload_at']
+    cursor = (calendar.timegm(upload_at.utctimetuple()) * 1000
+              + upload_at.microsecond // 1000, mdocs[-1]['_id'])
+  return mdocs, cursor
 
 
 @argmethod.wrap
 async def inc(domain_id: str, pid: document.convert_doc_id, key: str, value: int):
-  return await document.inc(domain_id, document.TYPE_PROBLEM, pid, key, value)
+  epoch = _epoch
+  pdoc = await document.inc(domain_id, document.TYPE_PROBLEM, pid, key, value)
+  if key not in COUNTER_KEYS:
+    await invalidate(domain_id, pid)
+  elif pdoc and _cache is not None and epoch == _epoch and (domain_id, pid) in _cache:
+    _cache_put((domain_id, pid), pdoc)
+  return pdoc
+
+
+async def inc_buffered(domain_id: str, pid: document.convert_doc_id, key: str, value: int):
+  """Increments a counter of the problem, written behind. Returns nothing."""
+  assert key in COUNTER_KEYS
+  await document.inc_buffered(domain_id, document.TYPE_PROBLEM, pid, key, value)
+
+
+async def inc_status_buffered(domain_id: str, pid: document.convert_doc_id, uid: int,
+                              key: str, value: int):
+  await document.inc_status_buffered(domain_id, document.TYPE_PROBLEM, pid, uid, key, value)
 
 
 @argmethod.wrap
@@ -2,11 +2,17 @@ from bson import objectid
 from pymongo import errors
 
 from vj4 import error
+from vj4.model import container
 from vj4.model import document
 from vj4.util import argmethod
 from vj4.util import validator
 
 
+def get_pids(dag):
+  """Returns the problems in all nodes of a training."""
+  return [pid for node in dag for pid in node['pids']]
+
+
 @argmethod.wrap
 async def add(domain_id: str, title: str, content: str, owner_uid: int, dag=[], desc=''):
   validator.check_title(title)
@@ -17,8 +23,10 @@ async def add(domain_id: str, title: str, content: str, owner_uid: int, dag=[],
     for nid in node['require_nids']:
       if nid >= node['_id']:
         raise error.ValidationError('dag')
-  return await document.add(domain_id, content, owner_uid, document.TYPE_TRAINING,
-                            title=title, dag=dag, desc=desc, enroll=0)
+  tid = await document.add(domain_id, content, owner_uid, document.TYPE_TRAINING,
+                           title=title, dag=dag, desc=desc, enroll=0)
+  await container.set(domain_id, document.TYPE_TRAINING, tid, get_pids(dag), title)
+  return tid
 
 
 @argmethod.wrap
@@ -42,7 +50,11 @@ async def edit(domain_id: str, tid: objectid.ObjectId, **kwargs):
       for nid in node['require_nids']:
         if nid >= node['_id']:
           raise error.ValidationError('dag')
-  return await document.set(domain_id, document.TYPE_TRAINING, tid, **kwargs)
+  tdoc = await document.set(domain_id, document.TYPE_TRAINING, tid, **kwargs)
+  if tdoc and kwargs.keys() & {'dag', 'title'}:
+    await container.set(domain_id, document.TYPE_TRAINING, tid, get_pids(tdoc['dag']),
+                        tdoc['title'])
+  return tdoc
 
 
 @argmethod.wrap
@@ -59,13 +71,9 @@ def get_multi_status(*, fields=None, **kwargs):
 
 
 async def get_dict_status(domain_id, uid, tids, *, fields=None):
-  result = dict()
-  async for tsdoc in get_multi_status(domain_id=domain_id,
-                                      uid=uid,
-                                      doc_id={'$in': list(set(tids))},
-                                      fields=fields):
-    result[tsdoc['doc_id']] = tsdoc
-  return result
+  sdict = await document.get_dict_status_multi(domain_id, uid,
+                                               [(document.TYPE_TRAINING, tids)], fields=fields)
+  return sdict[document.TYPE_TRAINING]
 
 
 def get_multi(domain_id: str, *, fields=None, **kwargs):
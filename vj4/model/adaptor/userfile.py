@@ -31,7 +31,6 @@ async def get(fid: objectid.ObjectId):
 async def delete(fid: objectid.ObjectId):
   doc = await get(fid)
   result = await document.delete(STORE_DOMAIN_ID, document.TYPE_USERFILE, fid)
-  result = bool(result.deleted_count)
   if result:
     await fs.unlink(doc['file_id'])
   return result
@@ -0,0 +1,80 @@
+"""A reverse index from problems to the contests, homework and trainings containing them.
+
+There is one document per (domain_id, pid), holding a short summary of each container, so that
+the problem detail page reads one small document instead of querying the containers by pids.
+The index is updated by the contest and training adaptors on add and edit, built for existing
+data by vj4.upgrader.from_1_to_2, and rebuilt from scratch by vj4.job.container.
+"""
+from vj4 import db
+from vj4.util import argmethod
+
+
+def _summary(doc_type, doc_id, title, begin_at, end_at):
+  return {'doc_type': doc_type,
+          'doc_id': doc_id,
+          'title': title,
+          'begin_at': begin_at,
+          'end_at': end_at}
+
+
+async def set(domain_id: str, doc_type: int, doc_id, pids, title: str,
+              begin_at=None, end_at=None):
+  """Sets the problems contained by a container, replacing its previous summaries."""
+  coll = db.coll('problem.container')
+  await coll.update_many({'domain_id': domain_id,
+                          'containers': {'$elemMatch': {'doc_type': doc_type,
+                                                        'doc_id': doc_id}}},
+                         {'$pull': {'containers': {'doc_type': doc_type,
+                                                   'doc_id': doc_id}}})
+  pids = list(dict.fromkeys(pids))
+  if not pids:
+    return
+  summary = _summary(doc_type, doc_id, title, begin_at, end_at)
+  bulk = coll.initialize_unordered_bulk_op()
+  for pid in pids:
+    bulk.find({'domain_id': domain_id, 'pid': pid}).upsert().update_one(
+        {'$push': {'containers': summary}})
+  await bulk.execute()
+
+
+@argmethod.wrap
+async def get(domain_id: str, pid):
+  """Returns the summaries of the containers of a problem, newest first."""
+  doc = await db.coll('problem.container').find_one({'domain_id': domain_id, 'pid': pid})
+  if not doc:
+    return []
+  return sorted(doc['containers'], key=lambda summary: summary['doc_id'], reverse=True)
+
+
+async def reset(domain_id: str, tdocs_and_pids):
+  """Replaces the index of a domain.
+
+  Args:
+    domain_id: the domain.
+    tdocs_and_pids: iterable of (tdoc, pids) of all containers in the domain.
+  """
+  containers = {}
+  for tdoc, pids in tdocs_and_pids:
+    summary = _summary(tdoc['doc_type'], tdoc['doc_id'], tdoc['title'],
+                       tdoc.get('begin_at'), tdoc.get('end_at'))
+    for pid in dict.fromkeys(pids):
+      containers.setdefault(pid, []).append(summary)
+  coll = db.coll('problem.container')
+  await coll.delete_many({'domain_id': domain_id})
+  if containers:
+    await coll.insert_many([{'domain_id': domain_id, 'pid': pid, 'containers': summaries}
+                            for pid, summaries in containers.items()])
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('problem.container')
+  await coll.create_index([('domain_id', 1),
+                           ('pid', 1)], unique=True)
+  await coll.create_index([('domain_id', 1),
+                           ('containers.doc_type', 1),
+                           ('containers.doc_id', 1)])
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
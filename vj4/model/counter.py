@@ -0,0 +1,180 @@
+"""Incrementally maintained counts, so that list pages and statistics do not need to scan.
+
+Document counts are kept per (domain_id, doc_type, hidden) and updated by document.add,
+document.delete and document.set. Record counts are kept in time buckets: records are counted
+in hourly buckets, which are rolled up into daily buckets after RECORD_HOUR_DAYS days and into
+monthly buckets after RECORD_DAY_DAYS days.
+
+Document counts of a type in a domain are seeded from the documents by document.count when
+they are first read, since they are missing on deployments which predate them. Record counts are
+seeded by vj4.upgrader.from_1_to_2.
+
+The counts may drift if a process dies between a write and its counter update. They are
+recomputed from scratch by vj4.job.counter.
+"""
+import collections
+import datetime
+
+from pymongo import ReturnDocument
+
+from vj4 import db
+from vj4.util import argmethod
+
+SPAN_HOUR = 'hour'
+SPAN_DAY = 'day'
+SPAN_MONTH = 'month'
+
+RECORD_HOUR_DAYS = 2
+RECORD_DAY_DAYS = 400
+
+
+@argmethod.wrap
+async def inc_document(domain_id: str, doc_type: int, hidden: bool, value: int=1):
+  coll = db.coll('counter.document')
+  doc = await coll.find_one_and_update(filter={'domain_id': domain_id,
+                                               'doc_type': doc_type,
+                                               'hidden': bool(hidden)},
+                                       update={'$inc': {'count': value}},
+                                       upsert=True,
+                                       return_document=ReturnDocument.AFTER)
+  return doc['count']
+
+
+@argmethod.wrap
+async def get_document_count(domain_id: str, doc_type: int, hidden: bool=None):
+  """Returns the number of documents, or only the hidden or visible ones if hidden is given.
+
+  Returns None if the counts of the document type in the domain have not been seeded.
+  """
+  coll = db.coll('counter.document')
+  count = 0
+  seeded = False
+  async for cdoc in coll.find({'domain_id': domain_id, 'doc_type': doc_type},
+                              {'hidden': 1, 'count': 1, 'seeded': 1}):
+    seeded = seeded or cdoc.get('seeded', False)
+    if hidden is None or cdoc['hidden'] == bool(hidden):
+      count += cdoc['count']
+  if not seeded:
+    return None
+  return count
+
+
+async def set_document_counts(domain_id: str, counts, doc_type: int=None):
+  """Replaces the document counts of a domain, and marks them as seeded.
+
+  Args:
+    domain_id: the domain.
+    counts: dict mapping (doc_type, hidden) to count. Missing keys are set to 0.
+    doc_type: if given, only the counts of the document type are replaced.
+  """
+  coll = db.coll('counter.document')
+  query = {'domain_id': domain_id}
+  if doc_type is not None:
+    query['doc_type'] = doc_type
+  async for cdoc in coll.find(query):
+    if (cdoc['doc_type'], cdoc['hidden']) not in counts:
+      await coll.update_one({'_id': cdoc['_id']}, {'$set': {'count': 0, 'seeded': True}})
+  for (doc_type, hidden), count in counts.items():
+    await coll.update_one({'domain_id': domain_id, 'doc_type': doc_type, 'hidden': hidden},
+                          {'$set': {'count': count, 'seeded': True}}, upsert=True)
+
+
+def _floor(at, span):
+  at = at.replace(minute=0, second=0, microsecond=0)
+  if span != SPAN_HOUR:
+    at = at.replace(hour=0)
+  if span == SPAN_MONTH:
+    at = at.replace(day=1)
+  return at
+
+
+def _cutoffs(now):
+  """Returns the begin times of the oldest hourly and daily buckets."""
+  return (_floor(now - datetime.timedelta(days=RECORD_HOUR_DAYS), SPAN_DAY),
+          _floor(now - datetime.timedelta(days=RECORD_DAY_DAYS), SPAN_MONTH))
+
+
+def get_record_bucket(at, now=None):
+  """Returns (span, begin_at) of the bucket in which a record created at the time is counted."""
+  hour_cutoff, day_cutoff = _cutoffs(now or datetime.datetime.utcnow())
+  if at >= hour_cutoff:
+    span = SPAN_HOUR
+  elif at >= day_cutoff:
+    span = SPAN_DAY
+  else:
+    span = SPAN_MONTH
+  return span, _floor(at, span)
+
+
+async def inc_record(at: datetime.datetime=None, value: int=1):
+  coll = db.coll('counter.record')
+  span, begin_at = get_record_bucket(at or datetime.datetime.utcnow())
+  await coll.update_one({'span': span, 'begin_at': begin_at},
+                        {'$inc': {'count': value}}, upsert=True)
+
+
+async def get_record_counts(*begin_ats):
+  """Returns the numbers of records created since each of the times, and the total number.
+
+  Counts are precise to the size of the bucket containing the time: a bucket is counted if it
+  begins at or after the time.
+  """
+  coll = db.coll('counter.record')
+  counts = [0] * len(begin_ats)
+  total = 0
+  async for cdoc in coll.find({}, {'begin_at': 1, 'count': 1}):
+    total += cdoc['count']
+    for i, begin_at in enumerate(begin_ats):
+      if cdoc['begin_at'] >= begin_at:
+        counts[i] += cdoc['count']
+  return counts, total
+
+
+async def set_record_counts(counts):
+  """Replaces all record buckets.
+
+  Args:
+    counts: dict mapping (span, begin_at) to count.
+  """
+  coll = db.coll('counter.record')
+  async for cdoc in coll.find({}, {'span': 1, 'begin_at': 1}):
+    if (cdoc['span'], cdoc['begin_at']) not in counts:
+      await coll.delete_one({'_id': cdoc['_id']})
+  for (span, begin_at), count in counts.items():
+    await coll.update_one({'span': span, 'begin_at': begin_at},
+                          {'$set': {'count': count}}, upsert=True)
+
+
+async def _rollup(coll, span, to_span, cutoff):
+  groups = collections.defaultdict(list)
+  async for cdoc in coll.find({'span': span, 'begin_at': {'$lt': cutoff}}):
+    groups[_floor(cdoc['begin_at'], to_span)].append(cdoc)
+  for begin_at, cdocs in groups.items():
+    await coll.update_one({'span': to_span, 'begin_at': begin_at},
+                          {'$inc': {'count': sum(cdoc['count'] for cdoc in cdocs)}},
+                          upsert=True)
+    await coll.delete_many({'_id': {'$in': [cdoc['_id'] for cdoc in cdocs]}})
+
+
+@argmethod.wrap
+async def rollup_records():
+  """Rolls up expired hourly and daily record buckets."""
+  coll = db.coll('counter.record')
+  hour_cutoff, day_cutoff = _cutoffs(datetime.datetime.utcnow())
+  await _rollup(coll, SPAN_HOUR, SPAN_DAY, hour_cutoff)
+  await _rollup(coll, SPAN_DAY, SPAN_MONTH, day_cutoff)
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  document_coll = db.coll('counter.document')
+  await document_coll.create_index([('domain_id', 1),
+                                    ('doc_type', 1),
+                                    ('hidden', 1)], unique=True)
+  record_coll = db.coll('counter.record')
+  await record_coll.create_index([('span', 1),
+                                  ('begin_at', 1)], unique=True)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
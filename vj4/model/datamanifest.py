@@ -0,0 +1,98 @@
+"""A manifest of the data of all problems, for judges to synchronize.
+
+There is one document per (domain_id, pid) with the resolved data file, its MD5 checksum and its
+upload time. A problem copied from another links to the data of the source problem, which is
+named by data_domain_id and data_pid, and its document is updated with the source. Judges query
+the documents uploaded since their last synchronization by an indexed range on upload_at, and
+may share the data of the same MD5 checksum across problems. The manifest is built for existing
+problems by vj4.upgrader.from_1_to_2, and rebuilt from scratch by vj4.job.datamanifest.
+"""
+import datetime
+
+from vj4 import db
+from vj4.model import fs
+from vj4.util import argmethod
+
+
+def _file_fields(fdoc):
+  if not fdoc:
+    return {'file_id': None, 'md5': None, 'upload_at': None}
+  return {'file_id': fdoc['_id'], 'md5': fdoc['md5'], 'upload_at': fdoc['uploadDate']}
+
+
+async def set(domain_id: str, pid, file_id):
+  """Sets the data of a problem, and of the problems linked to it."""
+  fields = _file_fields(await fs.get_meta(file_id) if file_id else None)
+  coll = db.coll('problem.manifest')
+  await coll.update_one({'domain_id': domain_id, 'pid': pid},
+                        {'$set': {'data_domain_id': domain_id, 'data_pid': pid, **fields}},
+                        upsert=True)
+  await coll.update_many({'data_domain_id': domain_id, 'data_pid': pid}, {'$set': fields})
+
+
+async def link(domain_id: str, pid, data_domain_id: str, data_pid):
+  """Links the data of a problem to the data of another problem."""
+  coll = db.coll('problem.manifest')
+  doc = await coll.find_one({'domain_id': data_domain_id, 'pid': data_pid})
+  if doc:
+    fields = {'file_id': doc['file_id'], 'md5': doc['md5'], 'upload_at': doc['upload_at']}
+  else:
+    fields = _file_fields(None)
+  await coll.update_one({'domain_id': domain_id, 'pid': pid},
+                        {'$set': {'data_domain_id': data_domain_id, 'data_pid': data_pid,
+                                  **fields}},
+                        upsert=True)
+
+
+async def get(domain_id: str, pid):
+  return await db.coll('problem.manifest').find_one({'domain_id': domain_id, 'pid': pid})
+
+
+async def get_list(since: datetime.datetime, limit: int,
+                   after_at: datetime.datetime=None, after=None):
+  """Returns the data uploaded after since, ordered by (upload_at, _id).
+
+  Args:
+    since: the time of the last synchronization.
+    limit: the maximum number of documents returned, or 0 for all of them.
+    after_at, after: upload_at and _id of the last document of the previous page, if any.
+  """
+  query = {'upload_at': {'$gt': since}}
+  if after_at:
+    query['$or'] = [{'upload_at': {'$gt': after_at}},
+                    {'upload_at': after_at, '_id': {'$gt': after}}]
+  return await db.coll('problem.manifest').find(query) \
+                                          .sort([('upload_at', 1), ('_id', 1)]) \
+                                          .limit(limit) \
+                                          .to_list()
+
+
+async def reset(domain_id: str, entries):
+  """Replaces the manifest of a domain.
+
+  Args:
+    domain_id: the domain.
+    entries: iterable of (pid, data_domain_id, data_pid, fdoc) of all problems with data.
+  """
+  coll = db.coll('problem.manifest')
+  await coll.delete_many({'domain_id': domain_id})
+  docs = [{'domain_id': domain_id, 'pid': pid,
+           'data_domain_id': data_domain_id, 'data_pid': data_pid, **_file_fields(fdoc)}
+          for pid, data_domain_id, data_pid, fdoc in entries]
+  if docs:
+    await coll.insert_many(docs)
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('problem.manifest')
+  await coll.create_index([('domain_id', 1),
+                           ('pid', 1)], unique=True)
+  await coll.create_index([('data_domain_id', 1),
+                           ('data_pid', 1)])
+  await coll.create_index([('upload_at', 1),
+                           ('_id', 1)])
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
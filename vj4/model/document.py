@@ -3,6 +3,8 @@ from bson import objectid
 from pymongo import ReturnDocument
 
 from vj4 import db
+from vj4.model import counter
+from vj4.service import incbuffer
 from vj4.util import argmethod
 
 TYPE_PROBLEM = 10
@@ -57,6 +59,7 @@ async def add(domain_id: str, content: str, owner_uid: int,
     assert parent_doc_type and parent_doc_id
     doc['parent_doc_type'], doc['parent_doc_id'] = parent_doc_type, parent_doc_id
   await coll.insert_one(doc)
+  await counter.inc_document(domain_id, doc_type, doc.get('hidden', False), 1)
   return doc['doc_id']
 
 
@@ -70,6 +73,17 @@ async def get(domain_id: str, doc_type: int, doc_id: convert_doc_id, fields=None
 
 async def set(domain_id: str, doc_type: int, doc_id: convert_doc_id, **kwargs):
   coll = db.coll('document')
+  if 'hidden' in kwargs:
+    # Flip the hidden flag separately so that only the writer which changed it moves the count.
+    hidden = bool(kwargs['hidden'])
+    result = await coll.update_one({'domain_id': domain_id,
+                                    'doc_type': doc_type,
+                                    'doc_id': doc_id,
+                                    'hidden': {'$ne': True} if hidden else True},
+                                   {'$set': {'hidden': hidden}})
+    if result.modified_count:
+      await counter.inc_document(domain_id, doc_type, not hidden, -1)
+      await counter.inc_document(domain_id, doc_type, hidden, 1)
   doc = await coll.find_one_and_update(filter={'domain_id': domain_id,
                                                'doc_type': doc_type,
                                                'doc_id': doc_id},
@@ -81,17 +95,52 @@ async def set(domain_id: str, doc_type: int, doc_id: convert_doc_id, **kwargs):
 async def delete(domain_id: str, doc_type: int, doc_id: convert_doc_id):
   # TODO(twd2): delete status?
   coll = db.coll('document')
-  return await coll.delete_one({'domain_id': domain_id,
-                                'doc_type': doc_type,
-                                'doc_id': doc_id})
+  doc = await coll.find_one_and_delete(filter={'domain_id': domain_id,
+                                               'doc_type': doc_type,
+                                               'doc_id': doc_id},
+                                       projection={'hidden': 1})
+  if not doc:
+    return False
+  await counter.inc_document(domain_id, doc_type, doc.get('hidden', False), -1)
+  return True
 
 
 async def delete_multi(domain_id: str, doc_type: int, **kwargs):
   # TODO(twd2): delete status?
   coll = db.coll('document')
-  return await coll.delete_many({'domain_id': domain_id,
-                                 'doc_type': doc_type,
-                                 **kwargs})
+  result = await coll.delete_many({'domain_id': domain_id,
+                                   'doc_type': doc_type,
+                                   **kwargs})
+  if result.deleted_count:
+    await recount(domain_id, doc_type)
+  return result
+
+
+async def recount(domain_id: str, doc_type: int=None):
+  """Recomputes the document counts of a domain, or of one document type in it."""
+  query = {'domain_id': domain_id}
+  if doc_type is not None:
+    query['doc_type'] = doc_type
+  pipeline = [
+    {'$match': query},
+    {'$group': {'_id': {'doc_type': '$doc_type', 'hidden': {'$eq': ['$hidden', True]}},
+                'count': {'$sum': 1}}}
+  ]
+  counts = dict()
+  if doc_type is not None:
+    counts[(doc_type, False)] = counts[(doc_type, True)] = 0
+  async for adoc in await db.coll('document').aggregate(pipeline):
+    counts[(adoc['_id']['doc_type'], adoc['_id']['hidden'])] = adoc['count']
+  await counter.set_document_counts(domain_id, counts, doc_type)
+
+
+async def count(domain_id: str, doc_type: int, hidden: bool=None):
+  """Returns the number of documents from the maintained counts, seeding them if missing."""
+  num = await counter.get_document_count(domain_id, doc_type, hidden)
+  if num is None:
+    await recount(domain_id, doc_type)
+    num = await counter.get_document_count(domain_id, doc_type, hidden)
+  return num
 
 
 def get_multi(*, fields=None, **kwargs):
@@ -115,6 +164,27 @@ async def get_dict(domain_id: str, dtuples, *, fields=None):
   return result
 
 
+async def get_dict_multi(domain_id: str, dtuples, *, fields=None):
+  """Gets documents of several types in one query.
+
+  Args:
+    domain_id: the domain.
+    dtuples: iterable of (doc_type, doc_ids).
+    fields: projection, which must include doc_type and doc_id.
+
+  Returns:
+    dict mapping each requested doc_type to a dict from doc_id to document.
+  """
+  result = dict()
+  pairs = []
+  for doc_type, doc_ids in dtuples:
+    result.setdefault(doc_type, dict())
+    pairs.extend((doc_type, doc_id) for doc_id in doc_ids)
+  for (doc_type, doc_id), doc in (await get_dict(domain_id, pairs, fields=fields)).items():
+    result[doc_type][doc_id] = doc
+  return result
+
+
 @argmethod.wrap
 async def inc(domain_id: str, doc_type: int, doc_id: convert_doc_id, key: str, value: int):
   coll = db.coll('document')
@@ -126,6 +196,23 @@ async def inc(domain_id: str, doc_type: int, doc_id: convert_doc_id, key: str, v
   return doc
 
 
+async def inc_buffered(domain_id: str, doc_type: int, doc_id: convert_doc_id, key: str,
+                       value: int):
+  """Like inc, but the increment is buffered and written behind. Returns nothing."""
+  await incbuffer.inc('document', {'domain_id': domain_id,
+                                   'doc_type': doc_type,
+                                   'doc_id': doc_id}, {key: value})
+
+
+def apply_buffered(doc):
+  """Applies the buffered increments of this process to a document."""
+  if not doc:
+    return doc
+  return incbuffer.apply('document', {'domain_id': doc['domain_id'],
+                                      'doc_type': doc['doc_type'],
+                                      'doc_id': doc['doc_id']}, doc)
+
+
 @argmethod.wrap
 async def inc_and_set(domain_id: str, doc_type: int, doc_id: convert_doc_id,
                       inc_key: str, inc_value: int, set_key: str, set_value: lambda _: _):
@@ -235,6 +322,36 @@ def get_multi_status(*, fields=None, **kwargs):
   return coll.find(kwargs, projection=fields)
 
 
+async def get_dict_status_multi(domain_id: str, uid: int, dtuples, *, fields=None):
+  """Gets status documents of a user for documents of several types in one query.
+
+  Args:
+    domain_id: the domain.
+    uid: the user.
+    dtuples: iterable of (doc_type, doc_ids).
+    fields: projection, which must include doc_type and doc_id.
+
+  Returns:
+    dict mapping each requested doc_type to a dict from doc_id to status document.
+  """
+  query = {'$or': []}
+  result = dict()
+  for doc_type, doc_ids in dtuples:
+    result.setdefault(doc_type, dict())
+    doc_ids = list(set(doc_ids))
+    if doc_ids:
+      query['$or'].append({'domain_id': domain_id, 'doc_type': doc_type, 'uid': uid,
+                           'doc_id': {'$in': doc_ids}})
+  if not query['$or']:
+    return result
+  async for sdoc in get_multi_status(**query, fields=fields).hint([('domain_id', 1),
+                                                                   ('doc_type', 1),
+                                                                   ('uid', 1),
+                                                                   ('doc_id', 1)]):
+    result[sdoc['doc_type']][sdoc['doc_id']] = sdoc
+  return result
+
+
 async def set_status(domain_id, doc_type, doc_id, uid, **kwargs):
   coll = db.coll('document.status')
   doc = await coll.find_one_and_update(filter={'domain_id': domain_id,
@@ -301,15 +418,52 @@ async def inc_status(domain_id: str, doc_type: int, doc_id: convert_doc_id, uid:
   return doc
 
 
-async def rev_push_status(domain_id, doc_type, doc_id, uid, key, value):
+async def inc_status_buffered(domain_id: str, doc_type: int, doc_id: convert_doc_id, uid: int,
+                              key: str, value: int):
+  """Like inc_status, but the increment is buffered and written behind. Returns nothing."""
+  await incbuffer.inc('document.status', {'domain_id': domain_id,
+                                          'doc_type': doc_type,
+                                          'doc_id': doc_id,
+                                          'uid': uid}, {key: value}, upsert=True)
+
+
+def apply_buffered_status(sdoc):
+  """Applies the buffered increments of this process to a status document."""
+  if not sdoc:
+    return sdoc
+  return incbuffer.apply('document.status', {'domain_id': sdoc['domain_id'],
+                                             'doc_type': sdoc['doc_type'],
+                                             'doc_id': sdoc['doc_id'],
+                                             'uid': sdoc['uid']}, sdoc)
+
+
+async def rev_push_status(domain_id, doc_type, doc_id, uid, key, value, **kwargs):
   coll = db.coll('document.status')
+  update = {'$push': {key: value},
+            '$inc': {'rev': 1}}
+  if kwargs:
+    update['$set'] = kwargs
   doc = await coll.find_one_and_update(filter={'domain_id': domain_id,
                                                'doc_type': doc_type,
                                                'doc_id': doc_id,
                                                'uid': uid},
+                                       update=update,
+                                       upsert=True,
+                                       return_document=ReturnDocument.AFTER)
+  return doc
+
+
+async def rev_push_set_status(domain_id, doc_type, doc_id, uid, rev, key, value, **kwargs):
+  """Pushes a value and sets fields of a status document, if its revision is rev."""
+  coll = db.coll('document.status')
+  doc = await coll.find_one_and_update(filter={'domain_id': domain_id,
+                                               'doc_type': doc_type,
+                                               'doc_id': doc_id,
+                                               'uid': uid,
+                                               'rev': rev},
                                        update={'$push': {key: value},
+                                               '$set': kwargs,
                                                '$inc': {'rev': 1}},
-                                       upsert=True,
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -344,6 +498,29 @@ async def rev_set_status(domain_id, doc_type, doc_id, uid, rev, return_doc=True,
     return result
 
 
+async def rev_set_status_multi(domain_id, doc_type, doc_id, updates):
+  """Sets fields of status documents with an unordered bulk, each if its revision matches.
+
+  Args:
+    updates: list of (uid, rev, fields).
+
+  Returns:
+    The number of status documents modified.
+  """
+  if not updates:
+    return 0
+  coll = db.coll('document.status')
+  bulk = coll.initialize_unordered_bulk_op()
+  for uid, rev, fields in updates:
+    bulk.find({'domain_id': domain_id,
+               'doc_type': doc_type,
+               'doc_id': doc_id,
+               'uid': uid,
+               'rev': rev}).update_one({'$set': fields, '$inc': {'rev': 1}})
+  result = await bulk.execute()
+  return result['nModified']
+
+
 @argmethod.wrap
 async def ensure_indexes():
   coll = db.coll('document')
@@ -8,6 +8,8 @@ from vj4 import db
 from vj4 import error
 from vj4.model import builtin
 from vj4.model import system
+from vj4.service import incbuffer
+from vj4.service import smallcache
 from vj4.util import argmethod
 from vj4.util import validator
 
@@ -17,6 +19,9 @@ PROJECTION_PUBLIC = {
   'gravatar': 1
 }
 
+_cache = smallcache.register('domain', max_entries=1024, ttl=600)
+_roles_cache = smallcache.register('domain-roles', max_entries=1024)
+
 
 @argmethod.wrap
 async def add(domain_id: str, owner_uid: int,
@@ -58,17 +63,26 @@ async def add_continue(domain_id: str, ensure_owner_uid: int=None):
   coll = db.coll('domain')
   await coll.update_one({'_id': domain_id},
                         {'$unset': {'pending': ''}})
+  await _cache.unset_global(domain_id)
 
 
 @argmethod.wrap
 async def get(domain_id: str, fields=None):
+  """Get a domain. The returned document is shared and must not be modified."""
   for domain in builtin.DOMAINS:
     if domain['_id'] == domain_id:
       return domain
+  if fields is None:
+    ddoc = _cache.get(domain_id)
+    if ddoc:
+      return ddoc
+  version = _cache.version
   coll = db.coll('domain')
   ddoc = await coll.find_one(domain_id, fields)
   if not ddoc:
     raise error.DomainNotFoundError(domain_id)
+  if fields is None:
+    ddoc = _cache.set_local(domain_id, ddoc, version=version)
   return ddoc
 
 
@@ -98,17 +112,21 @@ async def edit(domain_id: str, **kwargs):
   if 'name' in kwargs:
     validator.check_name(kwargs['name'])
   # TODO(twd2): check kwargs
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': {**kwargs}},
                                         return_document=ReturnDocument.AFTER)
+  await _cache.unset_global(domain_id)
+  return ddoc
 
 
 async def unset(domain_id, fields):
   # TODO(twd2): check fields
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict((f, '') for f in set(fields))},
                                         return_document=ReturnDocument.AFTER)
+  await _cache.unset_global(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -148,9 +166,11 @@ async def set_roles(domain_id: str, roles):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': update},
                                         return_document=ReturnDocument.AFTER)
+  await _cache.unset_global(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -171,10 +191,12 @@ async def delete_roles(domain_id: str, roles):
   await user_coll.update_many({'domain_id': domain_id, 'role': {'$in': list(roles)}},
                               {'$unset': {'role': ''}})
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict(('roles.{0}'.format(role), '')
                                                                for role in roles)},
                                         return_document=ReturnDocument.AFTER)
+  await _cache.unset_global(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -183,15 +205,20 @@ async def transfer(domain_id: str, old_owner_uid: int, new_owner_uid: int):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
                                         update={'$set': {'owner_uid': new_owner_uid}},
                                         return_document=ReturnDocument.AFTER)
+  await _cache.unset_global(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
 async def get_user(domain_id: str, uid: int, fields=None):
   coll = db.coll('domain.user')
-  return await coll.find_one({'domain_id': domain_id, 'uid': uid}, fields)
+  dudoc = await coll.find_one({'domain_id': domain_id, 'uid': uid}, fields)
+  if fields is None:
+    dudoc = incbuffer.apply('domain.user', {'domain_id': domain_id, 'uid': uid}, dudoc)
+  return dudoc
 
 
 async def set_user(domain_id, uid, **kwargs):
@@ -269,6 +296,11 @@ async def inc_user(domain_id, uid, **kwargs):
                                         return_document=ReturnDocument.AFTER)
 
 
+async def inc_user_buffered(domain_id, uid, **kwargs):
+  """Like inc_user, but the increments are buffered and written behind. Returns nothing."""
+  await incbuffer.inc('domain.user', {'domain_id': domain_id, 'uid': uid}, kwargs, upsert=True)
+
+
 async def inc_user_usage(domain_id: str, uid: int, usage_field: str, usage: int, quota: int):
   coll = db.coll('domain.user')
   try:
@@ -302,9 +334,18 @@ async def get_dict_user_by_domain_id(uid, *, fields=None):
 
 
 def get_all_roles(ddoc):
-  builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
+  """Get all roles of a domain. The returned dict is shared and must not be modified."""
   domain_roles = ddoc['roles']
-  return {**builtin_roles, **domain_roles}
+  entry = _roles_cache.get(ddoc['_id'])
+  # Cached documents are shared, so the role table is valid as long as it was computed from
+  # the very same roles object.
+  if entry and entry[0] is domain_roles:
+    return entry[1]
+  builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
+  roles = {**builtin_roles, **domain_roles}
+  if isinstance(domain_roles, smallcache.FrozenDict):
+    roles = _roles_cache.set_local(ddoc['_id'], (domain_roles, roles))[1]
+  return roles
 
 
 def get_join_settings(ddoc, now):
@@ -354,7 +395,8 @@ async def ensure_indexes():
   await user_coll.create_index([('domain_id', 1),
                                 ('rp', -1)])
   await user_coll.create_index([('domain_id', 1),
-                                ('rank', 1)])
+                                ('rank', 1),
+                                ('uid', 1)])
 
 
 if __name__ == '__main__':
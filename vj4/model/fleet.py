@@ -0,0 +1,147 @@
+"""Registry of the connected judges.
+
+Each judge connection has a document with its heartbeat time, its concurrency, the number of
+records it is judging, statistics of the records it judged and of their wait in the queue. A
+sweeper running in every server process requeues the records of judges which missed their
+heartbeats, and records which have been judged for longer than judge_deadline seconds.
+"""
+import asyncio
+import datetime
+import logging
+
+from vj4 import db
+from vj4.model import record
+from vj4.util import argmethod
+from vj4.util import options
+
+options.define('judge_heartbeat_timeout', default=120,
+               help='Seconds without a heartbeat before a judge is considered dead.')
+options.define('judge_deadline', default=900,
+               help='Seconds a record may be judged before it is requeued.')
+options.define('judge_sweep_interval', default=30,
+               help='Seconds between sweeps of dead judges and stuck records.')
+
+_logger = logging.getLogger(__name__)
+
+_sweeper = None
+
+
+async def add(token: str, uid: int, ip: str):
+  now = datetime.datetime.utcnow()
+  await db.coll('fleet').insert_one({'_id': token,
+                                     'uid': uid,
+                                     'ip': ip,
+                                     'begin_at': now,
+                                     'heartbeat_at': now,
+                                     'concurrency': 0,
+                                     'in_flight': 0,
+                                     'num_begun': 0,
+                                     'num_judged': 0,
+                                     'total_ms': 0,
+                                     'max_ms': 0,
+                                     'total_wait_ms': 0})
+
+
+async def heartbeat(token: str):
+  await db.coll('fleet').update_one({'_id': token},
+                                    {'$set': {'heartbeat_at': datetime.datetime.utcnow()}})
+
+
+async def set_concurrency(token: str, concurrency: int):
+  await db.coll('fleet').update_one({'_id': token}, {'$set': {'concurrency': concurrency}})
+
+
+async def begin_judge(token: str, wait_ms: int=0):
+  await db.coll('fleet').update_one({'_id': token}, {'$inc': {'in_flight': 1,
+                                                              'num_begun': 1,
+                                                              'total_wait_ms': wait_ms}})
+
+
+async def end_judge(token: str, judge_ms: int=None):
+  """Counts a record judged in judge_ms, or taken back from the judge if judge_ms is None."""
+  update = {'$inc': {'in_flight': -1}}
+  if judge_ms is not None:
+    update['$inc'].update({'num_judged': 1, 'total_ms': judge_ms})
+    update['$max'] = {'max_ms': judge_ms}
+  await db.coll('fleet').update_one({'_id': token}, update)
+
+
+async def delete(token: str):
+  await db.coll('fleet').delete_one({'_id': token})
+
+
+@argmethod.wrap
+async def get_all():
+  """Returns the state of all judges, with their throughput and average latency."""
+  now = datetime.datetime.utcnow()
+  jdocs = await db.coll('fleet').find().sort('begin_at', 1).to_list()
+  for jdoc in jdocs:
+    uptime = max((now - jdoc['begin_at']).total_seconds(), 1)
+    jdoc['throughput'] = jdoc['num_judged'] * 60 / uptime
+    jdoc['average_ms'] = jdoc['total_ms'] // jdoc['num_judged'] if jdoc['num_judged'] else 0
+    jdoc['average_wait_ms'] = \
+        jdoc['total_wait_ms'] // jdoc['num_begun'] if jdoc['num_begun'] else 0
+    jdoc['alive'] = (now - jdoc['heartbeat_at']).total_seconds() \
+                    < options.judge_heartbeat_timeout
+  return jdocs
+
+
+async def _requeue_all(rdocs):
+  count = 0
+  async for rdoc in rdocs:
+    if await record.requeue(rdoc['_id'], rdoc['judge_token']):
+      count += 1
+  return count
+
+
+@argmethod.wrap
+async def sweep():
+  """Requeues the records of dead judges and stuck records. Returns the number requeued."""
+  now = datetime.datetime.utcnow()
+  count = 0
+  dead_before = now - datetime.timedelta(seconds=options.judge_heartbeat_timeout)
+  async for jdoc in db.coll('fleet').find({'heartbeat_at': {'$lt': dead_before}}):
+    # Only the process which removes the judge requeues its records.
+    if await db.coll('fleet').find_one_and_delete({'_id': jdoc['_id'],
+                                                   'heartbeat_at': jdoc['heartbeat_at']}):
+      _logger.warning('Judge %s (uid %d) is dead', jdoc['_id'], jdoc['uid'])
+      count += await _requeue_all(record.get_multi_judging(
+          judge_token=jdoc['_id'], fields={'_id': 1, 'judge_token': 1}))
+  deadline = now - datetime.timedelta(seconds=options.judge_deadline)
+  count += await _requeue_all(record.get_multi_judging(
+      judge_at_before=deadline, fields={'_id': 1, 'judge_token': 1}))
+  if count:
+    _logger.warning('Requeued %d records', count)
+  return count
+
+
+async def _sweep_forever():
+  while True:
+    await asyncio.sleep(options.judge_sweep_interval)
+    try:
+      await sweep()
+    except Exception:
+      _logger.exception('Failed to sweep judges')
+
+
+def init():
+  global _sweeper
+  _sweeper = asyncio.get_event_loop().create_task(_sweep_forever())
+
+
+def uninit():
+  global _sweeper
+  if _sweeper:
+    _sweeper.cancel()
+    _sweeper = None
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('fleet')
+  await coll.create_index([('uid', 1)])
+  await coll.create_index([('heartbeat_at', 1)])
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
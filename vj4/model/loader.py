@@ -0,0 +1,144 @@
+"""Request-scoped batching loader for point lookups.
+
+Lookups issued through a loader in the same event loop iteration are coalesced into one
+$in query per collection. A memoizing loader (one per request) also remembers the results
+for the rest of its lifetime, while a non-memoizing loader (shared by connections) forgets
+them as soon as the batch is resolved.
+
+Documents returned by a loader are shared between all callers, so they must not be
+modified in place.
+"""
+import asyncio
+import collections
+
+from vj4 import error
+from vj4.model import document
+from vj4.model import domain
+from vj4.model import user
+
+
+class _Batch(object):
+  def __init__(self, batch_func, memoize):
+    self.batch_func = batch_func
+    self.memoize = memoize
+    self.futures = {}
+    self.keys = []
+
+  def load(self, key):
+    future = self.futures.get(key)
+    if future:
+      return future
+    loop = asyncio.get_event_loop()
+    future = self.futures[key] = loop.create_future()
+    if not self.keys:
+      loop.call_soon(self._dispatch)
+    self.keys.append(key)
+    return future
+
+  def _dispatch(self):
+    keys, self.keys = self.keys, []
+    asyncio.ensure_future(self._run(keys))
+
+  async def _run(self, keys):
+    try:
+      result = await self.batch_func(keys)
+    except Exception as e:
+      for key in keys:
+        self.futures.pop(key).set_exception(e)
+      return
+    for key in keys:
+      if self.memoize:
+        future = self.futures[key]
+      else:
+        future = self.futures.pop(key)
+      future.set_result(result.get(key))
+
+
+async def _get_users(uids):
+  return await user.get_dict(uids)
+
+
+async def _get_domain_users(keys):
+  uids_by_domain = collections.defaultdict(list)
+  for domain_id, uid in keys:
+    uids_by_domain[domain_id].append(uid)
+  domain_ids = list(uids_by_domain.keys())
+  dudicts = await asyncio.gather(*[domain.get_dict_user_by_uid(domain_id,
+                                                               uids_by_domain[domain_id])
+                                   for domain_id in domain_ids])
+  result = dict()
+  for domain_id, dudict in zip(domain_ids, dudicts):
+    for uid, dudoc in dudict.items():
+      result[(domain_id, uid)] = dudoc
+  return result
+
+
+async def _get_documents(keys):
+  dtuples_by_domain = collections.defaultdict(list)
+  for domain_id, doc_type, doc_id in keys:
+    dtuples_by_domain[domain_id].append((doc_type, doc_id))
+  domain_ids = list(dtuples_by_domain.keys())
+  ddicts = await asyncio.gather(*[document.get_dict(domain_id, dtuples_by_domain[domain_id])
+                                  for domain_id in domain_ids])
+  result = dict()
+  for domain_id, ddict in zip(domain_ids, ddicts):
+    for (doc_type, doc_id), doc in ddict.items():
+      result[(domain_id, doc_type, doc_id)] = doc
+  return result
+
+
+async def _get_statuses(keys):
+  doc_ids_by_group = collections.defaultdict(lambda: collections.defaultdict(list))
+  for domain_id, doc_type, doc_id, uid in keys:
+    doc_ids_by_group[(domain_id, uid)][doc_type].append(doc_id)
+  groups = list(doc_ids_by_group.keys())
+  sdicts = await asyncio.gather(*[document.get_dict_status_multi(
+                                      domain_id, uid, doc_ids_by_group[(domain_id, uid)].items())
+                                  for domain_id, uid in groups])
+  result = dict()
+  for (domain_id, uid), sdict in zip(groups, sdicts):
+    for doc_type, sdocs in sdict.items():
+      for doc_id, sdoc in sdocs.items():
+        result[(domain_id, doc_type, doc_id, uid)] = sdoc
+  return result
+
+
+class Loader(object):
+  def __init__(self, *, memoize=True):
+    self._users = _Batch(_get_users, memoize)
+    self._domain_users = _Batch(_get_domain_users, memoize)
+    self._documents = _Batch(_get_documents, memoize)
+    self._statuses = _Batch(_get_statuses, memoize)
+
+  def get_user(self, uid):
+    """Returns a future of the user document (PROJECTION_VIEW), or None."""
+    return self._users.load(uid)
+
+  def get_domain_user(self, domain_id, uid):
+    """Returns a future of the domain user document, or None."""
+    return self._domain_users.load((domain_id, uid))
+
+  def get_document(self, domain_id, doc_type, doc_id):
+    """Returns a future of the document, or None."""
+    return self._documents.load((domain_id, doc_type, doc_id))
+
+  def get_status(self, domain_id, doc_type, doc_id, uid):
+    """Returns a future of the document status, or None."""
+    return self._statuses.load((domain_id, doc_type, doc_id, uid))
+
+  async def get_problem(self, domain_id, pid):
+    pdoc = await self.get_document(domain_id, document.TYPE_PROBLEM, pid)
+    if not pdoc:
+      raise error.ProblemNotFoundError(domain_id, pid)
+    return pdoc
+
+
+_shared = None
+
+
+def shared():
+  """Returns the process-wide non-memoizing loader, to be used by long-lived connections."""
+  global _shared
+  if not _shared:
+    _shared = Loader(memoize=False)
+  return _shared
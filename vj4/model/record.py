@@ -1,21 +1,251 @@
 import asyncio
+import collections
 import datetime
+import hashlib
 from bson import objectid
 from pymongo import ReturnDocument
 
 from vj4 import constant
 from vj4 import db
+from vj4.model import counter
+from vj4.model import datamanifest
 from vj4.model import document
 from vj4.model import domain
+from vj4.model import fs
 from vj4.model.adaptor import problem
 from vj4.service import bus
 from vj4.service import queue
 from vj4.util import argmethod
+from vj4.util import options
+from vj4.util import projection
 from vj4.util import validator
 
 PROJECTION_PUBLIC = {'code': 0}
+PROJECTION_LIST = {'_id': 1,
+                   'hidden': 1,
+                   'status': 1,
+                   'score': 1,
+                   'time_ms': 1,
+                   'memory_kb': 1,
+                   'progress': 1,
+                   'domain_id': 1,
+                   'pid': 1,
+                   'uid': 1,
+                   'lang': 1,
+                   'type': 1,
+                   'ttype': 1,
+                   'tid': 1}
 PROJECTION_ALL = None
 
+options.define('record_state_max_entries', default=4096,
+               help='Maximum number of records whose state is cached in each process.')
+options.define('judge_user_share', default=4,
+               help='Number of pending records of a user which are judged before others.')
+options.define('judge_domain_share', default=64,
+               help='Number of pending records of a domain which are judged before others.')
+options.define('record_dedup_window', default=86400,
+               help='Seconds within which a judged record may be a duplicate of a submission.')
+
+# Judge queue priorities.
+JUDGE_PRIORITY_REJUDGE = 0
+JUDGE_PRIORITY_PRETEST = 1
+JUDGE_PRIORITY_SUBMISSION = 2
+JUDGE_PRIORITY_CONTEST = 3
+
+_CODE_BATCH_SIZE = 64
+
+# Policies of a domain (ddoc['dedup_policy']) for a submission with the same language, code
+# and data as a record judged recently.
+DEDUP_POLICY_NONE = 0  # judged as usual.
+DEDUP_POLICY_DEPRIORITIZE = 1  # judged with the lowest priority.
+DEDUP_POLICY_REUSE = 2  # completed with the verdict of the judged record when dispatched.
+DEDUP_POLICY_RANGE = collections.OrderedDict([
+  (DEDUP_POLICY_NONE, 'Judge as usual'),
+  (DEDUP_POLICY_DEPRIORITIZE, 'Judge with low priority'),
+  (DEDUP_POLICY_REUSE, 'Reuse the verdict'),
+])
+
+# Verdicts which depend only on the language, code and data.
+_REUSABLE_STATUSES = [constant.record.STATUS_ACCEPTED,
+                      constant.record.STATUS_WRONG_ANSWER,
+                      constant.record.STATUS_TIME_LIMIT_EXCEEDED,
+                      constant.record.STATUS_MEMORY_LIMIT_EXCEEDED,
+                      constant.record.STATUS_OUTPUT_LIMIT_EXCEEDED,
+                      constant.record.STATUS_RUNTIME_ERROR,
+                      constant.record.STATUS_COMPILE_ERROR]
+_REUSE_FIELDS = ['status', 'score', 'time_ms', 'memory_kb',
+                 'compiler_texts', 'judge_texts', 'cases']
+
+# Records are published on the bus as record_change deltas instead of whole documents. Every
+# write to a record increments its rev, and its delta is one of:
+#   {'_id', 'rev', 'full': True, 'set'}: a new record, set is the record without code.
+#   {'_id', 'rev', 'prev', 'set', 'unset', 'push'}: applies to the record at rev prev, fields
+#       in unset are removed, then fields in set are set, then values in push are appended.
+#   {'_id', 'rev'}: the record changed, the subscriber must fetch it.
+# Subscribers get the record with get_state(delta), which applies deltas to a per-process cache.
+
+# rid -> record without code, None if the cache is disabled.
+_states = None
+# rid -> future of fetching the record.
+_fetches = {}
+
+
+def init():
+  global _states
+  _states = collections.OrderedDict()
+
+
+def uninit():
+  global _states
+  _states = None
+
+
+def _apply_delta(rdoc, delta):
+  """Applies an incremental delta to a record, in place."""
+  for field in delta.get('unset', []):
+    rdoc.pop(field, None)
+  rdoc.update(delta.get('set', {}))
+  for field, values in delta.get('push', {}).items():
+    rdoc[field] = rdoc.get(field, []) + values
+  rdoc['rev'] = delta['rev']
+
+
+def _merge_delta(first, second):
+  """Returns a delta which has the effect of two successive deltas."""
+  if second.get('full'):
+    return second
+  if 'prev' not in second or second['prev'] != first['rev']:
+    return {'_id': second['_id'], 'rev': max(first['rev'], second['rev'])}
+  if first.get('full'):
+    rdoc = dict(first['set'])
+    _apply_delta(rdoc, second)
+    return {'_id': first['_id'], 'rev': second['rev'], 'full': True, 'set': rdoc}
+  if 'prev' not in first:
+    return {'_id': first['_id'], 'rev': second['rev']}
+  set_ = dict(first.get('set', {}))
+  unset = list(first.get('unset', []))
+  push = {field: list(values) for field, values in first.get('push', {}).items()}
+  for field in second.get('unset', []):
+    set_.pop(field, None)
+    push.pop(field, None)
+    if field not in unset:
+      unset.append(field)
+  for field, value in second.get('set', {}).items():
+    set_[field] = value
+    push.pop(field, None)
+  for field, values in second.get('push', {}).items():
+    if field in set_:
+      set_[field] = set_[field] + values
+    else:
+      push[field] = push.get(field, []) + values
+  return {'_id': first['_id'], 'rev': second['rev'], 'prev': first['prev'],
+          'set': set_, 'unset': unset, 'push': push}
+
+
+def _publish_delta(delta):
+  bus.publish_throttle('record_change', delta, delta['_id'], merge=_merge_delta)
+
+
+def _publish_update(rdoc, set_=None, unset=None, push=None):
+  """Publishes the delta of an update, given the record after it with at least _id and rev."""
+  _publish_delta({'_id': rdoc['_id'],
+                  'rev': rdoc['rev'],
+                  'prev': rdoc['rev'] - 1,
+                  'set': set_ or {},
+                  'unset': unset or [],
+                  'push': push or {}})
+
+
+def _get_priority(type, tid):
+  if type == constant.record.TYPE_PRETEST:
+    return JUDGE_PRIORITY_PRETEST
+  elif tid:
+    return JUDGE_PRIORITY_CONTEST
+  else:
+    return JUDGE_PRIORITY_SUBMISSION
+
+
+def _get_shares(domain_id, uid):
+  return [('user/{0}'.format(uid), options.judge_user_share),
+          ('domain/{0}'.format(domain_id), options.judge_domain_share)]
+
+
+async def _enqueue(rid, domain_id, uid, priority):
+  await queue.publish('judge', priority=priority, shares=_get_shares(domain_id, uid),
+                      rid=rid, enqueue_at=datetime.datetime.utcnow())
+
+
+def _state_put(rdoc):
+  _states[rdoc['_id']] = rdoc
+  _states.move_to_end(rdoc['_id'])
+  while len(_states) > options.record_state_max_entries:
+    _states.popitem(False)
+
+
+async def _fetch_state(rid):
+  future = _fetches.get(rid)
+  if not future:
+    future = _fetches[rid] = asyncio.ensure_future(get(rid, PROJECTION_PUBLIC))
+    future.add_done_callback(lambda _: _fetches.pop(rid, None))
+  rdoc = await asyncio.shield(future)
+  if not rdoc:
+    return None
+  rdoc = dict(rdoc)
+  rdoc.setdefault('rev', 0)
+  return rdoc
+
+
+async def get_state(delta):
+  """Returns the record without code after a record_change delta, or None if not found."""
+  rid = delta['_id']
+  if _states is None:
+    rdoc = await _fetch_state(rid)
+    if rdoc and delta.get('full') and rdoc['rev'] < delta['rev']:
+      rdoc = dict(delta['set'])
+    return rdoc
+  rdoc = _states.get(rid)
+  if rdoc and rdoc['rev'] >= delta['rev']:
+    _states.move_to_end(rid)
+    return dict(rdoc)
+  if delta.get('full'):
+    rdoc = dict(delta['set'])
+  elif rdoc and delta.get('prev') == rdoc['rev']:
+    rdoc = dict(rdoc)
+    _apply_delta(rdoc, delta)
+  else:
+    rdoc = await _fetch_state(rid)
+    if _states is None:
+      return rdoc
+    if not rdoc:
+      _states.pop(rid, None)
+      return None
+    current = _states.get(rid)
+    if current and current['rev'] >= rdoc['rev']:
+      return dict(current)
+  _state_put(rdoc)
+  return dict(rdoc)
+
+
+async def _get_hash(domain_id, pid, lang, code, data_id):
+  """Returns the hash of the language, code and data MD5 of a record, None if it has no data."""
+  if data_id:
+    md5 = await fs.get_md5(data_id)
+  else:
+    mdoc = await datamanifest.get(domain_id, pid)
+    md5 = mdoc['md5'] if mdoc else None
+  if not md5:
+    return None
+  return hashlib.sha256('{0}\0{1}\0'.format(lang, md5).encode() + code.encode()).hexdigest()
+
+
+def _get_reusable_query(hash):
+  begin_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=options.record_dedup_window)
+  return {'hash': hash,
+          '_id': {'$gte': objectid.ObjectId.from_datetime(begin_at)},
+          'status': {'$in': _REUSABLE_STATUSES},
+          'judge_token': {'$exists': False},
+          'judge_at': {'$exists': True}}
+
 
 @argmethod.wrap
 async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
@@ -23,6 +253,18 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
               ttype=None, tid: objectid.ObjectId=None, hidden=False):
   validator.check_lang(lang)
   coll = db.coll('record')
+  priority = _get_priority(type, tid)
+  hash, ddoc = await asyncio.gather(_get_hash(domain_id, pid, lang, code, data_id),
+                                    domain.get(domain_id))
+  dedup_policy = (ddoc or {}).get('dedup_policy', DEDUP_POLICY_NONE)
+  reuse_rid = None
+  if hash and dedup_policy != DEDUP_POLICY_NONE:
+    rdoc = await coll.find_one(_get_reusable_query(hash), sort=[('_id', -1)],
+                               projection={'_id': 1})
+    if rdoc and dedup_policy == DEDUP_POLICY_DEPRIORITIZE:
+      priority = JUDGE_PRIORITY_REJUDGE
+    elif rdoc and dedup_policy == DEDUP_POLICY_REUSE:
+      reuse_rid = rdoc['_id']
   doc = {'hidden': hidden,
          'status': constant.record.STATUS_WAITING,
          'score': 0,
@@ -36,14 +278,20 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
          'ttype': ttype,
          'tid': tid,
          'data_id': data_id,
-         'type': type}
+         'type': type,
+         'rev': 0}
+  if hash:
+    doc['hash'] = hash
+  if reuse_rid:
+    doc['reuse_rid'] = reuse_rid
   rid = (await coll.insert_one(doc)).inserted_id
-  bus.publish_throttle('record_change', doc, rid)
-  post_coros = [queue.publish('judge', rid=rid)]
+  _publish_delta({'_id': rid, 'rev': 0, 'full': True,
+                  'set': {key: value for key, value in doc.items() if key != 'code'}})
+  post_coros = [_enqueue(rid, domain_id, uid, priority), counter.inc_record()]
   if type == constant.record.TYPE_SUBMISSION:
-    post_coros.extend([problem.inc_status(domain_id, pid, uid, 'num_submit', 1),
-                       problem.inc(domain_id, pid, 'num_submit', 1),
-                       domain.inc_user(domain_id, uid, num_submit=1)])
+    post_coros.extend([problem.inc_status_buffered(domain_id, pid, uid, 'num_submit', 1),
+                       problem.inc_buffered(domain_id, pid, 'num_submit', 1),
+                       domain.inc_user_buffered(domain_id, uid, num_submit=1)])
   await asyncio.gather(*post_coros)
   return rid
 
@@ -54,25 +302,51 @@ async def get(record_id: objectid.ObjectId, fields=PROJECTION_ALL):
   return await coll.find_one(record_id, fields)
 
 
+_REJUDGE_UNSET = ['judge_uid', 'judge_token', 'judge_at', 'compiler_texts', 'judge_texts',
+                  'cases', 'rejudge_job', 'wait_ms', 'reuse_rid']
+
+
+def _rejudge_set():
+  return {'status': constant.record.STATUS_WAITING,
+          'score': 0,
+          'time_ms': 0,
+          'memory_kb': 0,
+          'rejudged': True}
+
+
 @argmethod.wrap
 async def rejudge(record_id: objectid.ObjectId, enqueue: bool=True):
   coll = db.coll('record')
+  unset = _REJUDGE_UNSET
+  set_ = _rejudge_set()
   doc = await coll.find_one_and_update(filter={'_id': record_id},
-                                       update={'$unset': {'judge_uid': '',
-                                                          'judge_token': '',
-                                                          'judge_at': '',
-                                                          'compiler_texts': '',
-                                                          'judge_texts': '',
-                                                          'cases': ''},
-                                               '$set': {'status': constant.record.STATUS_WAITING,
-                                                        'score': 0,
-                                                        'time_ms': 0,
-                                                        'memory_kb': 0,
-                                                        'rejudged': True}},
+                                       update={'$unset': {field: '' for field in unset},
+                                               '$set': set_,
+                                               '$inc': {'rev': 1}},
+                                       projection={'rev': 1, 'domain_id': 1, 'uid': 1},
                                        return_document=ReturnDocument.AFTER)
-  bus.publish_throttle('record_change', doc, doc['_id'])
+  _publish_update(doc, set_=set_, unset=unset)
   if enqueue:
-    await queue.publish('judge', rid=doc['_id'])
+    await _enqueue(doc['_id'], doc['domain_id'], doc['uid'], JUDGE_PRIORITY_REJUDGE)
+
+
+async def rejudge_multi(rejudge_job: objectid.ObjectId, **kwargs):
+  """Resets the records matching kwargs for rejudging with one update, without enqueuing them.
+
+  The records are marked with rejudge_job, so that judging them does not update the statuses
+  which the rejudge job recalculates at the end. Returns the number of records.
+  """
+  coll = db.coll('record')
+  result = await coll.update_many(kwargs,
+                                  {'$unset': {field: '' for field in _REJUDGE_UNSET},
+                                   '$set': {**_rejudge_set(), 'rejudge_job': rejudge_job},
+                                   '$inc': {'rev': 1}})
+  return result.modified_count
+
+
+async def enqueue_rejudge(rdoc):
+  """Enqueues a record reset by rejudge_multi, given at least its _id, domain_id and uid."""
+  await _enqueue(rdoc['_id'], rdoc['domain_id'], rdoc['uid'], JUDGE_PRIORITY_REJUDGE)
 
 
 @argmethod.wrap
@@ -92,6 +366,12 @@ def get_multi(get_hidden: bool=False, fields=None, **kwargs):
   return coll.find(kwargs, projection=fields)
 
 
+def get_multi_code(rids):
+  """Returns the language and code of records, fetched in batches to bound memory."""
+  return get_multi(get_hidden=True, fields={'lang': 1, 'code': 1},
+                   _id={'$in': rids}).batch_size(_CODE_BATCH_SIZE)
+
+
 @argmethod.wrap
 async def get_count(begin_id: objectid.ObjectId=None):
   coll = db.coll('record')
@@ -127,34 +407,61 @@ async def get_dict(rids, *, get_hidden=False, fields=None):
   query = {'_id': {'$in': list(set(rids))}}
   result = dict()
   async for rdoc in get_multi(**query, get_hidden=get_hidden, fields=fields):
-    result[rdoc['_id']] = rdoc
+    result[rdoc['_id']] = projection.guard(rdoc, fields)
   return result
 
 
 @argmethod.wrap
 async def begin_judge(record_id: objectid.ObjectId,
-                      judge_uid: int, judge_token: str, status: int):
+                      judge_uid: int, judge_token: str, status: int,
+                      enqueue_at: datetime.datetime=None):
+  """Assigns a waiting record to a judge, and records its wait in the queue if enqueue_at is given.
+
+  Returns None if the record is not waiting, e.g. when a message of a record which has been
+  requeued is delivered again after the connection of its old judge is closed.
+  """
   coll = db.coll('record')
-  doc = await coll.find_one_and_update(filter={'_id': record_id},
-                                       update={'$set': {'status': status,
-                                                        'judge_uid': judge_uid,
-                                                        'judge_token': judge_token,
-                                                        'judge_at': datetime.datetime.utcnow(),
-                                                        'compiler_texts': [],
-                                                        'judge_texts': [],
-                                                        'cases': [],
-                                                        'progress': 0.0}},
+  now = datetime.datetime.utcnow()
+  set_ = {'status': status,
+          'judge_uid': judge_uid,
+          'judge_token': judge_token,
+          'judge_at': now,
+          'compiler_texts': [],
+          'judge_texts': [],
+          'cases': [],
+          'progress': 0.0}
+  if enqueue_at:
+    set_['wait_ms'] = max(int((now - enqueue_at).total_seconds() * 1000), 0)
+  doc = await coll.find_one_and_update(filter={'_id': record_id,
+                                               'status': constant.record.STATUS_WAITING,
+                                               'judge_token': {'$exists': False}},
+                                       update={'$set': set_, '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
+  if doc:
+    _publish_update(doc, set_=set_)
   return doc
 
 
 async def next_judge(record_id, judge_uid, judge_token, **kwargs):
+  """Applies a $set and $push update to a record being judged.
+
+  Returns the record with only _id and rev, or None if it is not judged by the judge.
+  """
   coll = db.coll('record')
   doc = await coll.find_one_and_update(filter={'_id': record_id,
                                                'judge_uid': judge_uid,
                                                'judge_token': judge_token},
-                                       update=kwargs,
+                                       update={**kwargs, '$inc': {'rev': 1}},
+                                       projection={'rev': 1},
                                        return_document=ReturnDocument.AFTER)
+  if doc:
+    push = {}
+    for field, value in kwargs.get('$push', {}).items():
+      if isinstance(value, dict) and '$each' in value:
+        push[field] = list(value['$each'])
+      else:
+        push[field] = [value]
+    _publish_update(doc, set_=kwargs.get('$set'), push=push)
   return doc
 
 
@@ -162,19 +469,110 @@ async def next_judge(record_id, judge_uid, judge_token, **kwargs):
 async def end_judge(record_id: objectid.ObjectId, judge_uid: int, judge_token: str,
                     status: int, score: int, time_ms: int, memory_kb: int):
   coll = db.coll('record')
+  set_ = {'status': status,
+          'score': score,
+          'time_ms': time_ms,
+          'memory_kb': memory_kb}
+  unset = ['judge_token', 'progress']
   doc = await coll.find_one_and_update(filter={'_id': record_id,
                                                'judge_uid': judge_uid,
                                                'judge_token': judge_token},
-                                       update={'$set': {'status': status,
-                                                        'score': score,
-                                                        'time_ms': time_ms,
-                                                        'memory_kb': memory_kb},
-                                               '$unset': {'judge_token': '',
-                                                          'progress': ''}},
+                                       update={'$set': set_,
+                                               '$unset': {field: '' for field in unset},
+                                               '$inc': {'rev': 1}},
+                                       return_document=ReturnDocument.AFTER)
+  if doc:
+    _publish_update(doc, set_=set_, unset=unset)
+  return doc
+
+
+async def reuse_judge(rdoc, judge_uid: int, judge_token: str):
+  """Completes a record being judged with the verdict of the record named by its reuse_rid.
+
+  Returns the record, or None if the verdict is no longer reusable.
+  """
+  coll = db.coll('record')
+  src_rdoc = await coll.find_one({**_get_reusable_query(rdoc['hash']), '_id': rdoc['reuse_rid']},
+                                 projection=_REUSE_FIELDS)
+  if not src_rdoc:
+    return None
+  set_ = {field: src_rdoc.get(field, []) for field in _REUSE_FIELDS}
+  unset = ['judge_token', 'progress']
+  doc = await coll.find_one_and_update(filter={'_id': rdoc['_id'],
+                                               'judge_uid': judge_uid,
+                                               'judge_token': judge_token},
+                                       update={'$set': set_,
+                                               '$unset': {field: '' for field in unset},
+                                               '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
+  if doc:
+    _publish_update(doc, set_=set_, unset=unset)
   return doc
 
 
+async def requeue(record_id: objectid.ObjectId, judge_token: str):
+  """Takes a record back from a judge which is dead or stuck, and enqueues it again.
+
+  Returns whether the record was still judged with the token.
+  """
+  coll = db.coll('record')
+  set_ = {'status': constant.record.STATUS_WAITING}
+  unset = ['judge_token', 'progress']
+  doc = await coll.find_one_and_update(filter={'_id': record_id,
+                                               'judge_token': judge_token},
+                                       update={'$set': set_,
+                                               '$unset': {field: '' for field in unset},
+                                               '$inc': {'rev': 1}},
+                                       projection={'rev': 1, 'domain_id': 1, 'uid': 1,
+                                                   'type': 1, 'tid': 1},
+                                       return_document=ReturnDocument.AFTER)
+  if not doc:
+    return False
+  _publish_update(doc, set_=set_, unset=unset)
+  await _enqueue(doc['_id'], doc['domain_id'], doc['uid'], _get_priority(doc['type'], doc['tid']))
+  return True
+
+
+@argmethod.wrap
+async def requeue_waiting():
+  """Enqueues all waiting records again, and rebuilds the fair share counts of the judge queue.
+
+  This recovers the records whose queue messages are lost, e.g. in a broker restart or in the
+  judge queue used before priorities. Undelivered messages are purged first. Returns the number
+  of records enqueued.
+  """
+  coll = db.coll('record')
+  await queue.purge('judge')
+  counts = collections.Counter()
+  async for rdoc in coll.find({'judge_token': {'$exists': True}},
+                              projection={'domain_id': 1, 'uid': 1}):
+    for share_id, _ in _get_shares(rdoc['domain_id'], rdoc['uid']):
+      counts[share_id] += 1
+  await queue.set_shares('judge', counts)
+  count = 0
+  async for rdoc in coll.find({'status': constant.record.STATUS_WAITING,
+                               'judge_token': {'$exists': False}},
+                              projection={'domain_id': 1, 'uid': 1, 'type': 1, 'tid': 1,
+                                          'rejudged': 1}):
+    if rdoc.get('rejudged'):
+      priority = JUDGE_PRIORITY_REJUDGE
+    else:
+      priority = _get_priority(rdoc['type'], rdoc.get('tid'))
+    await _enqueue(rdoc['_id'], rdoc['domain_id'], rdoc['uid'], priority)
+    count += 1
+  return count
+
+
+def get_multi_judging(judge_token: str=None, judge_at_before: datetime.datetime=None, *,
+                      fields=None):
+  """Returns the records being judged, by a judge or since before a time."""
+  coll = db.coll('record')
+  query = {'judge_token': judge_token if judge_token else {'$exists': True}}
+  if judge_at_before:
+    query['judge_at'] = {'$lt': judge_at_before}
+  return coll.find(query, projection=fields)
+
+
 @argmethod.wrap
 async def ensure_indexes():
   coll = db.coll('record')
@@ -204,6 +602,15 @@ async def ensure_indexes():
                            ('uid', 1),
                            ('type', 1),
                            ('_id', 1)])
+  # for judge sweeper
+  await coll.create_index([('judge_token', 1),
+                           ('judge_at', 1)], sparse=True)
+  # for job rejudge
+  await coll.create_index([('rejudge_job', 1),
+                           ('_id', 1)], sparse=True)
+  # for dedup
+  await coll.create_index([('hash', 1),
+                           ('_id', -1)], sparse=True)
   # TODO(iceboy): Add more indexes.
 
 
@@ -0,0 +1,104 @@
+"""Snapshots of rendered contest scoreboards.
+
+A snapshot holds the rows of a scoreboard rendered for one view and language, stored by column:
+the header cell, the values, the type if all cells of the column share it, and the raw values
+if any cell has one. A snapshot is valid while the version of the scoreboard it was rendered from
+is unchanged, so it is simply replaced when the version changes. Only final scoreboards are stored,
+so a contest has at most one snapshot per view and language.
+"""
+import datetime
+import logging
+
+from bson import objectid
+from pymongo import errors
+
+from vj4 import db
+from vj4.util import argmethod
+
+VIEW_PAGE = 'page'
+VIEW_EXPORT = 'export'
+
+_logger = logging.getLogger(__name__)
+
+
+def _encode_rows(rows):
+  header, body = rows[0], rows[1:]
+  columns = []
+  for index, head in enumerate(header):
+    cells = [row[index] for row in body]
+    column = {'head': head, 'values': [cell['value'] for cell in cells]}
+    types = set(cell['type'] for cell in cells)
+    if len(types) <= 1:
+      column['type'] = types.pop() if types else None
+    else:
+      column['types'] = [cell['type'] for cell in cells]
+    if any('raw' in cell for cell in cells):
+      column['raws'] = [cell.get('raw') for cell in cells]
+    columns.append(column)
+  return columns
+
+
+def get_rows(sdoc, begin=0, end=None):
+  """Returns the header and the rows from begin to end (exclusive) of a snapshot."""
+  rows = [[column['head'] for column in sdoc['columns']]]
+  for index in range(sdoc['num_rows'])[begin:end]:
+    row = []
+    for column in sdoc['columns']:
+      cell = {'type': column['types'][index] if 'types' in column else column['type'],
+              'value': column['values'][index]}
+      if 'raws' in column:
+        cell['raw'] = column['raws'][index]
+      row.append(cell)
+    rows.append(row)
+  return rows
+
+
+async def get(domain_id: str, doc_type: int, tid: objectid.ObjectId, view: str, lang: str):
+  return await db.coll('contest.snapshot').find_one({'domain_id': domain_id,
+                                                     'doc_type': doc_type,
+                                                     'tid': tid,
+                                                     'view': view,
+                                                     'lang': lang})
+
+
+async def put(domain_id: str, doc_type: int, tid: objectid.ObjectId, view: str, lang: str,
+              version: str, rows):
+  """Stores the rows of a scoreboard. Returns the snapshot, which is not stored if too large."""
+  key = {'domain_id': domain_id,
+         'doc_type': doc_type,
+         'tid': tid,
+         'view': view,
+         'lang': lang}
+  sdoc = {**key,
+          'version': version,
+          'create_at': datetime.datetime.utcnow(),
+          'num_rows': len(rows) - 1,
+          'columns': _encode_rows(rows)}
+  try:
+    await db.coll('contest.snapshot').replace_one(key, sdoc, upsert=True)
+  except errors.DocumentTooLarge:
+    _logger.warning('Scoreboard of %s/%s is too large for a snapshot', domain_id, tid)
+  return sdoc
+
+
+@argmethod.wrap
+async def delete(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+  """Deletes the snapshots of a contest."""
+  result = await db.coll('contest.snapshot').delete_many({'domain_id': domain_id,
+                                                          'doc_type': doc_type,
+                                                          'tid': tid})
+  return result.deleted_count
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('contest.snapshot')
+  await coll.create_index([('domain_id', 1),
+                           ('doc_type', 1),
+                           ('tid', 1),
+                           ('view', 1),
+                           ('lang', 1)], unique=True)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
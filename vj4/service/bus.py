@@ -52,10 +52,16 @@ async def publish(key: str, value: str):
   await channel.basic_publish(bson.BSON.encode({'key': key, 'value': value}), 'bus', '')
 
 
-def publish_throttle(key, value, throttle_id, delay=.016):
+def publish_throttle(key, value, throttle_id, delay=.016, merge=None):
+  """Publishes a value after delay, replacing values published with the same throttle_id.
+
+  If merge is given, the pending value is replaced by merge(pending, value) instead.
+  """
   loop = asyncio.get_event_loop()
   if throttle_id not in _throttles:
     loop.call_later(delay, lambda: loop.create_task(publish(key, _throttles.pop(throttle_id))))
+  elif merge:
+    value = merge(_throttles[throttle_id], value)
   _throttles[throttle_id] = value
 
 
@@ -80,6 +86,58 @@ def unsubscribe(callback):
     del _subscribers[callback]
 
 
+class Router(object):
+  """Indexes listeners by their filters, so that an event value is matched against the
+  listeners which may match it instead of all listeners.
+
+  Each listener is indexed by the first index whose fields all appear in its filter, or as
+  unfiltered if there is none.
+  """
+
+  def __init__(self, indexes):
+    """Args:
+      indexes: list of tuples of fields, most selective first.
+    """
+    self.indexes = [tuple(index) for index in indexes]
+    self._listeners = {}  # listener -> (index, index key, filter)
+    self._index = {}  # (index, index key) -> set of listeners
+
+  def __len__(self):
+    return len(self._listeners)
+
+  def add(self, listener, filter):
+    """Adds a listener which matches the event values whose fields equal filter."""
+    self.remove(listener)
+    index = next((index for index in self.indexes if all(field in filter for field in index)),
+                 ())
+    key = (index, tuple(filter[field] for field in index))
+    self._listeners[listener] = (index, key, dict(filter))
+    self._index.setdefault(key, set()).add(listener)
+
+  def remove(self, listener):
+    entry = self._listeners.pop(listener, None)
+    if entry:
+      listeners = self._index[entry[1]]
+      listeners.discard(listener)
+      if not listeners:
+        del self._index[entry[1]]
+
+  def match(self, value):
+    """Returns the listeners matching the event value."""
+    result = []
+    for index in self.indexes + [()]:
+      try:
+        key = (index, tuple(value[field] for field in index))
+      except KeyError:
+        continue
+      for listener in self._index.get(key, ()):
+        filter = self._listeners[listener][2]
+        if all(field in value and value[field] == expected
+               for field, expected in filter.items()):
+          result.append(listener)
+    return result
+
+
 @argmethod.wrap
 async def tail():
   channel = await mq.channel('bus')
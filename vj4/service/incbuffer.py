@@ -0,0 +1,132 @@
+"""A write-behind buffer for $inc updates on hot counters.
+
+Increments are merged per (collection, filter) and written as one unordered bulk operation per
+collection every incbuffer_flush_ms milliseconds, or as soon as incbuffer_max_ops increments
+are buffered. Pending increments are flushed on shutdown.
+
+Readers in the same process can apply the buffered increments to a fetched document with
+apply(). Other processes see the increments only after they are flushed, and increments which
+fail to flush are logged and dropped, so buffered counters must be ones which can be
+recomputed by the jobs in vj4.job.
+
+Before init(), increments are written through immediately.
+"""
+import asyncio
+import collections
+import logging
+
+from vj4 import db
+from vj4.util import options
+
+options.define('incbuffer_flush_ms', default=200,
+               help='Milliseconds to buffer counter increments before writing them.')
+options.define('incbuffer_max_ops', default=1000,
+               help='Maximum number of counter increments to buffer before writing them.')
+
+_logger = logging.getLogger(__name__)
+
+# (coll_name, filter key) -> [filter, upsert, deltas]
+_pending = {}
+# Batches being written, still visible to apply().
+_flushing = []
+_ops = 0
+_timer = None
+_enabled = False
+
+
+def _key(coll_name, filter):
+  return coll_name, tuple(sorted(filter.items()))
+
+
+async def inc(coll_name: str, filter, deltas, *, upsert=False):
+  """Buffers an $inc update.
+
+  Args:
+    coll_name: name of the collection.
+    filter: filter of the document, which must be a flat dict with hashable values.
+    deltas: dict mapping fields to increments.
+    upsert: whether to insert the document if it does not exist.
+  """
+  global _ops, _timer
+  if not _enabled:
+    await db.coll(coll_name).update_one(filter, {'$inc': deltas}, upsert=upsert)
+    return
+  key = _key(coll_name, filter)
+  entry = _pending.get(key)
+  if not entry:
+    entry = _pending[key] = [filter, upsert, collections.Counter()]
+  entry[1] = entry[1] or upsert
+  entry[2].update(deltas)
+  _ops += 1
+  if _ops >= options.incbuffer_max_ops:
+    await flush()
+  elif not _timer:
+    _timer = asyncio.get_event_loop().call_later(options.incbuffer_flush_ms / 1000,
+                                                 _on_timer)
+
+
+def _on_timer():
+  global _timer
+  _timer = None
+  asyncio.ensure_future(flush())
+
+
+async def flush():
+  """Writes all buffered increments."""
+  global _pending, _ops, _timer
+  if _timer:
+    _timer.cancel()
+    _timer = None
+  if not _pending:
+    return
+  batch, _pending, _ops = _pending, {}, 0
+  _flushing.append(batch)
+  try:
+    bulks = {}
+    for (coll_name, _), (filter, upsert, deltas) in batch.items():
+      deltas = {field: value for field, value in deltas.items() if value}
+      if not deltas:
+        continue
+      if coll_name not in bulks:
+        bulks[coll_name] = db.coll(coll_name).initialize_unordered_bulk_op()
+      op = bulks[coll_name].find(filter)
+      if upsert:
+        op = op.upsert()
+      op.update_one({'$inc': deltas})
+    await asyncio.gather(*[bulk.execute() for bulk in bulks.values()])
+  except Exception:
+    _logger.exception('Failed to flush %d counters', len(batch))
+  finally:
+    _flushing.remove(batch)
+
+
+def get_pending(coll_name: str, filter):
+  """Returns the increments of a document which are not yet written."""
+  key = _key(coll_name, filter)
+  result = collections.Counter()
+  for batch in _flushing + [_pending]:
+    entry = batch.get(key)
+    if entry:
+      result.update(entry[2])
+  return result
+
+
+def apply(coll_name: str, filter, doc):
+  """Applies the increments which are not yet written to a fetched document, in place."""
+  if doc is None or not _enabled:
+    return doc
+  for field, value in get_pending(coll_name, filter).items():
+    if value:
+      doc[field] = doc.get(field, 0) + value
+  return doc
+
+
+def init():
+  global _enabled
+  _enabled = True
+
+
+async def uninit():
+  global _enabled
+  await flush()
+  _enabled = False
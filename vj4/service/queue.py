@@ -1,21 +1,140 @@
+"""Work queues with priorities and fair sharing.
+
+Each message has a priority from 0 to MAX_PRIORITY, and messages of a higher priority are
+delivered first. Within a priority, a message may name up to MAX_SHARES shares, each with a
+limit, e.g. the user and the domain which the message belongs to. The number of pending
+messages of each share is counted, and messages of shares which are within their limits are
+delivered before the messages of shares over their limits, so that one heavy user or domain does
+not monopolize the consumers. Consumers must acknowledge messages with ack().
+
+The pending counts are decremented on acknowledgement, so they leak if messages are lost, e.g.
+in a broker restart. They can be rebuilt with set_shares().
+"""
+import re
+import weakref
+
 import bson
+from pymongo import ReturnDocument
 
+from vj4 import db
 from vj4 import mq
 from vj4.util import options
 
 options.define('queue_prefetch', default=1, help='Queue prefetch count.')
 
+MAX_PRIORITY = 3
+MAX_SHARES = 2
+
+_LEVELS = MAX_SHARES + 1
+
+# channel -> {delivery tag: share ids}
+_deliveries = weakref.WeakKeyDictionary()
+
+
+def _queue_name(key):
+  # A new name, since the arguments of an existing queue cannot be changed.
+  return key + '.priority'
+
+
+async def _declare(channel, key):
+  await channel.queue_declare(_queue_name(key),
+                              arguments={'x-max-priority': (MAX_PRIORITY + 1) * _LEVELS - 1})
+
+
+def _share_key(key, share_id):
+  return '{0}/{1}'.format(key, share_id)
+
+
+async def _inc_share(key, share_id):
+  doc = await db.coll('queue.share').find_one_and_update(
+      filter={'_id': _share_key(key, share_id)},
+      update={'$inc': {'pending': 1}},
+      upsert=True,
+      return_document=ReturnDocument.AFTER)
+  return doc['pending']
+
+
+async def _dec_share(key, share_id):
+  # The count may have been rebuilt since the message was published, so it stays non-negative.
+  await db.coll('queue.share').update_one({'_id': _share_key(key, share_id),
+                                           'pending': {'$gt': 0}},
+                                          {'$inc': {'pending': -1}})
+
 
-async def publish(key, **kwargs):
+async def set_shares(key, counts):
+  """Replaces the pending counts of the shares of a queue.
+
+  Args:
+    key: name of the queue.
+    counts: dict mapping share id to the number of pending messages. Missing shares are set to 0.
+  """
+  coll = db.coll('queue.share')
+  await coll.delete_many({'_id': {'$regex': '^' + re.escape(key + '/')}})
+  if counts:
+    await coll.insert_many([{'_id': _share_key(key, share_id), 'pending': count}
+                            for share_id, count in counts.items()])
+
+
+async def purge(key):
+  """Removes the messages of a queue which are not delivered."""
+  channel = await mq.channel('queue')
+  await _declare(channel, key)
+  await channel.queue_purge(_queue_name(key))
+
+
+async def delete_legacy(key):
+  """Deletes the queue of the name used before priorities, with the messages in it."""
+  channel = await mq.channel('queue')
+  await channel.queue_delete(key)
+
+
+async def publish(key, *, priority=0, shares=(), **kwargs):
+  """Publishes a message.
+
+  Args:
+    key: name of the queue.
+    priority: priority of the message, from 0 to MAX_PRIORITY.
+    shares: list of (share id, limit) of the message.
+    kwargs: content of the message.
+  """
+  assert 0 <= priority <= MAX_PRIORITY
+  assert len(shares) <= MAX_SHARES
+  level = 0
+  for share_id, limit in shares:
+    if await _inc_share(key, share_id) <= limit:
+      level += 1
   channel = await mq.channel('queue')
-  await channel.queue_declare(key)
-  await channel.basic_publish(bson.BSON.encode(kwargs), '', key)
+  await _declare(channel, key)
+  await channel.basic_publish(bson.BSON.encode(kwargs), '', _queue_name(key),
+                              properties={'priority': priority * _LEVELS + level,
+                                          'headers': {'shares': [share_id
+                                                                 for share_id, _ in shares]}})
 
 
-async def consume(key, on_message):
+async def consume(key, on_message, prefetch=None):
+  """Consumes messages, at most prefetch (default queue_prefetch) unacknowledged at a time."""
   channel = await mq.channel()
-  await channel.queue_declare(key)
-  await channel.basic_qos(prefetch_count=options.queue_prefetch)
-  await channel.basic_consume((lambda channel, body, envelope, properties:
-                               on_message(envelope.delivery_tag, **bson.BSON.decode(body))), key)
+  await _declare(channel, key)
+  await set_prefetch(channel, prefetch)
+  deliveries = _deliveries[channel] = {}
+
+  def on_delivery(channel, body, envelope, properties):
+    headers = properties.headers or {}
+    deliveries[envelope.delivery_tag] = (key, headers.get('shares', []))
+    return on_message(envelope.delivery_tag, **bson.BSON.decode(body))
+
+  await channel.basic_consume(on_delivery, _queue_name(key))
   return channel
+
+
+async def set_prefetch(channel, prefetch=None):
+  """Sets the number of unacknowledged messages delivered to a consumer channel."""
+  await channel.basic_qos(prefetch_count=prefetch or options.queue_prefetch)
+
+
+async def ack(channel, tag):
+  """Acknowledges a message delivered to a consumer channel."""
+  await channel.basic_client_ack(tag)
+  key, share_ids = _deliveries.get(channel, {}).pop(tag, (None, []))
+  for share_id in share_ids:
+    await _dec_share(key, share_id)
@@ -1,31 +1,220 @@
+"""A process-local cache with namespaces, invalidated across processes through the bus.
+
+Values are frozen when stored: dicts and lists are converted to FrozenDict and FrozenList
+which raise TypeError on modification, so they can be returned to readers without copying.
+Deep copies of frozen values are plain dicts and lists.
+
+Namespaces other than the default one are only active after init(), that is, when
+invalidations from other processes are being received.
+"""
 import collections
 import copy
+import sys
+import time
 
 from vj4.service import bus
 from vj4.util import options
 
-PREFIX_DISCUSSION_NODES = 'discussion-nodes-'
-
 options.define('smallcache_max_entries', default=64,
-               help='Maximum number of entries in smallcache.')
-
-_cache = collections.OrderedDict()
+               help='Maximum number of entries in the default namespace of smallcache.')
+
+
+def _read_only(self, *args, **kwargs):
+  raise TypeError('{0} is read-only'.format(type(self).__name__))
+
+
+class FrozenDict(dict):
+  __setitem__ = __delitem__ = __ior__ = _read_only
+  clear = pop = popitem = setdefault = update = _read_only
+
+  def __copy__(self):
+    return dict(self)
+
+  def __deepcopy__(self, memo):
+    return {copy.deepcopy(k, memo): copy.deepcopy(v, memo) for k, v in self.items()}
+
+
+class FrozenList(list):
+  __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+  append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+  def __copy__(self):
+    return list(self)
+
+  def __deepcopy__(self, memo):
+    return [copy.deepcopy(v, memo) for v in self]
+
+
+def freeze(value):
+  if type(value) in (FrozenDict, FrozenList):
+    return value
+  if isinstance(value, dict):
+    return FrozenDict((k, freeze(v)) for k, v in value.items())
+  if isinstance(value, list):
+    return FrozenList(freeze(v) for v in value)
+  if type(value) is tuple:
+    return tuple(freeze(v) for v in value)
+  return value
+
+
+def _sizeof(value):
+  """Approximate memory footprint of a value in bytes."""
+  size = sys.getsizeof(value)
+  if isinstance(value, dict):
+    size += sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+  elif isinstance(value, (list, tuple, set, frozenset)):
+    size += sum(_sizeof(v) for v in value)
+  return size
+
+
+class Namespace(object):
+  def __init__(self, name, *, max_entries=None, max_bytes=None, ttl=None, enabled=True):
+    self.name = name
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.enabled = enabled
+    self.version = 0
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = collections.OrderedDict()  # key -> (value, size, expire)
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def get(self, key, default=None):
+    """Gets a frozen value. The value must not be modified."""
+    if not self.enabled:
+      return default
+    entry = self._entries.get(key)
+    if entry and entry[2] is not None and entry[2] <= time.monotonic():
+      self._remove(key)
+      entry = None
+    if not entry:
+      self.misses += 1
+      return default
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return entry[0]
+
+  def set_local(self, key, value, *, version=None):
+    """Freezes and stores a value, and returns the frozen value.
+
+    If version is given and the namespace has been invalidated since then, the value is not
+    stored since it may have been read before the invalidating write.
+    """
+    value = freeze(value)
+    if not self.enabled or (version is not None and version != self.version):
+      return value
+    self._remove(key)
+    size = _sizeof(value)
+    expire = time.monotonic() + self.ttl if self.ttl else None
+    self._entries[key] = (value, size, expire)
+    self.bytes += size
+    while self._entries and ((self.max_entries and len(self._entries) > self.max_entries)
+                             or (self.max_bytes and self.bytes > self.max_bytes)):
+      _, (_, size, _) = self._entries.popitem(False)
+      self.bytes -= size
+      self.evictions += 1
+    return value
+
+  def _remove(self, key):
+    entry = self._entries.pop(key, None)
+    if entry:
+      self.bytes -= entry[1]
+
+  def unset_local(self, key):
+    self.version += 1
+    self._remove(key)
+
+  def unset_prefix_local(self, prefix):
+    self.version += 1
+    for key in [key for key in self._entries
+                if isinstance(key, str) and key.startswith(prefix)]:
+      self._remove(key)
+
+  async def unset_global(self, key):
+    self.unset_local(key)
+    await bus.publish('smallcache-unset', {'namespace': self.name, 'key': key})
+
+  async def unset_prefix_global(self, prefix):
+    self.unset_prefix_local(prefix)
+    await bus.publish('smallcache-unset', {'namespace': self.name, 'prefix': prefix})
+
+  def clear(self):
+    self.version += 1
+    self._entries.clear()
+    self.bytes = 0
+
+  def get_stats(self):
+    return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits,
+            'misses': self.misses, 'evictions': self.evictions}
+
+
+_cache = Namespace('')
+_namespaces = {_cache.name: _cache}
+_initialized = False
+
+
+def register(name, *, max_entries=None, max_bytes=None, ttl=None):
+  """Registers a namespace.
+
+  Args:
+    name: name of the namespace, used in invalidation messages.
+    max_entries: maximum number of entries, or None for unlimited.
+    max_bytes: maximum approximate size of all values in bytes, or None for unlimited.
+    ttl: seconds before an entry expires, or None to keep it until evicted or invalidated.
+
+  Returns:
+    The Namespace object. If the namespace is already registered, for example when the module
+    registering it is reloaded, its limits are updated and the existing object is returned.
+  """
+  namespace = _namespaces.get(name)
+  if namespace is not None:
+    namespace.max_entries = max_entries
+    namespace.max_bytes = max_bytes
+    namespace.ttl = ttl
+    return namespace
+  namespace = Namespace(name, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl,
+                        enabled=_initialized)
+  _namespaces[name] = namespace
+  return namespace
+
+
+def get_stats():
+  return {name: namespace.get_stats() for name, namespace in _namespaces.items()}
 
 
 async def _on_unset(e):
-  if e['value'] in _cache:
-    del _cache[e['value']]
+  value = e['value']
+  if not isinstance(value, dict):
+    # Legacy message with a bare key in the default namespace.
+    _cache.unset_local(value)
+    return
+  namespace = _namespaces.get(value.get('namespace', ''))
+  if not namespace:
+    return
+  if 'prefix' in value:
+    namespace.unset_prefix_local(value['prefix'])
+  else:
+    namespace.unset_local(value['key'])
 
 
 def init():
+  global _initialized
+  _initialized = True
+  for namespace in _namespaces.values():
+    namespace.enabled = True
   bus.subscribe(_on_unset, ['smallcache-unset'])
 
 
 def get_direct(key, default=None):
-  if key not in _cache:
-    return default
-  _cache.move_to_end(key)
-  return _cache[key]
+  return _cache.get(key, default)
 
 
 def get(key, default=None):
@@ -33,21 +222,23 @@ def get(key, default=None):
 
 
 def set_local_direct(key, value):
-  if key in _cache:
-    del _cache[key]
-  _cache[key] = value
-  if len(_cache) > options.smallcache_max_entries:
-    _cache.popitem(False)
+  _cache.max_entries = options.smallcache_max_entries
+  _cache.set_local(key, value)
 
 
 def set_local(key, value):
-  set_local_direct(key, copy.deepcopy(value))
+  set_local_direct(key, value)
 
 
 async def unset_global(key):
-  await bus.publish('smallcache-unset', key)
+  await _cache.unset_global(key)
 
 
 def uninit():
+  global _initialized
+  _initialized = False
   bus.unsubscribe(_on_unset)
-  _cache.clear()
+  for namespace in _namespaces.values():
+    namespace.clear()
+    if namespace is not _cache:
+      namespace.enabled = False
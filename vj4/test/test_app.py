@@ -0,0 +1,46 @@
+import unittest
+
+from vj4 import app
+from vj4.model import fleet
+from vj4.model import record
+from vj4.model import system
+from vj4.model.adaptor import contest
+from vj4.model.adaptor import problem
+from vj4.service import bus
+from vj4.service import incbuffer
+from vj4.service import smallcache
+from vj4.test import base
+
+
+class ApplicationTest(base.BusTestCase):
+  async def noop(*args, **kwargs):
+    pass
+
+  def setUp(self):
+    super(ApplicationTest, self).setUp()
+    self.old_application = app.Application
+    self.old_init = bus.init
+    bus.init = ApplicationTest.noop
+    base.wait(system.set_db_version(system.EXPECTED_DB_VERSION))
+
+  def tearDown(self):
+    fleet.uninit()
+    base.wait(incbuffer.uninit())
+    record.uninit()
+    contest.uninit()
+    problem.uninit()
+    smallcache.uninit()
+    bus.init = self.old_init
+    app.Application = self.old_application
+    super(ApplicationTest, self).tearDown()
+
+  def test_init(self):
+    application = app.Application()
+    self.assertIs(app.Application(), application)
+    self.assertIsNotNone(problem._cache)
+    self.assertIsNotNone(contest._boards)
+    self.assertIsNotNone(record._states)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from vj4.service import bus
+
+
+class RouterTest(unittest.TestCase):
+  def setUp(self):
+    self.router = bus.Router([('uid',), ('domain_id', 'pid'), ('tid',)])
+    self.router.add('all', {})
+    self.router.add('uid', {'uid': 1})
+    self.router.add('uid_pid', {'uid': 1, 'domain_id': 'system', 'pid': 2})
+    self.router.add('pid', {'domain_id': 'system', 'pid': 2})
+    self.router.add('other_pid', {'domain_id': 'other', 'pid': 2})
+    self.router.add('tid', {'domain_id': 'system', 'tid': 3})
+
+  def test_match(self):
+    self.assertCountEqual(
+        self.router.match({'uid': 1, 'domain_id': 'system', 'pid': 2, 'tid': None}),
+        ['all', 'uid', 'uid_pid', 'pid'])
+    self.assertCountEqual(
+        self.router.match({'uid': 4, 'domain_id': 'system', 'pid': 2, 'tid': 3}),
+        ['all', 'pid', 'tid'])
+    self.assertCountEqual(
+        self.router.match({'uid': 1, 'domain_id': 'other', 'pid': 5, 'tid': 3}),
+        ['all', 'uid'])
+
+  def test_remove(self):
+    self.router.remove('uid')
+    self.router.remove('all')
+    self.router.remove('all')
+    self.router.add('pid', {'uid': 4})
+    self.assertEqual(len(self.router), 4)
+    self.assertCountEqual(
+        self.router.match({'uid': 1, 'domain_id': 'system', 'pid': 2, 'tid': None}),
+        ['uid_pid'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from vj4.model import container
+from vj4.model import document
+from vj4.model.adaptor import training
+from vj4.test import base
+
+DOMAIN_ID = 'dummy_domain'
+OWNER_UID = 1
+
+
+def _dag(*pids_list):
+  return [{'_id': nid, 'title': '', 'require_nids': [], 'pids': pids}
+          for nid, pids in enumerate(pids_list, 1)]
+
+
+class ContainerTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_training(self):
+    tid1 = await training.add(DOMAIN_ID, 'training 1', 'content', OWNER_UID, _dag([1, 2], [2]))
+    tid2 = await training.add(DOMAIN_ID, 'training 2', 'content', OWNER_UID, _dag([2, 3]))
+    self.assertEqual([(s['doc_id'], s['title']) for s in await container.get(DOMAIN_ID, 2)],
+                     [(tid2, 'training 2'), (tid1, 'training 1')])
+    await training.edit(DOMAIN_ID, tid1, title='renamed', dag=_dag([3]))
+    self.assertEqual(await container.get(DOMAIN_ID, 1), [])
+    self.assertEqual([s['doc_id'] for s in await container.get(DOMAIN_ID, 2)], [tid2])
+    summaries = await container.get(DOMAIN_ID, 3)
+    self.assertEqual([(s['doc_id'], s['title']) for s in summaries],
+                     [(tid2, 'training 2'), (tid1, 'renamed')])
+    self.assertEqual(summaries[0]['doc_type'], document.TYPE_TRAINING)
+
+  @base.wrap_coro
+  async def test_reset(self):
+    tid = await training.add(DOMAIN_ID, 'training', 'content', OWNER_UID, _dag([1]))
+    tdoc = await training.get(DOMAIN_ID, tid)
+    await container.set(DOMAIN_ID, document.TYPE_TRAINING, tid, [2], 'stale')
+    await container.reset(DOMAIN_ID, [(tdoc, training.get_pids(tdoc['dag']))])
+    self.assertEqual(await container.get(DOMAIN_ID, 2), [])
+    self.assertEqual([s['title'] for s in await container.get(DOMAIN_ID, 1)], ['training'])
+
+
+if __name__ == '__main__':
+  unittest.main()
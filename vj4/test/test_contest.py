@@ -1,5 +1,6 @@
 import datetime
 import functools
+import random
 import unittest
 
 from bson import objectid
@@ -9,6 +10,7 @@ from vj4 import error
 from vj4.model import document
 from vj4.model.adaptor import contest
 from vj4.test import base
+from vj4.util import options
 
 
 def _rule_test_stat(tdoc, journal):
@@ -227,6 +229,56 @@ class AssignmentRuleTest(unittest.TestCase):
     self.assertEqual(stats['detail'], [])
 
 
+class StatIncTest(unittest.TestCase):
+  """Applies random journals entry by entry as update_status does, and checks the statistics
+  against stat_func on the whole journal."""
+  def assert_stats_equal(self, stats, expected):
+    self.assertEqual(stats.keys(), expected.keys())
+    for key in expected:
+      if key == 'detail':
+        self.assertEqual(sorted(stats[key], key=lambda d: d['pid']),
+                         sorted(expected[key], key=lambda d: d['pid']))
+      else:
+        self.assertAlmostEqual(stats[key], expected[key])
+
+  def check_rule(self, rule_id, tdoc):
+    rule = contest.RULES[rule_id]
+    rng = random.Random(rule_id)
+    num_inc = 0
+    for _ in range(200):
+      journal = []
+      detail = []
+      for _ in range(rng.randint(1, 12)):
+        if journal and rng.random() < 0.2:
+          # Rejudged.
+          jdoc = {**rng.choice(journal), 'accept': rng.random() < 0.5, 'score': rng.randint(0, 100)}
+        else:
+          rid_time = NOW + datetime.timedelta(seconds=rng.randint(0, 20))
+          rid = objectid.ObjectId(objectid.ObjectId.from_datetime(rid_time).binary[:4] +
+                                  bytes(rng.randrange(256) for _ in range(8)))
+          jdoc = {'rid': rid, 'pid': rng.choice([777, 778, 779, 780]),
+                  'accept': rng.random() < 0.4, 'score': rng.randint(0, 100)}
+        journal.append(jdoc)
+        expected = rule.stat_func(tdoc, contest._get_status_journal({'journal': journal}))
+        stats = contest.STAT_INC_FUNCS[rule_id](tdoc, detail, jdoc)
+        if stats is None:
+          stats = expected
+        else:
+          num_inc += 1
+        self.assert_stats_equal(stats, expected)
+        detail = stats['detail']
+    self.assertGreater(num_inc, 0)
+
+  def test_oi(self):
+    self.check_rule(constant.contest.RULE_OI, TDOC)
+
+  def test_acm(self):
+    self.check_rule(constant.contest.RULE_ACM, TDOC)
+
+  def test_assignment(self):
+    self.check_rule(constant.contest.RULE_ASSIGNMENT, ASSDOC)
+
+
 class OuterTest(base.DatabaseTestCase):
   @base.wrap_coro
   async def test_add_get(self):
@@ -246,7 +298,7 @@ class OuterTest(base.DatabaseTestCase):
     self.assertFalse('content' in tdocs[0])
 
 
-class InnerTest(base.DatabaseTestCase):
+class InnerTest(base.BusTestCase):
   def setUp(self):
     super(InnerTest, self).setUp()
     begin_at = NOW
@@ -352,5 +404,184 @@ class InnerTest(base.DatabaseTestCase):
     del tsdoc_old['rev']
     self.assertEqual(tsdoc, tsdoc_old)
 
+class ScoreboardTest(base.BusTestCase):
+  def setUp(self):
+    super(ScoreboardTest, self).setUp()
+    contest.init()
+    self.tid = base.wait(contest.add(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, TITLE, CONTENT,
+                                     OWNER_UID, constant.contest.RULE_OI, NOW,
+                                     NOW + datetime.timedelta(seconds=22), [777, 778]))
+
+  def tearDown(self):
+    contest.uninit()
+    super(ScoreboardTest, self).tearDown()
+
+  async def get_ranked(self):
+    board = await contest.get_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    return [(rank, tsdoc['uid'], tsdoc.get('score', 0)) for rank, tsdoc in board.get_ranked()]
+
+  @base.wrap_coro
+  async def test_incremental(self):
+    for uid in [1, 2, 3]:
+      await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid)
+    self.assertEqual(await self.get_ranked(), [(1, 1, 0), (1, 2, 0), (1, 3, 0)])
+    board = await contest.get_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    version = board.version
+    await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 2,
+                                **SUBMIT_777_AC)
+    await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 3,
+                                **SUBMIT_778_AC)
+    self.assertIs(await contest.get_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid),
+                  board)
+    self.assertNotEqual(board.version, version)
+    self.assertEqual(await self.get_ranked(), [(1, 3, 33), (2, 2, 22), (3, 1, 0)])
+    self.assertEqual([tsdoc['uid'] for _, tsdoc in board.get_ranked(1, 2)], [2])
+    # Applying an older status document has no effect.
+    self.assertFalse(board.update({'uid': 3, 'rev': 1, 'score': 0}))
+    # Reloaded after the contest is edited.
+    version = board.version
+    await contest.edit(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, title='renamed')
+    board = await contest.get_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    self.assertEqual(board.tdoc['title'], 'renamed')
+    self.assertNotEqual(board.version, version)
+    self.assertEqual(await self.get_ranked(), [(1, 3, 33), (2, 2, 22), (3, 1, 0)])
+
+  @base.wrap_coro
+  async def test_ranked_around(self):
+    for uid, submit in [(1, None), (2, SUBMIT_777_AC), (3, SUBMIT_778_AC), (4, SUBMIT_777_AC)]:
+      await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid)
+      if submit:
+        await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid,
+                                    **submit)
+    board = await contest.get_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    self.assertEqual(board.get_position(4), 2)
+    self.assertEqual([(rank, tsdoc['uid']) for rank, tsdoc in board.get_ranked_around(4, 1)],
+                     [(2, 2), (2, 4), (4, 1)])
+    self.assertEqual([(rank, tsdoc['uid']) for rank, tsdoc in board.get_ranked_around(3, 1)],
+                     [(1, 3), (2, 2)])
+    self.assertIsNone(board.get_position(5))
+    self.assertEqual(board.get_ranked_around(5, 1), [])
+
+  @base.wrap_coro
+  async def test_frozen(self):
+    for uid in [1, 2]:
+      await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid)
+    await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 2,
+                                **SUBMIT_777_AC)
+    await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 1,
+                                **SUBMIT_778_AC)
+    self.assertEqual(await self.get_ranked(), [(1, 1, 33), (2, 2, 22)])
+    board = await contest.get_frozen_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                           NOW + datetime.timedelta(seconds=3))
+    self.assertEqual([(rank, tsdoc['uid'], tsdoc.get('score', 0))
+                      for rank, tsdoc in board.get_ranked()],
+                     [(1, 2, 22), (2, 1, 0)])
+    # The live scoreboard is not affected.
+    self.assertEqual(await self.get_ranked(), [(1, 1, 33), (2, 2, 22)])
+    live_board = await contest.get_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    board = await contest.get_frozen_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                           NOW + datetime.timedelta(seconds=3), live_board.version)
+    self.assertIs(await contest.get_frozen_board(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                                 NOW + datetime.timedelta(seconds=3),
+                                                 live_board.version), board)
+
+  def test_freeze_at(self):
+    handler = contest.ContestCommonOperationMixin()
+    handler.now = NOW + datetime.timedelta(seconds=1000)
+    tdoc = {'begin_at': NOW, 'end_at': NOW + datetime.timedelta(seconds=2000)}
+    begin_at = int(NOW.replace(tzinfo=datetime.timezone.utc).timestamp())
+    old_interval = options.contest_freeze_interval
+    options.contest_freeze_interval = 300
+    try:
+      self.assertEqual(handler.get_freeze_at(tdoc, 0), 0)
+      self.assertEqual(handler.get_freeze_at(tdoc, begin_at + 599), begin_at + 300)
+      self.assertEqual(handler.get_freeze_at(tdoc, begin_at + 600), begin_at + 600)
+      self.assertEqual(handler.get_freeze_at(tdoc, begin_at - 10), begin_at)
+      self.assertEqual(handler.get_freeze_at(tdoc, begin_at + 1000), 0)
+    finally:
+      options.contest_freeze_interval = old_interval
+
+  def test_rank_func(self):
+    for rule_id, rule in contest.RULES.items():
+      tsdocs = [{'uid': uid, 'rev': 1, **{field: uid % 3 for field, _ in rule.status_sort}}
+                for uid in range(10)]
+      board = contest.Scoreboard({'rule': rule_id}, tsdocs)
+      expected = list(rule.rank_func(sorted(tsdocs, key=board._key)))
+      self.assertEqual(board.get_ranked(), expected)
+
+
+class RecalcTest(base.BusTestCase):
+  def setUp(self):
+    super(RecalcTest, self).setUp()
+    self.old_chunk_size = options.contest_recalc_chunk_size
+    options.contest_recalc_chunk_size = 2
+    self.tid = base.wait(contest.add(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, TITLE, CONTENT,
+                                     OWNER_UID, constant.contest.RULE_ACM, NOW,
+                                     NOW + datetime.timedelta(seconds=22), [777, 778]))
+
+  def tearDown(self):
+    options.contest_recalc_chunk_size = self.old_chunk_size
+    contest.shutdown_recalc_executor()
+    super(RecalcTest, self).tearDown()
+
+  async def add_statuses(self):
+    for uid in range(1, 6):
+      await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid)
+      if uid != 5:
+        await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid,
+                                    **SUBMIT_777_NAC)
+        await contest.update_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, uid,
+                                    **SUBMIT_777_AC_LATE)
+
+  @base.wrap_coro
+  async def test_recalc(self):
+    await self.add_statuses()
+    _, tsdocs = await contest.get_and_list_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    progress = []
+
+    async def on_progress(done, total):
+      progress.append((done, total))
+
+    await contest.edit(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                       begin_at=NOW + datetime.timedelta(seconds=1))
+    self.assertEqual(await contest.recalc_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                                 on_progress), 4)
+    self.assertEqual(progress, [(2, 4), (4, 4)])
+    _, new_tsdocs = await contest.get_and_list_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST,
+                                                      self.tid)
+    old_revs = dict((tsdoc['uid'], tsdoc['rev']) for tsdoc in tsdocs)
+    for tsdoc in new_tsdocs:
+      if tsdoc['uid'] == 5:
+        self.assertEqual(tsdoc['rev'], old_revs[5])
+        continue
+      self.assertEqual(tsdoc['rev'], old_revs[tsdoc['uid']] + 1)
+      self.assertEqual(tsdoc['accept'], 1)
+      self.assertEqual(tsdoc['time'], 6 + 20 * 60)
+
+  @base.wrap_coro
+  async def test_recalc_parallel(self):
+    await self.add_statuses()
+    await contest.edit(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                       begin_at=NOW + datetime.timedelta(seconds=1))
+    self.assertEqual(await contest.recalc_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                                 parallel=1), 4)
+    tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 1)
+    self.assertEqual(tsdoc['accept'], 1)
+    self.assertEqual(tsdoc['time'], 6 + 20 * 60)
+
+  @base.wrap_coro
+  async def test_recalc_conflict(self):
+    await self.add_statuses()
+    tdoc = await contest.get(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 1)
+    # Computed from a revision which has changed since.
+    await contest._write_recalc(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, tdoc,
+                                [(1, tsdoc['rev'] - 1, {'accept': 0, 'time': 0})])
+    new_tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, 1)
+    self.assertEqual(new_tsdoc['rev'], tsdoc['rev'] + 1)
+    self.assertEqual(new_tsdoc['accept'], 1)
+    self.assertEqual(new_tsdoc['time'], tsdoc['time'])
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,83 @@
+import datetime
+import unittest
+
+from vj4 import db
+from vj4.model import counter
+from vj4.model import document
+from vj4.test import base
+
+DOMAIN_ID = 'dummy_domain'
+DOC_TYPE = document.TYPE_PROBLEM
+OWNER_UID = 1
+NOW = datetime.datetime(2017, 6, 15, 12, 30)
+
+
+class DocumentCountTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_add_set_delete(self):
+    doc_id = await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE)
+    await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE, hidden=True)
+    self.assertEqual(await document.count(DOMAIN_ID, DOC_TYPE), 2)
+    self.assertEqual(await document.count(DOMAIN_ID, DOC_TYPE, False), 1)
+    await document.set(DOMAIN_ID, DOC_TYPE, doc_id, hidden=True)
+    await document.set(DOMAIN_ID, DOC_TYPE, doc_id, hidden=True)
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE, False), 0)
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE, True), 2)
+    self.assertTrue(await document.delete(DOMAIN_ID, DOC_TYPE, doc_id))
+    self.assertFalse(await document.delete(DOMAIN_ID, DOC_TYPE, doc_id))
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE), 1)
+
+  @base.wrap_coro
+  async def test_seed(self):
+    # Documents which predate the counters.
+    await db.coll('document').insert_many([
+        {'domain_id': DOMAIN_ID, 'doc_type': DOC_TYPE, 'doc_id': doc_id, 'hidden': False}
+        for doc_id in range(3)])
+    await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE, hidden=True)
+    self.assertIsNone(await counter.get_document_count(DOMAIN_ID, DOC_TYPE))
+    self.assertEqual(await document.count(DOMAIN_ID, DOC_TYPE, False), 3)
+    self.assertEqual(await document.count(DOMAIN_ID, DOC_TYPE), 4)
+    await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE)
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE), 5)
+
+  @base.wrap_coro
+  async def test_recount(self):
+    await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE)
+    await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE, hidden=True)
+    await counter.inc_document(DOMAIN_ID, DOC_TYPE, False, 10)
+    await document.recount(DOMAIN_ID)
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE, False), 1)
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE, True), 1)
+    await document.delete_multi(DOMAIN_ID, DOC_TYPE)
+    self.assertEqual(await counter.get_document_count(DOMAIN_ID, DOC_TYPE), 0)
+
+
+class RecordCountTest(base.DatabaseTestCase):
+  def test_get_record_bucket(self):
+    self.assertEqual(counter.get_record_bucket(NOW, NOW),
+                     (counter.SPAN_HOUR, datetime.datetime(2017, 6, 15, 12)))
+    self.assertEqual(counter.get_record_bucket(datetime.datetime(2017, 6, 1, 8), NOW),
+                     (counter.SPAN_DAY, datetime.datetime(2017, 6, 1)))
+    self.assertEqual(counter.get_record_bucket(datetime.datetime(2016, 3, 2, 8), NOW),
+                     (counter.SPAN_MONTH, datetime.datetime(2016, 3, 1)))
+
+  @base.wrap_coro
+  async def test_inc_rollup(self):
+    now = datetime.datetime.utcnow()
+    await counter.set_record_counts({(counter.SPAN_HOUR, datetime.datetime(2000, 1, 1, 1)): 3,
+                                     (counter.SPAN_HOUR, datetime.datetime(2000, 1, 1, 2)): 4})
+    await counter.inc_record(now)
+    await counter.inc_record(now)
+    (count,), total = await counter.get_record_counts(now - datetime.timedelta(days=1))
+    self.assertEqual(count, 2)
+    self.assertEqual(total, 9)
+    await counter.rollup_records()
+    (count,), total = await counter.get_record_counts(now - datetime.timedelta(days=1))
+    self.assertEqual(count, 2)
+    self.assertEqual(total, 9)
+    (count,), _ = await counter.get_record_counts(datetime.datetime(2000, 1, 1))
+    self.assertEqual(count, 9)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from vj4.model import datamanifest
+from vj4.model import fs
+from vj4.model.adaptor import problem
+from vj4.test import base
+
+DOMAIN_ID = 'dummy_domain'
+DEST_DOMAIN_ID = 'dummy_dest_domain'
+OWNER_UID = 1
+
+
+class DataManifestTest(base.BusTestCase):
+  @base.wrap_coro
+  async def test_set_and_copy(self):
+    pid = await problem.add(DOMAIN_ID, 'title', 'content', OWNER_UID)
+    pdoc = await problem.get(DOMAIN_ID, pid)
+    dest_pid = await problem.copy(pdoc, DEST_DOMAIN_ID, OWNER_UID)
+    mdocs, cursor = await problem.get_data_list(0)
+    self.assertEqual(mdocs, [])
+    self.assertIsNone(cursor)
+    file_id = await fs.add_data('application/zip', b'data')
+    await problem.set_data(DOMAIN_ID, pid, file_id)
+    mdocs, _ = await problem.get_data_list(0)
+    self.assertEqual(sorted((mdoc['domain_id'], mdoc['pid']) for mdoc in mdocs),
+                     [(DEST_DOMAIN_ID, dest_pid), (DOMAIN_ID, pid)])
+    self.assertEqual({mdoc['md5'] for mdoc in mdocs}, {await fs.get_md5(file_id)})
+
+  @base.wrap_coro
+  async def test_pagination(self):
+    file_id = await fs.add_data('application/zip', b'data')
+    for pid in range(1, 6):
+      await problem.add(DOMAIN_ID, 'title', 'content', OWNER_UID, pid, data=file_id)
+    pids = []
+    after_at, after = 0, None
+    while True:
+      mdocs, cursor = await problem.get_data_list(0, 2, after_at, after)
+      pids.extend(mdoc['pid'] for mdoc in mdocs)
+      if not cursor:
+        break
+      after_at, after = cursor
+    self.assertEqual(sorted(pids), [1, 2, 3, 4, 5])
+
+  @base.wrap_coro
+  async def test_reset(self):
+    file_id = await fs.add_data('application/zip', b'data')
+    await datamanifest.reset(DOMAIN_ID, [(1, DOMAIN_ID, 1, await fs.get_meta(file_id))])
+    mdocs, _ = await problem.get_data_list(0)
+    self.assertEqual([(mdoc['pid'], mdoc['file_id']) for mdoc in mdocs], [(1, file_id)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+import datetime
+import unittest
+
+from vj4 import constant
+from vj4 import db
+from vj4.model import fleet
+from vj4.model import record
+from vj4.test import base
+
+DOMAIN_ID = 'system'
+PID = 1
+UID = 22
+JUDGE_UID = 1
+JUDGE_TOKEN = 'token'
+
+
+class FleetTest(base.BusTestCase, base.QueueTestCase):
+  async def add_judging(self):
+    rid = await record.add(DOMAIN_ID, PID, constant.record.TYPE_SUBMISSION, UID, 'cc', 'code')
+    await record.begin_judge(rid, JUDGE_UID, JUDGE_TOKEN, constant.record.STATUS_FETCHED)
+    await fleet.begin_judge(JUDGE_TOKEN)
+    return rid
+
+  @base.wrap_coro
+  async def test_stats(self):
+    await fleet.add(JUDGE_TOKEN, JUDGE_UID, '127.0.0.1')
+    await fleet.set_concurrency(JUDGE_TOKEN, 4)
+    await fleet.begin_judge(JUDGE_TOKEN, 10)
+    await fleet.begin_judge(JUDGE_TOKEN, 20)
+    await fleet.end_judge(JUDGE_TOKEN, 100)
+    await fleet.end_judge(JUDGE_TOKEN, 300)
+    await fleet.begin_judge(JUDGE_TOKEN, 30)
+    jdoc, = await fleet.get_all()
+    self.assertEqual(jdoc['concurrency'], 4)
+    self.assertEqual(jdoc['in_flight'], 1)
+    self.assertEqual(jdoc['average_wait_ms'], 20)
+    self.assertEqual(jdoc['num_judged'], 2)
+    self.assertEqual(jdoc['average_ms'], 200)
+    self.assertEqual(jdoc['max_ms'], 300)
+    self.assertTrue(jdoc['alive'])
+
+  @base.wrap_coro
+  async def test_wait_ms(self):
+    rid = await record.add(DOMAIN_ID, PID, constant.record.TYPE_SUBMISSION, UID, 'cc', 'code')
+    enqueue_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    rdoc = await record.begin_judge(rid, JUDGE_UID, JUDGE_TOKEN, constant.record.STATUS_FETCHED,
+                                    enqueue_at)
+    self.assertGreaterEqual(rdoc['wait_ms'], 1000)
+    await record.rejudge(rid)
+    rdoc = await record.get(rid)
+    self.assertNotIn('wait_ms', rdoc)
+
+  @base.wrap_coro
+  async def test_sweep_dead(self):
+    await fleet.add(JUDGE_TOKEN, JUDGE_UID, '127.0.0.1')
+    rid = await self.add_judging()
+    self.assertEqual(await fleet.sweep(), 0)
+    await db.coll('fleet').update_one(
+        {'_id': JUDGE_TOKEN},
+        {'$set': {'heartbeat_at': datetime.datetime.utcnow() - datetime.timedelta(hours=1)}})
+    self.assertEqual(await fleet.sweep(), 1)
+    rdoc = await record.get(rid)
+    self.assertEqual(rdoc['status'], constant.record.STATUS_WAITING)
+    self.assertNotIn('judge_token', rdoc)
+    self.assertEqual(await fleet.get_all(), [])
+
+  @base.wrap_coro
+  async def test_sweep_stuck(self):
+    await fleet.add(JUDGE_TOKEN, JUDGE_UID, '127.0.0.1')
+    rid = await self.add_judging()
+    await db.coll('record').update_one(
+        {'_id': rid},
+        {'$set': {'judge_at': datetime.datetime.utcnow() - datetime.timedelta(hours=1)}})
+    self.assertEqual(await fleet.sweep(), 1)
+    self.assertEqual(await fleet.sweep(), 0)
+    rdoc = await record.get(rid)
+    self.assertEqual(rdoc['status'], constant.record.STATUS_WAITING)
+    self.assertIsNone(await record.end_judge(rid, JUDGE_UID, JUDGE_TOKEN,
+                                             constant.record.STATUS_ACCEPTED, 100, 0, 0))
+
+
+  @base.wrap_coro
+  async def test_stale_delivery(self):
+    await fleet.add(JUDGE_TOKEN, JUDGE_UID, '127.0.0.1')
+    rid = await self.add_judging()
+    self.assertIsNone(await record.begin_judge(rid, JUDGE_UID, 'token2',
+                                               constant.record.STATUS_FETCHED))
+    await db.coll('fleet').update_one(
+        {'_id': JUDGE_TOKEN},
+        {'$set': {'heartbeat_at': datetime.datetime.utcnow() - datetime.timedelta(hours=1)}})
+    self.assertEqual(await fleet.sweep(), 1)
+    self.assertIsNotNone(await record.begin_judge(rid, JUDGE_UID, 'token2',
+                                                  constant.record.STATUS_FETCHED))
+    # The original message, delivered again when the connection of the dead judge is closed.
+    self.assertIsNone(await record.begin_judge(rid, JUDGE_UID, JUDGE_TOKEN,
+                                               constant.record.STATUS_FETCHED))
+    rdoc = await record.get(rid)
+    self.assertEqual(rdoc['judge_token'], 'token2')
+
+
+if __name__ == '__main__':
+  unittest.main()
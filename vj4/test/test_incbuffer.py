@@ -0,0 +1,60 @@
+import unittest
+
+from vj4 import db
+from vj4.model import document
+from vj4.model import domain
+from vj4.service import incbuffer
+from vj4.test import base
+
+DOMAIN_ID = 'dummy_domain'
+DOC_TYPE = document.TYPE_PROBLEM
+OWNER_UID = 1
+UID = 22
+
+
+class IncbufferTest(base.DatabaseTestCase):
+  def setUp(self):
+    super(IncbufferTest, self).setUp()
+    incbuffer.init()
+
+  def tearDown(self):
+    base.wait(incbuffer.uninit())
+    super(IncbufferTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_inc_flush(self):
+    doc_id = await document.add(DOMAIN_ID, 'content', OWNER_UID, DOC_TYPE, num_submit=0)
+    await document.inc_buffered(DOMAIN_ID, DOC_TYPE, doc_id, 'num_submit', 1)
+    await document.inc_buffered(DOMAIN_ID, DOC_TYPE, doc_id, 'num_submit', 2)
+    await domain.inc_user_buffered(DOMAIN_ID, UID, num_submit=1)
+    doc = await db.coll('document').find_one({'domain_id': DOMAIN_ID, 'doc_id': doc_id})
+    self.assertEqual(doc['num_submit'], 0)
+    self.assertEqual(document.apply_buffered(doc)['num_submit'], 3)
+    self.assertEqual((await domain.get_user(DOMAIN_ID, UID))['num_submit'], 1)
+    await incbuffer.flush()
+    doc = await document.get(DOMAIN_ID, DOC_TYPE, doc_id)
+    self.assertEqual(doc['num_submit'], 3)
+    self.assertEqual(document.apply_buffered(doc)['num_submit'], 3)
+    self.assertEqual((await domain.get_user(DOMAIN_ID, UID))['num_submit'], 1)
+
+  @base.wrap_coro
+  async def test_status_upsert(self):
+    await document.inc_status_buffered(DOMAIN_ID, DOC_TYPE, 1, UID, 'num_submit', 1)
+    await document.inc_status_buffered(DOMAIN_ID, DOC_TYPE, 1, UID, 'num_submit', -1)
+    await document.inc_status_buffered(DOMAIN_ID, DOC_TYPE, 2, UID, 'num_submit', 1)
+    await incbuffer.flush()
+    self.assertIsNone(await document.get_status(DOMAIN_ID, DOC_TYPE, 1, UID))
+    sdoc = await document.get_status(DOMAIN_ID, DOC_TYPE, 2, UID)
+    self.assertEqual(sdoc['num_submit'], 1)
+
+
+class WriteThroughTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_inc(self):
+    await domain.inc_user_buffered(DOMAIN_ID, UID, num_submit=1)
+    dudoc = await db.coll('domain.user').find_one({'domain_id': DOMAIN_ID, 'uid': UID})
+    self.assertEqual(dudoc['num_submit'], 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,11 +1,14 @@
+import asyncio
 import unittest
 
 from vj4 import constant
+from vj4 import db
 from vj4 import job
 from vj4.model import domain
 from vj4.model import record
 from vj4.model.adaptor import problem
 from vj4.test import base
+from vj4.util import options
 
 DOMAIN_ID = 'system'
 OWNER_UID = 20
@@ -121,6 +124,78 @@ class RecordTest(RecordTestCase):
     self.assertEqual(dudoc['num_accept'], 0)
 
 
+class RejudgeTest(RecordTestCase):
+  def setUp(self):
+    super(RejudgeTest, self).setUp()
+    self.old_rate = options.rejudge_rate
+    self.old_poll_interval = options.rejudge_poll_interval
+    options.rejudge_rate = 1000.0
+    options.rejudge_poll_interval = 0.01
+
+  def tearDown(self):
+    options.rejudge_rate = self.old_rate
+    options.rejudge_poll_interval = self.old_poll_interval
+    super(RejudgeTest, self).tearDown()
+
+  async def judge_all(self, job_id):
+    async for rdoc in record.get_all_multi(rejudge_job=job_id, fields={'_id': 1}):
+      await record.begin_judge(rdoc['_id'], JUDGE_UID, JUDGE_TOKEN,
+                               constant.record.STATUS_JUDGING)
+      await record.end_judge(rdoc['_id'], JUDGE_UID, JUDGE_TOKEN,
+                             constant.record.STATUS_WRONG_ANSWER, 0, 1000, 1024)
+
+  @base.wrap_coro
+  async def test_problem(self):
+    await self.init_record()
+    await job.record.run(DOMAIN_ID)
+    task = asyncio.ensure_future(job.rejudge.problem(DOMAIN_ID, self.pid2))
+    while True:
+      jdoc = await db.coll('job.rejudge').find_one()
+      if jdoc and jdoc['status'] == job.rejudge.STATUS_JUDGING:
+        break
+      await asyncio.sleep(0.01)
+    self.assertEqual(jdoc['total'], 5)
+    self.assertEqual(jdoc['enqueued'], 5)
+    await self.judge_all(jdoc['_id'])
+    self.assertEqual(await task, jdoc['_id'])
+    jdoc = await job.rejudge.get(jdoc['_id'])
+    self.assertEqual(jdoc['status'], job.rejudge.STATUS_DONE)
+    self.assertEqual(jdoc['judged'], 5)
+    pdoc = await problem.get(DOMAIN_ID, self.pid2, UID)
+    self.assertEqual(pdoc['num_submit'], 5)
+    self.assertEqual(pdoc['num_accept'], 0)
+    self.assertEqual(pdoc['psdoc']['status'], constant.record.STATUS_WRONG_ANSWER)
+    pdoc = await problem.get(DOMAIN_ID, self.pid1, UID)
+    self.assertEqual(pdoc['psdoc']['status'], constant.record.STATUS_ACCEPTED)
+
+  @base.wrap_coro
+  async def test_resume(self):
+    await self.init_record()
+    await job.record.run(DOMAIN_ID)
+    # A job interrupted after resetting its records, before enqueuing them.
+    job_id = (await db.coll('job.rejudge').insert_one({'kind': 'problem',
+                                                       'args': [DOMAIN_ID, self.pid2],
+                                                       'status': job.rejudge.STATUS_ENQUEUING,
+                                                       'total': 0,
+                                                       'enqueued': 0,
+                                                       'judged': 0})).inserted_id
+    await record.rejudge_multi(job_id, domain_id=DOMAIN_ID, pid=self.pid2,
+                               type=constant.record.TYPE_SUBMISSION)
+    task = asyncio.ensure_future(job.rejudge.finish(job_id))
+    while True:
+      jdoc = await job.rejudge.get(job_id)
+      if jdoc['status'] == job.rejudge.STATUS_JUDGING:
+        break
+      await asyncio.sleep(0.01)
+    self.assertEqual(jdoc['total'], 5)
+    self.assertEqual(jdoc['enqueued'], 5)
+    await self.judge_all(job_id)
+    self.assertEqual(await task, job_id)
+    jdoc = await job.rejudge.get(job_id)
+    self.assertEqual(jdoc['status'], job.rejudge.STATUS_DONE)
+    self.assertEqual(jdoc['judged'], 5)
+
+
 class RpTest(RecordTestCase):
   @base.wrap_coro
   async def test_recalc(self):
@@ -201,6 +276,7 @@ class RpTest(RecordTestCase):
     dudoc = await domain.get_user(DOMAIN_ID, UID2)
     self.assertEqual(dudoc['rp'], rp_p1u2)
     # rejudge to WA
+    await record.rejudge(self.rid_p2_ac, False)
     await record.begin_judge(self.rid_p2_ac, JUDGE_UID, JUDGE_TOKEN,
                              constant.record.STATUS_JUDGING)
     await record.end_judge(self.rid_p2_ac, JUDGE_UID, JUDGE_TOKEN,
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from vj4 import error
+from vj4.model import builtin
+from vj4.model import domain
+from vj4.model import loader
+from vj4.model import user
+from vj4.model.adaptor import problem
+from vj4.test import base
+
+UID = 22
+UNAME = 'twd2'
+UID2 = 23
+UNAME2 = 'iceboy'
+UID_NOT_EXIST = 10000
+DOMAIN_ID = 'dummy_domain'
+OWNER_UID = 1
+ROLE = 'foo'
+
+
+class LoaderTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_user(self):
+    await user.add(UID, UNAME, '123456', 'twd2@vijos.org')
+    await user.add(UID2, UNAME2, '123456', 'iceboy@vijos.org')
+    l = loader.Loader()
+    udoc, udoc2, udoc3, guest = await asyncio.gather(l.get_user(UID), l.get_user(UID2),
+                                                     l.get_user(UID_NOT_EXIST),
+                                                     l.get_user(builtin.UID_GUEST))
+    self.assertEqual(udoc['uname'], UNAME)
+    self.assertEqual(udoc2['uname'], UNAME2)
+    self.assertIsNone(udoc3)
+    self.assertEqual(guest['_id'], builtin.UID_GUEST)
+    self.assertNotIn('hash', udoc)
+    self.assertIs(await l.get_user(UID), udoc)
+
+  @base.wrap_coro
+  async def test_no_memoize(self):
+    await user.add(UID, UNAME, '123456', 'twd2@vijos.org')
+    l = loader.Loader(memoize=False)
+    udoc = await l.get_user(UID)
+    self.assertEqual(udoc['uname'], UNAME)
+    self.assertIsNot(await l.get_user(UID), udoc)
+
+  @base.wrap_coro
+  async def test_domain_user(self):
+    await domain.add_user_role(DOMAIN_ID, UID, ROLE)
+    l = loader.Loader()
+    dudoc, dudoc2 = await asyncio.gather(l.get_domain_user(DOMAIN_ID, UID),
+                                         l.get_domain_user(DOMAIN_ID, UID2))
+    self.assertEqual(dudoc['role'], ROLE)
+    self.assertIsNone(dudoc2)
+
+  @base.wrap_coro
+  async def test_problem(self):
+    pid = await problem.add(DOMAIN_ID, 'title', 'content', OWNER_UID)
+    l = loader.Loader()
+    pdoc = await l.get_problem(DOMAIN_ID, pid)
+    self.assertEqual(pdoc['title'], 'title')
+    with self.assertRaises(error.ProblemNotFoundError):
+      await l.get_problem(DOMAIN_ID, 10000)
+
+
+if __name__ == '__main__':
+  unittest.main()
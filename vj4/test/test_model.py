@@ -126,8 +126,27 @@ class DocumentTest(base.DatabaseTestCase):
     with self.assertRaises(pymongo_errors.DuplicateKeyError):
       await document.capped_inc_status(DOMAIN_ID, DOC_TYPE, doc_id, OWNER_UID, STATUS_KEY, 1)
 
-
-class DomainTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_get_dict_status_multi(self):
+    doc_id = await document.add(DOMAIN_ID, CONTENT, OWNER_UID, DOC_TYPE)
+    doc_id2 = await document.add(DOMAIN_ID, CONTENT, OWNER_UID, document.TYPE_TRAINING)
+    await document.inc_status(DOMAIN_ID, DOC_TYPE, doc_id, UID, STATUS_KEY, 1)
+    await document.inc_status(DOMAIN_ID, document.TYPE_TRAINING, doc_id2, UID, STATUS_KEY, 2)
+    await document.inc_status(DOMAIN_ID, DOC_TYPE, doc_id, OWNER_UID, STATUS_KEY, 3)
+    sdict = await document.get_dict_status_multi(
+        DOMAIN_ID, UID, [(DOC_TYPE, [doc_id]),
+                         (document.TYPE_TRAINING, [doc_id2]),
+                         (document.TYPE_CONTEST, [])])
+    self.assertEqual(sdict[DOC_TYPE][doc_id][STATUS_KEY], 1)
+    self.assertEqual(sdict[document.TYPE_TRAINING][doc_id2][STATUS_KEY], 2)
+    self.assertEqual(sdict[document.TYPE_CONTEST], {})
+    ddict = await document.get_dict_multi(
+        DOMAIN_ID, [(DOC_TYPE, [doc_id]), (document.TYPE_TRAINING, [doc_id2])])
+    self.assertEqual(ddict[DOC_TYPE][doc_id]['doc_id'], doc_id)
+    self.assertEqual(ddict[document.TYPE_TRAINING][doc_id2]['doc_id'], doc_id2)
+
+
+class DomainTest(base.SmallcacheTestCase):
   @base.wrap_coro
   async def test_add_get_transfer(self):
     inserted_id = await domain.add(DOMAIN_ID, OWNER_UID, ROLES, name=DOMAIN_NAME)
@@ -326,6 +345,22 @@ class DomainTest(base.DatabaseTestCase):
     self.assertTrue(FOO_ROLE not in ddoc['roles'])
     self.assertEqual(ddoc['roles'][BAR_ROLE], 666)
 
+  @base.wrap_coro
+  async def test_get_cached(self):
+    await domain.add(DOMAIN_ID, OWNER_UID, ROLES, name=DOMAIN_NAME)
+    ddoc = await domain.get(DOMAIN_ID)
+    self.assertIs(await domain.get(DOMAIN_ID), ddoc)
+    with self.assertRaises(TypeError):
+      ddoc['name'] = DOMAIN_NAME
+    roles = domain.get_all_roles(ddoc)
+    self.assertIs(domain.get_all_roles(ddoc), roles)
+    self.assertEqual(roles[FOO_ROLE], 777)
+    await domain.edit(DOMAIN_ID, name='edited')
+    await domain.set_roles(DOMAIN_ID, {FOO_ROLE: 666})
+    ddoc = await domain.get(DOMAIN_ID)
+    self.assertEqual(ddoc['name'], 'edited')
+    self.assertEqual(domain.get_all_roles(ddoc)[FOO_ROLE], 666)
+
 
 class FsTest(base.DatabaseTestCase):
   CONTENT = b'dummy_content'
@@ -0,0 +1,17 @@
+import unittest
+
+from vj4.util import options
+
+
+class Test(unittest.TestCase):
+  def test_redefine(self):
+    options.define('test_redefine_int', default=7, help='Test option.')
+    options.define('test_redefine_int', default=7, help='Test option.')
+    self.assertEqual(options.test_redefine_int, 7)
+    options.define('test_redefine_bool', default=True, help='Test option.')
+    options.define('test_redefine_bool', default=True, help='Test option.')
+    self.assertTrue(options.test_redefine_bool)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from vj4 import error
+from vj4.model.adaptor import problem
+from vj4.test import base
+from vj4.util import pagination
+
+DOMAIN_ID = 'dummy_domain'
+TITLE = 'dummy_title'
+CONTENT = 'dummy_content'
+UID = 22
+NUM_PROBLEMS = 23
+PAGE_SIZE = 5
+SORT = [('doc_id', 1)]
+
+
+class CursorTest(unittest.TestCase):
+  def test_encode_decode(self):
+    cursor = pagination.encode_cursor(3, -1, [7, 'a'])
+    self.assertEqual(pagination.decode_cursor(cursor), (3, -1, [7, 'a']))
+
+  def test_invalid(self):
+    with self.assertRaises(error.ValidationError):
+      pagination.decode_cursor('invalid')
+    with self.assertRaises(error.ValidationError):
+      pagination.decode_cursor(pagination.encode_cursor(3, 0, [7]))
+
+
+class PaginateTest(base.SmallcacheTestCase):
+  async def add_problems(self):
+    for pid in range(1000, 1000 + NUM_PROBLEMS):
+      await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, pid)
+
+  async def paginate(self, page, cursor=''):
+    return await pagination.paginate(problem.get_multi, SORT, page, PAGE_SIZE, cursor,
+                                     domain_id=DOMAIN_ID)
+
+  @base.wrap_coro
+  async def test_pages(self):
+    await self.add_problems()
+    expected = list(range(1000, 1000 + NUM_PROBLEMS))
+    num_pages = (NUM_PROBLEMS + PAGE_SIZE - 1) // PAGE_SIZE
+    for page in range(1, num_pages + 2):
+      pdocs, ppcount, pcount, _ = await self.paginate(page)
+      self.assertEqual(ppcount, num_pages)
+      self.assertEqual(pcount, NUM_PROBLEMS)
+      self.assertEqual([pdoc['doc_id'] for pdoc in pdocs],
+                       expected[(page - 1) * PAGE_SIZE:page * PAGE_SIZE])
+
+  @base.wrap_coro
+  async def test_cursors(self):
+    await self.add_problems()
+    expected = list(range(1000, 1000 + NUM_PROBLEMS))
+    page, cursor = 1, ''
+    while True:
+      pdocs, ppcount, _, cursors = await self.paginate(page, cursor)
+      self.assertEqual([pdoc['doc_id'] for pdoc in pdocs],
+                       expected[(page - 1) * PAGE_SIZE:page * PAGE_SIZE])
+      if page == ppcount:
+        break
+      page, cursor = page + 1, cursors[page + 1]
+    while page > 1:
+      page, cursor = page - 1, cursors[page - 1]
+      pdocs, _, _, cursors = await self.paginate(page, cursor)
+      self.assertEqual([pdoc['doc_id'] for pdoc in pdocs],
+                       expected[(page - 1) * PAGE_SIZE:page * PAGE_SIZE])
+
+  @base.wrap_coro
+  async def test_stale_count(self):
+    await self.add_problems()
+    await self.paginate(1)
+    for pid in range(1000 + NUM_PROBLEMS, 1000 + NUM_PROBLEMS + 2):
+      await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, pid)
+    expected = list(range(1000, 1000 + NUM_PROBLEMS + 2))
+    page = (NUM_PROBLEMS + PAGE_SIZE - 1) // PAGE_SIZE
+    pdocs, _, pcount, _ = await self.paginate(page)
+    self.assertEqual(pcount, NUM_PROBLEMS)
+    self.assertEqual([pdoc['doc_id'] for pdoc in pdocs],
+                     expected[(page - 1) * PAGE_SIZE:page * PAGE_SIZE])
+
+  @base.wrap_coro
+  async def test_invalid_page(self):
+    with self.assertRaises(error.ValidationError):
+      await self.paginate(0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,8 +1,10 @@
 import unittest
 
 from vj4 import error
+from vj4.model import document
 from vj4.model.adaptor import problem
 from vj4.test import base
+from vj4.util import options
 
 DOMAIN_ID = 'dummy_domain'
 TITLE = 'dummy_title'
@@ -97,5 +99,67 @@ class ProblemSolutionTest(base.DatabaseTestCase):
     self.assertEqual(psdoc['reply'][0]['owner_uid'], UID)
 
 
+class ProblemCacheTest(base.BusTestCase):
+  def setUp(self):
+    super(ProblemCacheTest, self).setUp()
+    self.old_counter_ttl = options.problem_counter_ttl
+    problem.init()
+
+  def tearDown(self):
+    problem.uninit()
+    options.problem_counter_ttl = self.old_counter_ttl
+    super(ProblemCacheTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_get_copy(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    pdoc['title'] = TITLE + '_modified'
+    pdoc['tag'].append('dummy_tag')
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['title'], TITLE)
+    self.assertEqual(pdoc['tag'], [])
+
+  @base.wrap_coro
+  async def test_edit(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['content'], CONTENT)
+    await problem.edit(DOMAIN_ID, PID, content=CONTENT2)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['content'], CONTENT2)
+    await problem.set_hidden(DOMAIN_ID, PID, True)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertTrue(pdoc['hidden'])
+
+  @base.wrap_coro
+  async def test_remote_change(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    await problem.get(DOMAIN_ID, PID)
+    await document.set(DOMAIN_ID, document.TYPE_PROBLEM, PID, content=CONTENT2)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['content'], CONTENT)
+    await problem.invalidate(DOMAIN_ID)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['content'], CONTENT2)
+
+  @base.wrap_coro
+  async def test_counter(self):
+    options.problem_counter_ttl = 3600
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    await problem.get(DOMAIN_ID, PID)
+    await problem.inc(DOMAIN_ID, PID, 'num_submit', 1)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['num_submit'], 1)
+    await document.inc(DOMAIN_ID, document.TYPE_PROBLEM, PID, 'num_accept', 1)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['num_accept'], 0)
+    options.problem_counter_ttl = 0
+    await problem.inc(DOMAIN_ID, PID, 'num_submit', 1)
+    pdoc = await problem.get(DOMAIN_ID, PID)
+    self.assertEqual(pdoc['num_submit'], 2)
+    self.assertEqual(pdoc['num_accept'], 1)
+
+
 if __name__ == '__main__':
   unittest.main()
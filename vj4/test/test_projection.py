@@ -0,0 +1,43 @@
+import copy
+import unittest
+
+from vj4.util import projection
+
+FIELDS = {'doc_id': 1, 'title': 1, 'dag.pids': 1}
+
+
+class ProjectionTest(unittest.TestCase):
+  def setUp(self):
+    projection.enabled = True
+
+  def tearDown(self):
+    projection.enabled = False
+
+  def test_is_projected(self):
+    self.assertTrue(projection.is_projected(None, 'content'))
+    self.assertTrue(projection.is_projected(FIELDS, '_id'))
+    self.assertTrue(projection.is_projected(FIELDS, 'title'))
+    self.assertTrue(projection.is_projected(FIELDS, 'dag'))
+    self.assertFalse(projection.is_projected(FIELDS, 'content'))
+    self.assertFalse(projection.is_projected({'_id': 0, 'title': 1}, '_id'))
+    self.assertTrue(projection.is_projected({'code': 0}, 'status'))
+    self.assertFalse(projection.is_projected({'code': 0}, 'code'))
+
+  def test_guard(self):
+    doc = projection.guard({'doc_id': 1}, FIELDS)
+    self.assertEqual(doc['doc_id'], 1)
+    self.assertIsNone(doc.get('title'))
+    with self.assertRaises(projection.ProjectionError):
+      doc['content']
+    with self.assertRaises(projection.ProjectionError):
+      doc.get('content', '')
+    self.assertEqual(copy.deepcopy(doc), {'doc_id': 1})
+
+  def test_disabled(self):
+    projection.enabled = False
+    doc = {'doc_id': 1}
+    self.assertIs(projection.guard(doc, FIELDS), doc)
+
+
+if __name__ == '__main__':
+  unittest.main()
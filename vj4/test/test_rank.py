@@ -0,0 +1,47 @@
+import bisect
+import random
+import unittest
+
+from vj4.util import rank
+
+
+class RankIndexTest(unittest.TestCase):
+  def test_ranked(self):
+    index = rank.RankIndex([(3, 'a'), (1, 'b'), (2, 'c'), (2, 'd'), (2, 'e')], tie_len=1)
+    self.assertEqual(list(index.ranked()),
+                     [(1, (1, 'b')), (2, (2, 'c')), (2, (2, 'd')), (2, (2, 'e')), (5, (3, 'a'))])
+    self.assertEqual(list(index.ranked(2, 4)), [(2, (2, 'd')), (2, (2, 'e'))])
+    self.assertEqual(index.rank((2, 'e')), 2)
+    self.assertEqual(index.index((2, 'e')), 3)
+    self.assertEqual(index[-1], (3, 'a'))
+    index.remove((1, 'b'))
+    self.assertEqual(index.rank((2, 'e')), 1)
+    self.assertRaises(ValueError, index.remove, (1, 'b'))
+    self.assertRaises(ValueError, index.rank, (1, 'b'))
+    self.assertRaises(IndexError, index.__getitem__, 4)
+
+  def test_random(self):
+    rng = random.Random(22)
+    for tie_len, equ_func in [(None, lambda a, b: False), (1, lambda a, b: a[0] == b[0])]:
+      index = rank.RankIndex(tie_len=tie_len)
+      keys = []
+      for _ in range(1000):
+        if keys and rng.random() < 0.4:
+          key = keys.pop(rng.randrange(len(keys)))
+          index.remove(key)
+        else:
+          key = (rng.randint(0, 10), rng.random())
+          bisect.insort(keys, key)
+          index.insert(key)
+      self.assertEqual(list(index), keys)
+      expected = list(rank.ranked(keys, equ_func))
+      self.assertEqual(list(index.ranked()), expected)
+      for position, key in enumerate(keys):
+        self.assertEqual(index[position], key)
+        self.assertEqual(index.rank(key), expected[position][0])
+        self.assertEqual(list(index.ranked(position - 2, position + 3)),
+                         expected[max(position - 2, 0):position + 3])
+
+
+if __name__ == '__main__':
+  unittest.main()
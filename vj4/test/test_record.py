@@ -0,0 +1,141 @@
+import functools
+import unittest
+
+from vj4 import constant
+from vj4.model import domain
+from vj4.model import fs
+from vj4.model import record
+from vj4.test import base
+
+DOMAIN_ID = 'system'
+PID = 1
+UID = 22
+JUDGE_UID = 0
+JUDGE_TOKEN = 'token'
+RID = 'dummy_rid'
+DEDUP_DOMAIN_ID = 'dedup'
+
+CASE = {'status': 1, 'score': 10, 'time_ms': 1, 'memory_kb': 1, 'judge_text': ''}
+DELTAS = [
+  {'_id': RID, 'rev': 0, 'full': True, 'set': {'_id': RID, 'status': 0, 'score': 0, 'rev': 0}},
+  {'_id': RID, 'rev': 1, 'prev': 0, 'set': {'status': 20, 'cases': [], 'progress': 0.0},
+   'unset': [], 'push': {}},
+  {'_id': RID, 'rev': 2, 'prev': 1, 'set': {'progress': 50.0}, 'unset': [],
+   'push': {'cases': [CASE]}},
+  {'_id': RID, 'rev': 3, 'prev': 2, 'set': {}, 'unset': [], 'push': {'cases': [CASE, CASE]}},
+  {'_id': RID, 'rev': 4, 'prev': 3, 'set': {'status': 1, 'score': 100}, 'unset': ['progress'],
+   'push': {}},
+  {'_id': RID, 'rev': 5, 'prev': 4, 'set': {'status': 0}, 'unset': ['cases'], 'push': {}},
+]
+
+
+def _apply_all(rdoc, deltas):
+  for delta in deltas:
+    record._apply_delta(rdoc, delta)
+  return rdoc
+
+
+class DeltaTest(unittest.TestCase):
+  def test_apply(self):
+    rdoc = _apply_all(dict(DELTAS[0]['set']), DELTAS[1:5])
+    self.assertEqual(rdoc, {'_id': RID, 'status': 1, 'score': 100, 'rev': 4,
+                            'cases': [CASE, CASE, CASE]})
+
+  def test_merge(self):
+    for begin in range(len(DELTAS)):
+      for end in range(begin + 1, len(DELTAS) + 1):
+        merged = functools.reduce(record._merge_delta, DELTAS[begin:end])
+        self.assertEqual(merged['rev'], DELTAS[end - 1]['rev'])
+        if begin == 0:
+          self.assertEqual(merged['set'], _apply_all(dict(DELTAS[0]['set']), DELTAS[1:end]))
+        else:
+          base_rdoc = _apply_all(dict(DELTAS[0]['set']), DELTAS[1:begin])
+          self.assertEqual(_apply_all(dict(base_rdoc), [merged]),
+                           _apply_all(dict(base_rdoc), DELTAS[begin:end]))
+
+  def test_merge_gap(self):
+    merged = record._merge_delta(DELTAS[1], DELTAS[3])
+    self.assertEqual(merged, {'_id': RID, 'rev': 3})
+
+
+class RecordStateTest(base.BusTestCase, base.QueueTestCase):
+  def setUp(self):
+    super(RecordStateTest, self).setUp()
+    record.init()
+
+  def tearDown(self):
+    record.uninit()
+    super(RecordStateTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_get_state(self):
+    rid = await record.add(DOMAIN_ID, PID, constant.record.TYPE_SUBMISSION, UID, 'cc', 'code')
+    rdoc = await record.get_state({'_id': rid, 'rev': 0})
+    self.assertNotIn('code', rdoc)
+    self.assertEqual(rdoc['rev'], 0)
+    await record.begin_judge(rid, JUDGE_UID, JUDGE_TOKEN, constant.record.STATUS_JUDGING)
+    await record.next_judge(rid, JUDGE_UID, JUDGE_TOKEN, **{'$push': {'cases': {'$each': [CASE]}}})
+    # Missed the delta of rev 1, fetched.
+    rdoc = await record.get_state({'_id': rid, 'rev': 2, 'prev': 1,
+                                   'push': {'cases': [CASE]}})
+    self.assertEqual(rdoc['rev'], 2)
+    self.assertEqual(rdoc['cases'], [CASE])
+    # Applied to the cached state.
+    rdoc = await record.get_state({'_id': rid, 'rev': 3, 'prev': 2,
+                                   'push': {'cases': [CASE]}})
+    self.assertEqual(rdoc['rev'], 3)
+    self.assertEqual(rdoc['cases'], [CASE, CASE])
+    # Already applied.
+    rdoc = await record.get_state({'_id': rid, 'rev': 2})
+    self.assertEqual(rdoc['rev'], 3)
+
+
+class DedupTest(base.BusTestCase, base.QueueTestCase):
+  async def add_judged(self, data_id, status, code='code'):
+    rid = await record.add(DEDUP_DOMAIN_ID, PID, constant.record.TYPE_PRETEST, UID, 'cc', code,
+                           data_id)
+    await record.begin_judge(rid, JUDGE_UID, JUDGE_TOKEN, constant.record.STATUS_FETCHED)
+    await record.end_judge(rid, JUDGE_UID, JUDGE_TOKEN, status, 100, 1, 1)
+    return rid
+
+  @base.wrap_coro
+  async def test_reuse(self):
+    await domain.add(DEDUP_DOMAIN_ID, UID, name='dedup')
+    await domain.edit(DEDUP_DOMAIN_ID, dedup_policy=record.DEDUP_POLICY_REUSE)
+    data_id = await fs.add_data('application/zip', b'data')
+    rid = await self.add_judged(data_id, constant.record.STATUS_ACCEPTED)
+    rdoc = await record.get(rid)
+    self.assertNotIn('reuse_rid', rdoc)
+    new_rid = await record.add(DEDUP_DOMAIN_ID, PID, constant.record.TYPE_PRETEST, UID, 'cc',
+                               'code', data_id)
+    rdoc = await record.get(new_rid)
+    self.assertEqual(rdoc['reuse_rid'], rid)
+    rdoc = await record.begin_judge(new_rid, JUDGE_UID, JUDGE_TOKEN,
+                                    constant.record.STATUS_FETCHED)
+    rdoc = await record.reuse_judge(rdoc, JUDGE_UID, JUDGE_TOKEN)
+    self.assertEqual(rdoc['status'], constant.record.STATUS_ACCEPTED)
+    self.assertEqual(rdoc['score'], 100)
+    self.assertNotIn('judge_token', rdoc)
+    # Different code.
+    other_rid = await record.add(DEDUP_DOMAIN_ID, PID, constant.record.TYPE_PRETEST, UID, 'cc',
+                                 'other code', data_id)
+    self.assertNotIn('reuse_rid', await record.get(other_rid))
+
+  @base.wrap_coro
+  async def test_no_reuse(self):
+    await domain.add(DEDUP_DOMAIN_ID, UID, name='dedup')
+    data_id = await fs.add_data('application/zip', b'data')
+    await self.add_judged(data_id, constant.record.STATUS_ACCEPTED)
+    rid = await record.add(DEDUP_DOMAIN_ID, PID, constant.record.TYPE_PRETEST, UID, 'cc', 'code',
+                           data_id)
+    self.assertNotIn('reuse_rid', await record.get(rid))
+    # System errors are not reused.
+    await domain.edit(DEDUP_DOMAIN_ID, dedup_policy=record.DEDUP_POLICY_REUSE)
+    await self.add_judged(data_id, constant.record.STATUS_SYSTEM_ERROR, 'bad code')
+    rid = await record.add(DEDUP_DOMAIN_ID, PID, constant.record.TYPE_PRETEST, UID, 'cc',
+                           'bad code', data_id)
+    self.assertNotIn('reuse_rid', await record.get(rid))
+
+
+if __name__ == '__main__':
+  unittest.main()
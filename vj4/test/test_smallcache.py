@@ -1,3 +1,4 @@
+import copy
 import unittest
 
 from vj4.service import smallcache
@@ -82,5 +83,75 @@ class OnlineTest(base.SmallcacheTestCase):
     self.assertIsNone(smallcache.get(0))
 
 
+class NamespaceTest(unittest.TestCase):
+  def setUp(self):
+    self.cache = smallcache.Namespace('test', max_entries=4)
+
+  def test_frozen(self):
+    value = self.cache.set_local('a', {'b': [1, {'c': 2}]})
+    self.assertIs(self.cache.get('a'), value)
+    with self.assertRaises(TypeError):
+      value['d'] = 3
+    with self.assertRaises(TypeError):
+      value['b'].append(3)
+    with self.assertRaises(TypeError):
+      value['b'][1]['c'] = 3
+    thawed = copy.deepcopy(value)
+    self.assertEqual(thawed, {'b': [1, {'c': 2}]})
+    thawed['b'][1]['c'] = 3
+    self.assertEqual(value['b'][1]['c'], 2)
+
+  def test_max_bytes(self):
+    self.cache.max_bytes = 1000
+    self.cache.set_local('a', 'x' * 400)
+    self.cache.set_local('b', 'x' * 400)
+    self.assertLessEqual(self.cache.bytes, 1000)
+    self.cache.set_local('c', 'x' * 400)
+    self.assertLessEqual(self.cache.bytes, 1000)
+    self.assertIsNone(self.cache.get('a'))
+    self.assertEqual(self.cache.get('c'), 'x' * 400)
+    self.assertEqual(self.cache.evictions, 1)
+
+  def test_ttl(self):
+    self.cache.ttl = -1
+    self.cache.set_local('a', 1)
+    self.assertIsNone(self.cache.get('a'))
+    self.assertEqual(self.cache.bytes, 0)
+
+  def test_stats(self):
+    self.cache.set_local('a', 1)
+    self.cache.get('a')
+    self.cache.get('b')
+    stats = self.cache.get_stats()
+    self.assertEqual(stats['entries'], 1)
+    self.assertEqual(stats['hits'], 1)
+    self.assertEqual(stats['misses'], 1)
+
+  def test_version(self):
+    version = self.cache.version
+    self.cache.unset_local('a')
+    self.cache.set_local('a', 1, version=version)
+    self.assertIsNone(self.cache.get('a'))
+
+  def test_unset_prefix(self):
+    self.cache.set_local('a-1', 1)
+    self.cache.set_local('a-2', 2)
+    self.cache.set_local('b-1', 3)
+    self.cache.unset_prefix_local('a-')
+    self.assertIsNone(self.cache.get('a-1'))
+    self.assertIsNone(self.cache.get('a-2'))
+    self.assertEqual(self.cache.get('b-1'), 3)
+
+
+class RegisterTest(unittest.TestCase):
+  def tearDown(self):
+    smallcache._namespaces.pop('test-register', None)
+
+  def test_register_twice(self):
+    namespace = smallcache.register('test-register', max_entries=4)
+    self.assertIs(smallcache.register('test-register', max_entries=8), namespace)
+    self.assertEqual(namespace.max_entries, 8)
+
+
 if __name__ == '__main__':
   unittest.main()
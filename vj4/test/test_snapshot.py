@@ -0,0 +1,49 @@
+import unittest
+
+from bson import objectid
+
+from vj4.model import snapshot
+from vj4.test import base
+
+DOMAIN_ID = 'system'
+DOC_TYPE = 30
+TID = objectid.ObjectId()
+ROWS = [[{'type': 'rank', 'value': 'Rank'},
+         {'type': 'user', 'value': 'User'},
+         {'type': 'problem_detail', 'value': '#1', 'raw': {'doc_id': 1000, 'title': 'A+B'}}],
+        [{'type': 'string', 'value': 1},
+         {'type': 'user', 'value': 'alice', 'raw': {'_id': 2, 'uname': 'alice'}},
+         {'type': 'record', 'value': 100, 'raw': objectid.ObjectId()}],
+        [{'type': 'string', 'value': 2},
+         {'type': 'user', 'value': 'bob', 'raw': {'_id': 3, 'uname': 'bob'}},
+         {'type': 'string', 'value': '-'}]]
+
+
+class RowsTest(unittest.TestCase):
+  def test_encode(self):
+    sdoc = {'num_rows': 2, 'columns': snapshot._encode_rows(ROWS)}
+    self.assertEqual(sdoc['columns'][0], {'head': ROWS[0][0], 'values': [1, 2], 'type': 'string'})
+    self.assertEqual(snapshot.get_rows(sdoc, 0, 1), ROWS[:2])
+    rows = snapshot.get_rows(sdoc)
+    self.assertEqual(rows[:2], ROWS[:2])
+    self.assertEqual(rows[2][2], {**ROWS[2][2], 'raw': None})
+
+
+class SnapshotTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_put_get(self):
+    await snapshot.put(DOMAIN_ID, DOC_TYPE, TID, snapshot.VIEW_PAGE, 'en', 'v1', ROWS)
+    sdoc = await snapshot.get(DOMAIN_ID, DOC_TYPE, TID, snapshot.VIEW_PAGE, 'en')
+    self.assertEqual(sdoc['version'], 'v1')
+    self.assertEqual(snapshot.get_rows(sdoc, 1),
+                     [ROWS[0], ROWS[2][:2] + [{**ROWS[2][2], 'raw': None}]])
+    self.assertIsNone(await snapshot.get(DOMAIN_ID, DOC_TYPE, TID, snapshot.VIEW_EXPORT, 'en'))
+    await snapshot.put(DOMAIN_ID, DOC_TYPE, TID, snapshot.VIEW_PAGE, 'en', 'v2', ROWS[:1])
+    sdoc = await snapshot.get(DOMAIN_ID, DOC_TYPE, TID, snapshot.VIEW_PAGE, 'en')
+    self.assertEqual(sdoc['version'], 'v2')
+    self.assertEqual(snapshot.get_rows(sdoc), ROWS[:1])
+    self.assertEqual(await snapshot.delete(DOMAIN_ID, DOC_TYPE, TID), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,34 @@
+import io
+import unittest
+import zipfile
+
+from vj4.test import base
+from vj4.util import zipstream
+
+
+class _Stream(object):
+  def __init__(self):
+    self.chunks = []
+
+  async def write(self, data):
+    self.chunks.append(data)
+
+
+class ZipWriterTest(unittest.TestCase):
+  @base.wrap_coro
+  async def test_write(self):
+    stream = _Stream()
+    zip_writer = zipstream.ZipWriter(stream)
+    await zip_writer.writestr('a.cc', 'int main() {}\n' * 100)
+    self.assertEqual(len(stream.chunks), 1)
+    await zip_writer.writestr('b.py', 'print(1)\n')
+    await zip_writer.close()
+    zip_file = zipfile.ZipFile(io.BytesIO(b''.join(stream.chunks)))
+    self.assertIsNone(zip_file.testzip())
+    self.assertEqual([zip_info.filename for zip_info in zip_file.infolist()], ['a.cc', 'b.py'])
+    self.assertEqual(zip_file.read('b.py'), b'print(1)\n')
+    self.assertEqual({zip_info.create_system for zip_info in zip_file.infolist()}, {0})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,47 @@
+import logging
+
+from vj4.job import container
+from vj4.job import counter
+from vj4.job import datamanifest
+from vj4.model import builtin
+from vj4.model import domain
+from vj4.model import record
+from vj4.model import system
+from vj4.service import queue
+from vj4.util import argmethod
+
+
+_logger = logging.getLogger(__name__)
+
+
+@argmethod.wrap
+async def run():
+  lock = await system.acquire_upgrade_lock()
+  try:
+    await system.ensure_db_version(1)
+
+    # seed record counters, document counters are seeded when first read
+    _logger.info('Counting records...')
+    await counter.records()
+
+    # build the index from problems to their contests, homework and trainings, and the manifest
+    # of problem data
+    ddocs = builtin.DOMAINS + await domain.get_multi(fields={'_id': 1}).to_list()
+    for ddoc in ddocs:
+      _logger.info('Updating domain {0}...'.format(ddoc['_id']))
+      await container.rebuild(ddoc['_id'])
+      await datamanifest.rebuild(ddoc['_id'])
+
+    # move waiting records from the judge queue used before priorities
+    _logger.info('Requeueing waiting records...')
+    await queue.delete_legacy('judge')
+    _logger.info('Requeued {0} records'.format(await record.requeue_waiting()))
+
+    _logger.info('Bumping database version...')
+    await system.set_db_version(2)
+  finally:
+    await system.release_upgrade_lock(lock)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -9,6 +9,9 @@ class Options(object):
   _dirty = False
 
   def define(self, name, default=None, help=None):
+    if any(action.dest == name for action in self._parser._actions):
+      # Already defined by an earlier load of the module, e.g. by tools.ensure_all_indexes.
+      return
     flag_name = '--' + name.replace('_', '-')
     flag_type = type(default)
     if flag_type is bool:
@@ -1,13 +1,132 @@
-import asyncio
+"""Keyset (continuation) pagination.
+
+Instead of skipping (page - 1) * page_size documents, a page is fetched relative to the sort
+key of a document on an adjacent page, which is encoded in an opaque cursor token. The sort
+must uniquely identify a document and should match an index, so that both directions are
+range scans on the index.
+
+Jumping to a page without a cursor falls back to skip. Total counts are cached for
+pagination_count_ttl seconds and may be approximate, as may a count function backed by
+maintained counters (see vj4.model.counter), so the skip walks from the end of the list only when
+the count has just been taken.
+"""
+import base64
+
+import bson
+
 from vj4 import error
+from vj4.service import smallcache
+from vj4.util import options
+from vj4.util import projection
+
+options.define('pagination_count_ttl', default=60,
+               help='Seconds to cache total counts of paginated lists.')
+
+_count_cache = smallcache.register('pagination-count', max_entries=4096)
+
+
+def encode_cursor(page, direction, values):
+  data = bson.BSON.encode({'p': page, 'd': direction, 'k': values})
+  return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+  """Decodes a cursor token into (page, direction, values)."""
+  try:
+    doc = bson.BSON(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))).decode()
+    page, direction, values = doc['p'], doc['d'], doc['k']
+  except Exception:
+    raise error.ValidationError('cursor') from None
+  if direction not in (1, -1) or type(values) is not list:
+    raise error.ValidationError('cursor')
+  return page, direction, values
+
+
+def _reverse(sort):
+  return [(key, -order) for key, order in sort]
+
+
+def _keyset_condition(sort, values, direction):
+  """Condition for documents strictly after (1) or before (-1) the key in sort order."""
+  conditions = []
+  for i, (key, order) in enumerate(sort):
+    condition = {k: v for (k, _), v in zip(sort[:i], values[:i])}
+    condition[key] = {'$gt' if order * direction > 0 else '$lt': values[i]}
+    conditions.append(condition)
+  return {'$or': conditions}
+
+
+async def _get_page(get_multi, query, sort, direction, skip, limit, fields):
+  if limit <= 0:
+    return []
+  if fields is not None:
+    query = {**query, 'fields': fields}
+  docs = await get_multi(**query).sort(sort if direction > 0 else _reverse(sort)) \
+                                 .skip(skip) \
+                                 .limit(limit) \
+                                 .to_list()
+  if direction < 0:
+    docs.reverse()
+  return projection.guard_all(docs, fields)
+
+
+async def _count(get_multi, query):
+  """Returns (count, exact). The count is not exact if it is taken from the cache."""
+  key = (repr(get_multi), bson.BSON.encode(query))
+  count = _count_cache.get(key)
+  if count is not None:
+    return count, False
+  count = await get_multi(**query).count()
+  _count_cache.ttl = options.pagination_count_ttl
+  _count_cache.set_local(key, count)
+  return count, True
+
+
+async def paginate(get_multi, sort, page: int, page_size: int, cursor: str='', *,
+                   fields=None, count_func=None, **query):
+  """Gets a page of documents.
 
+  Args:
+    get_multi: function which takes the query as keyword arguments and returns a cursor.
+    sort: list of (key, order) which uniquely identifies a document.
+    page: page number, starting from 1.
+    page_size: number of documents per page.
+    cursor: cursor token of the page, as returned by a previous call, or empty.
+    fields: projection of the documents, which must include the sort keys.
+    count_func: coroutine function which takes the query as keyword arguments and returns the
+        number of documents, or None to count with get_multi.
+    query: the query.
 
-async def paginate(cursor, page: int, page_size: int):
+  Returns:
+    Tuple of (page_docs, num_pages, count, cursors). cursors maps the numbers of the adjacent
+    pages to their cursor tokens.
+  """
   if page <= 0:
     raise error.ValidationError('page')
-  count, page_docs = await asyncio.gather(cursor.count(),
-                                          cursor.skip((page - 1) * page_size) \
-                                                .limit(page_size) \
-                                                .to_list())
+  if count_func:
+    count, exact = await count_func(**query), False
+  else:
+    count, exact = await _count(get_multi, query)
   num_pages = (count + page_size - 1) // page_size
-  return page_docs, num_pages, count
+  page_docs = None
+  if cursor:
+    cursor_page, direction, values = decode_cursor(cursor)
+    if cursor_page == page and len(values) == len(sort):
+      keyset_query = {**query, '$and': query.get('$and', []) +
+                                       [_keyset_condition(sort, values, direction)]}
+      page_docs = await _get_page(get_multi, keyset_query, sort, direction, 0, page_size,
+                                  fields)
+  if page_docs is None:
+    offset = (page - 1) * page_size
+    if not exact or offset * 2 <= count:
+      page_docs = await _get_page(get_multi, query, sort, 1, offset, page_size, fields)
+    else:
+      skip = max(count - offset - page_size, 0)
+      page_docs = await _get_page(get_multi, query, sort, -1, skip, count - offset - skip,
+                                  fields)
+  cursors = {}
+  if page_docs:
+    if page > 1:
+      cursors[page - 1] = encode_cursor(page - 1, -1, [page_docs[0].get(k) for k, _ in sort])
+    cursors[page + 1] = encode_cursor(page + 1, 1, [page_docs[-1].get(k) for k, _ in sort])
+  return page_docs, num_pages, count, cursors
@@ -0,0 +1,58 @@
+"""Guards documents fetched with a projection profile.
+
+When enabled (in debug mode), guarded documents raise ProjectionError when a field excluded by
+the projection is read, so that a template or handler which needs a field outside the profile
+fails loudly instead of rendering it as missing. ProjectionError is deliberately not a
+LookupError, which jinja2 would silently turn into an undefined value.
+"""
+
+enabled = False
+
+
+class ProjectionError(Exception):
+  pass
+
+
+def is_projected(fields, key):
+  """Returns whether the top-level field is returned by the projection."""
+  if fields is None:
+    return True
+  if key == '_id':
+    return bool(fields.get('_id', 1))
+  inclusive = any(value for name, value in fields.items() if name != '_id')
+  if not inclusive:
+    return bool(fields.get(key, 1))
+  prefix = key + '.'
+  return any(value and (name == key or name.startswith(prefix))
+             for name, value in fields.items())
+
+
+class ProjectedDict(dict):
+  def __init__(self, doc, fields):
+    super(ProjectedDict, self).__init__(doc)
+    self.fields = fields
+
+  def _check(self, key):
+    if not dict.__contains__(self, key) and not is_projected(self.fields, key):
+      raise ProjectionError('{0} is not in the projection {1}'.format(key, self.fields))
+
+  def __getitem__(self, key):
+    self._check(key)
+    return super(ProjectedDict, self).__getitem__(key)
+
+  def get(self, key, default=None):
+    self._check(key)
+    return super(ProjectedDict, self).get(key, default)
+
+  def __copy__(self):
+    return ProjectedDict(self, self.fields)
+
+
+def guard(doc, fields):
+  if not enabled or doc is None or fields is None:
+    return doc
+  return ProjectedDict(doc, fields)
+
+
+def guard_all(docs, fields):
+  return [guard(doc, fields) for doc in docs]
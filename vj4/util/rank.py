@@ -1,3 +1,6 @@
+import random
+
+
 def ranked(diter, equ_func=lambda a, b: a == b):
   last_doc = None
   r = 0
@@ -10,6 +13,144 @@ def ranked(diter, equ_func=lambda a, b: a == b):
     yield (r, doc)
 
 
+class _Node(object):
+  __slots__ = ('key', 'next', 'width')
+
+  def __init__(self, key, level, width=1):
+    self.key = key
+    self.next = [None] * level
+    # Number of positions skipped by following next, counting the end as one past the last key.
+    self.width = [width] * level
+
+
+class RankIndex(object):
+  """A sorted list of distinct keys with O(log n) insert, remove, rank and k-th queries.
+
+  The keys are kept in an indexable skip list. Keys which share their first tie_len items share
+  the rank of the first of them, as ranked with an equ_func comparing those items. If tie_len is
+  None, keys are ranked by their positions.
+  """
+  MAX_LEVEL = 32
+
+  def __init__(self, keys=(), tie_len=None):
+    self.tie_len = tie_len
+    self._head = _Node(None, self.MAX_LEVEL)
+    self._level = 1
+    self._size = 0
+    for key in keys:
+      self.insert(key)
+
+  def __len__(self):
+    return self._size
+
+  def __iter__(self):
+    node = self._head.next[0]
+    while node:
+      yield node.key
+      node = node.next[0]
+
+  def _search(self, key):
+    """Returns the last node before key at each level, and their positions from 1."""
+    nodes = [None] * self._level
+    positions = [0] * self._level
+    node = self._head
+    position = 0
+    for i in reversed(range(self._level)):
+      while node.next[i] and node.next[i].key < key:
+        position += node.width[i]
+        node = node.next[i]
+      nodes[i] = node
+      positions[i] = position
+    return nodes, positions
+
+  def _node_at(self, index):
+    node = self._head
+    position = 0
+    for i in reversed(range(self._level)):
+      while node.next[i] and position + node.width[i] <= index + 1:
+        position += node.width[i]
+        node = node.next[i]
+    return node
+
+  def insert(self, key):
+    nodes, positions = self._search(key)
+    level = 1
+    while level < self.MAX_LEVEL and random.random() < 0.5:
+      level += 1
+    for i in range(self._level, level):
+      self._head.width[i] = self._size + 1
+      nodes.append(self._head)
+      positions.append(0)
+    self._level = max(self._level, level)
+    new_node = _Node(key, level)
+    for i in range(self._level):
+      if i < level:
+        new_node.next[i] = nodes[i].next[i]
+        nodes[i].next[i] = new_node
+        new_node.width[i] = nodes[i].width[i] - (positions[0] - positions[i])
+        nodes[i].width[i] = positions[0] + 1 - positions[i]
+      else:
+        nodes[i].width[i] += 1
+    self._size += 1
+
+  def remove(self, key):
+    nodes, _ = self._search(key)
+    node = nodes[0].next[0]
+    if not node or node.key != key:
+      raise ValueError(key)
+    for i in range(self._level):
+      if nodes[i].next[i] is node:
+        nodes[i].width[i] += node.width[i] - 1
+        nodes[i].next[i] = node.next[i]
+      else:
+        nodes[i].width[i] -= 1
+    self._size -= 1
+
+  def bisect_left(self, key):
+    """Returns the number of keys less than key."""
+    _, positions = self._search(key)
+    return positions[0]
+
+  def index(self, key):
+    """Returns the position of key from 0."""
+    nodes, positions = self._search(key)
+    node = nodes[0].next[0]
+    if not node or node.key != key:
+      raise ValueError(key)
+    return positions[0]
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += self._size
+    if not 0 <= index < self._size:
+      raise IndexError(index)
+    return self._node_at(index).key
+
+  def rank(self, key):
+    """Returns the rank of key from 1."""
+    if self.tie_len is None:
+      return self.index(key) + 1
+    self.index(key)
+    return self.bisect_left(key[:self.tie_len]) + 1
+
+  def ranked(self, begin=0, end=None):
+    """Yields (rank, key) of the keys from position begin to end (exclusive)."""
+    begin = max(begin, 0)
+    end = self._size if end is None else min(end, self._size)
+    if begin >= end:
+      return
+    node = self._node_at(begin)
+    r = self.rank(node.key)
+    for position in range(begin, end):
+      if self.tie_len is None:
+        r = position + 1
+      elif position != begin and node.key[:self.tie_len] != last_key[:self.tie_len]:
+        r = position + 1
+      yield (r, node.key)
+      last_key = node.key
+      node = node.next[0]
+
+
 if __name__ == '__main__':
   for r, v in ranked(sorted([1, 2, 2, 2, 2, 3, 3, 3, 4, 5, 6])):
     print(r, v)
@@ -0,0 +1,51 @@
+"""Zip files written to an asynchronous stream entry by entry.
+
+Only the entry being written and its compressed bytes are held in memory. The zip file is
+written without seeking, with a data descriptor after each entry.
+"""
+import time
+import zipfile
+
+
+class _Buffer(object):
+  # Has no tell(), so that zipfile writes without seeking.
+  def __init__(self):
+    self.chunks = []
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def pop(self):
+    data = b''.join(self.chunks)
+    self.chunks = []
+    return data
+
+
+class ZipWriter(object):
+  def __init__(self, stream):
+    """Creates a zip file written to stream, which has a coroutine write(data)."""
+    self.stream = stream
+    self.buffer = _Buffer()
+    self.zip_file = zipfile.ZipFile(self.buffer, 'w', zipfile.ZIP_DEFLATED)
+
+  async def writestr(self, name, data):
+    zip_info = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    zip_info.compress_type = zipfile.ZIP_DEFLATED
+    zip_info.external_attr = 0o600 << 16
+    # mark all files as created in Windows :p
+    zip_info.create_system = 0
+    self.zip_file.writestr(zip_info, data)
+    await self._drain()
+
+  async def close(self):
+    self.zip_file.close()
+    await self._drain()
+
+  async def _drain(self):
+    data = self.buffer.pop()
+    if data:
+      await self.stream.write(data)